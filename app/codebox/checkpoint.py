@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from app.codebox.localbox import CustomLocalBox
+
+# NOTE: the names ipython puts into the namespace, not to be checkpointed
+_EXCLUDED_NAMES = ("In", "Out", "get_ipython", "exit", "quit")
+# NOTE: used as a directory name under the root
+_CHECKPOINT_ID = re.compile(r"[A-Za-z0-9_-]+")
+
+# NOTE: run in the kernel, defined as a function not to leave names behind
+_SAVE_FUNCTION = """\
+def _codebox_checkpoint(path, max_variable_bytes, max_total_bytes, excluded):
+    import json, os, pickle, types
+
+    try:
+        import cloudpickle as pickler
+    except ImportError:
+        try:
+            import dill as pickler
+        except ImportError:
+            pickler = pickle
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    def dump(name, value):
+        file = os.path.join(path, name)
+        if pd is not None and isinstance(value, pd.DataFrame):
+            try:
+                value.to_parquet(file + ".parquet")
+                return "parquet", name + ".parquet"
+            except Exception:
+                pass  # NOTE: e.g. no pyarrow or mixed object columns, then pickle
+        data = pickler.dumps(value)
+        if len(data) > max_variable_bytes:
+            raise ValueError(f"too large to checkpoint ({len(data)} bytes)")
+        with open(file + ".pkl", "wb") as f:
+            f.write(data)
+        return "pickle", name + ".pkl"
+
+    os.makedirs(path, exist_ok=True)
+    manifest = dict(pickler=pickler.__name__, modules={}, variables={}, skipped={})
+    total_bytes = 0
+    for name, value in list(globals().items()):
+        if name.startswith("_") or name in excluded:
+            continue
+        if isinstance(value, types.ModuleType):
+            manifest["modules"][name] = value.__name__
+            continue
+        try:
+            fmt, file = dump(name, value)
+        except Exception as e:
+            manifest["skipped"][name] = f"{type(e).__name__}: {e}"
+            continue
+        n_bytes = os.path.getsize(os.path.join(path, file))
+        if n_bytes > max_variable_bytes or total_bytes + n_bytes > max_total_bytes:
+            os.remove(os.path.join(path, file))
+            manifest["skipped"][name] = f"too large to checkpoint ({n_bytes} bytes)"
+            continue
+        total_bytes += n_bytes
+        manifest["variables"][name] = dict(format=fmt, file=file, bytes=n_bytes)
+
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+"""
+
+_RESTORE_FUNCTION = """\
+def _codebox_restore(path, result_path):
+    import importlib, json, os
+
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    pickler = importlib.import_module(manifest["pickler"])
+
+    namespace = globals()
+    failed = {}
+    for name, module in manifest["modules"].items():
+        try:
+            namespace[name] = importlib.import_module(module)
+        except ImportError as e:
+            failed[name] = f"{type(e).__name__}: {e}"
+    for name, entry in manifest["variables"].items():
+        file = os.path.join(path, entry["file"])
+        try:
+            if entry["format"] == "parquet":
+                import pandas as pd
+
+                namespace[name] = pd.read_parquet(file)
+            else:
+                with open(file, "rb") as f:
+                    namespace[name] = pickler.load(f)
+        except Exception as e:
+            failed[name] = f"{type(e).__name__}: {e}"
+
+    with open(result_path, "w") as f:
+        json.dump(dict(failed=failed), f)
+"""
+
+
+@dataclass
+class CheckpointInfo:
+    checkpoint_id: str
+    path: str
+    modules: dict[str, str] = field(default_factory=dict)
+    variables: list[str] = field(default_factory=list)
+    skipped: dict[str, str] = field(default_factory=dict)  # NOTE: name -> reason
+    n_bytes: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class KernelCheckpointer:
+    """Save / restore the kernel namespace and the working directory on disk
+
+    The variables are pickled by cloudpickle (or dill, pickle) in the kernel,
+    the dataframes are saved as parquet. The variables over the size limits
+    or not picklable are skipped, the modules are imported again on restore.
+    """
+
+    def __init__(
+        self,
+        root: str = ".checkpoints",
+        max_variable_bytes: int = 1 << 28,
+        max_total_bytes: int = 1 << 30,
+        timeout: float = 60 * 5,
+    ) -> None:
+        self.root: str = os.path.abspath(root)
+        self.max_variable_bytes: int = max_variable_bytes
+        self.max_total_bytes: int = max_total_bytes
+        self.timeout: float = timeout  # NOTE: seconds to save / restore the kernel
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def is_valid_id(checkpoint_id: str) -> bool:
+        return _CHECKPOINT_ID.fullmatch(checkpoint_id) is not None
+
+    def path(self, checkpoint_id: str) -> str:
+        if not self.is_valid_id(checkpoint_id):
+            raise ValueError(
+                f"Invalid checkpoint id: {checkpoint_id!r} (expected [A-Za-z0-9_-]+)"
+            )
+        return os.path.join(self.root, checkpoint_id)
+
+    def _manifest_path(self, checkpoint_id: str) -> str:
+        return os.path.join(self.path(checkpoint_id), "namespace", "manifest.json")
+
+    def exists(self, checkpoint_id: str) -> bool:
+        return os.path.exists(self._manifest_path(checkpoint_id))
+
+    def list(self) -> list[str]:
+        return sorted(
+            entry.name
+            for entry in os.scandir(self.root)
+            if self.is_valid_id(entry.name) and self.exists(entry.name)
+        )
+
+    def delete(self, checkpoint_id: str) -> None:
+        shutil.rmtree(self.path(checkpoint_id), ignore_errors=True)
+
+    def info(self, checkpoint_id: str) -> CheckpointInfo:
+        manifest_path = self._manifest_path(checkpoint_id)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return CheckpointInfo(
+            checkpoint_id=checkpoint_id,
+            path=self.path(checkpoint_id),
+            modules=manifest["modules"],
+            variables=list(manifest["variables"]),
+            skipped=manifest["skipped"],
+            n_bytes=sum(v["bytes"] for v in manifest["variables"].values()),
+            created_at=os.path.getmtime(manifest_path),
+        )
+
+    def save(self, box: CustomLocalBox, checkpoint_id: str) -> CheckpointInfo:
+        """Checkpoint the kernel of the box, overwriting the same id"""
+        path = self.path(checkpoint_id)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        output = box.run_function(
+            _SAVE_FUNCTION,
+            os.path.join(tmp_path, "namespace"),
+            self.max_variable_bytes,
+            self.max_total_bytes,
+            _EXCLUDED_NAMES,
+            timeout=self.timeout,
+        )
+        if output.type == "error":
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise RuntimeError(f"Failed to checkpoint the kernel: {output.content}")
+        shutil.copytree(box.workdir, os.path.join(tmp_path, "workdir"))
+
+        # NOTE: replace the previous checkpoint once completed
+        self.delete(checkpoint_id)
+        os.replace(tmp_path, path)
+        return self.info(checkpoint_id)
+
+    def restore(self, box: CustomLocalBox, checkpoint_id: str) -> CheckpointInfo:
+        """Restore the checkpoint into the kernel of the box, e.g. a fresh one"""
+        if not self.exists(checkpoint_id):
+            raise FileNotFoundError(f"No checkpoint: {checkpoint_id}")
+        path = self.path(checkpoint_id)
+        shutil.copytree(os.path.join(path, "workdir"), box.workdir, dirs_exist_ok=True)
+
+        # NOTE: the result is written outside, the checkpoint may be read-only
+        fd, result_path = tempfile.mkstemp(prefix="codebox-restore-", suffix=".json")
+        os.close(fd)
+        try:
+            output = box.run_function(
+                _RESTORE_FUNCTION,
+                os.path.join(path, "namespace"),
+                result_path,
+                timeout=self.timeout,
+            )
+            if output.type == "error":
+                raise RuntimeError(f"Failed to restore the kernel: {output.content}")
+            with open(result_path) as f:
+                failed: dict[str, str] = json.load(f)["failed"]
+        finally:
+            os.remove(result_path)
+
+        info = self.info(checkpoint_id)
+        info.variables = [name for name in info.variables if name not in failed]
+        info.skipped.update(failed)
+        return info
+
+    def stats(self) -> dict:
+        checkpoint_ids = self.list()
+        return dict(
+            n_checkpoints=len(checkpoint_ids),
+            total_bytes=sum(self.info(c).n_bytes for c in checkpoint_ids),
+        )
@@ -0,0 +1,216 @@
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from app.codebox.localbox import CustomLocalBox
+
+# NOTE: run in the kernel, writes the index as json to the path
+_INTROSPECT_FUNCTION = """\
+def _codebox_introspect(path, max_columns, max_files):
+    import json, os, types
+
+    def describe(value):
+        info = dict(type=type(value).__name__)
+        shape = getattr(value, "shape", None)
+        if isinstance(shape, tuple):
+            info["shape"] = list(shape)
+        dtypes = getattr(value, "dtypes", None)
+        if hasattr(dtypes, "items"):
+            items = list(dtypes.items())
+            info["columns"] = {str(k): str(v) for k, v in items[:max_columns]}
+            info["n_columns"] = len(items)
+        elif getattr(value, "dtype", None) is not None:
+            info["dtype"] = str(value.dtype)
+        elif isinstance(value, (bool, int, float, complex)):
+            info["value"] = repr(value)
+        elif isinstance(value, str) and len(value) <= 40:
+            info["value"] = repr(value)
+        elif isinstance(value, (list, tuple, dict, set, frozenset, str, bytes)):
+            info["len"] = len(value)
+        return info
+
+    excluded = ("In", "Out", "get_ipython", "exit", "quit")
+    names, variables, modules = [], {}, {}
+    for name, value in list(globals().items()):
+        names.append(name)
+        if name.startswith("_") or name in excluded:
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+        else:
+            variables[name] = describe(value)
+
+    files = {}
+    for entry in sorted(os.scandir("."), key=lambda e: e.name)[:max_files]:
+        if entry.is_file() and not entry.name.startswith("."):
+            files[entry.name] = entry.stat().st_size
+
+    index = dict(names=names, variables=variables, modules=modules, files=files)
+    with open(path, "w") as f:
+        json.dump(index, f, default=str)
+"""
+
+
+def _format_size(n_bytes: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n_bytes < 1024:
+            return f"{n_bytes:.0f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} GB"
+
+
+def _format_variable(name: str, info: dict) -> str:
+    text = f"{name}: {info['type']}"
+    if "value" in info:
+        text += f" = {info['value']}"
+    if "shape" in info:
+        text += f" shape={tuple(info['shape'])}"
+    if "dtype" in info:
+        text += f" dtype={info['dtype']}"
+    if "len" in info:
+        text += f" len={info['len']}"
+    if "columns" in info:
+        columns = ", ".join(f"{k}:{v}" for k, v in info["columns"].items())
+        if info["n_columns"] > len(info["columns"]):
+            columns += ", ..."
+        text += f" columns=[{columns}]"
+    return text
+
+
+@dataclass
+class NamespaceIndex:
+    """Variables (type, shape, dtypes), modules and files of the kernel"""
+
+    names: list[str] = field(default_factory=list)
+    variables: dict[str, dict] = field(default_factory=dict)
+    modules: dict[str, str] = field(default_factory=dict)
+    files: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.variables or self.modules or self.files)
+
+    def diff(self, after: "NamespaceIndex") -> "NamespaceDiff":
+        return NamespaceDiff(
+            added=[n for n in after.variables if n not in self.variables],
+            changed=[
+                n
+                for n, info in after.variables.items()
+                if n in self.variables and self.variables[n] != info
+            ],
+            removed=[n for n in self.variables if n not in after.variables],
+            new_files=[
+                n for n, size in after.files.items() if self.files.get(n) != size
+            ],
+        )
+
+
+@dataclass
+class NamespaceDiff:
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    new_files: list[str] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed or self.new_files)
+
+
+class NamespaceIntrospector:
+    """Index the kernel namespace after each cell and render it for the agent
+
+    The index is fetched by a single call in the kernel, the context block
+    is rendered within `max_tokens` and the changes per cell are diffed.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 400,
+        max_columns: int = 20,
+        max_files: int = 50,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        self.max_tokens: int = max_tokens
+        self.max_columns: int = max_columns
+        self.max_files: int = max_files
+        # NOTE: approximated by the bytes if not given, e.g. by tiktoken
+        self.count_tokens: Callable[[str], int] = count_tokens or (
+            lambda text: (len(text.encode("utf-8")) + 3) // 4
+        )
+        self.index: NamespaceIndex = NamespaceIndex()
+
+    def reset(self) -> None:
+        """Forget the index, e.g. on a new or restarted kernel"""
+        self.index = NamespaceIndex()
+
+    def refresh(self, box: CustomLocalBox) -> Optional[NamespaceDiff]:
+        """Index the kernel again, return the changes, None if it failed"""
+        # NOTE: outside of the workdir, not to be taken as an output file
+        fd, path = tempfile.mkstemp(prefix="codebox-introspect-", suffix=".json")
+        os.close(fd)
+        try:
+            output = box.run_function(
+                _INTROSPECT_FUNCTION, path, self.max_columns, self.max_files, timeout=10
+            )
+            if output.type == "error":
+                return None
+            with open(path) as f:
+                index = NamespaceIndex(**json.load(f))
+        finally:
+            os.remove(path)
+
+        diff = self.index.diff(index)
+        self.index = index
+        return diff
+
+    def render_diff(self, diff: NamespaceDiff) -> str:
+        """One line summary of the changes, appended to the cell output"""
+        parts = [
+            *(
+                f"+ {_format_variable(n, self.index.variables[n])}"
+                for n in diff.added + diff.changed
+            ),
+            *(f"- {n}" for n in diff.removed),
+            *(f"+ file {n}" for n in diff.new_files),
+        ]
+        return self._fit("[kernel] ", parts, sep="; ")
+
+    def render_context(self) -> str:
+        """The context block of the kernel state for the agent input"""
+        if self.index.is_empty:
+            return ""
+        lines = [
+            "**Current kernel state (no need to inspect it again): **",
+            *(
+                f"- {_format_variable(n, info)}"
+                for n, info in self.index.variables.items()
+            ),
+        ]
+        if self.index.modules:
+            modules = ", ".join(
+                name if name == module else f"{name} ({module})"
+                for name, module in self.index.modules.items()
+            )
+            lines.append(f"- imported: {modules}")
+        if self.index.files:
+            files = ", ".join(
+                f"{name} ({_format_size(size)})"
+                for name, size in self.index.files.items()
+            )
+            lines.append(f"- files in the cwd: {files}")
+        return self._fit("", lines, sep="\n")
+
+    def _fit(self, head: str, parts: list[str], sep: str) -> str:
+        """Join the parts within `max_tokens`, noting the number of the omitted"""
+        if not parts:
+            return ""
+        text = head
+        for i, part in enumerate(parts):
+            candidate = text + (sep if i > 0 else "") + part
+            if self.count_tokens(candidate) > self.max_tokens:
+                return text + f"{sep}... ({len(parts) - i} more)"
+            text = candidate
+        return text
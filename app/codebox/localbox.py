@@ -1,14 +1,484 @@
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tarfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional
+from uuid import uuid4
+
+import requests
 from codeboxapi.box.localbox import LocalBox
+from codeboxapi.schema import CodeBoxFile, CodeBoxOutput, CodeBoxStatus
+from websockets.exceptions import ConnectionClosedError
+from websockets.sync.client import ClientConnection
+from websockets.sync.client import connect as ws_connect_sync
+
+from app.codebox.snapshot import DirectorySnapshot
+
+
+@dataclass
+class ConnectionStats:
+    state: str = "disconnected"  # connected / reconnecting / disconnected / failed
+    n_checks: int = 0
+    n_reconnects: int = 0
+    n_failures: int = 0
+    last_checked_at: float = 0.0
+    last_ping_ms: float = 0.0
+    last_error: str = ""
+
+
+KERNEL_DIED_STATES = ("restarting", "dead")
+
+
+def is_port_in_use(port: int, host: str = "localhost") -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(1.0)
+        return s.connect_ex((host, port)) == 0
+
+
+def _add_output(
+    text: str, outputs: list[str], on_output: Optional[Callable[[str], None]]
+) -> None:
+    # NOTE: same as `LocalBox.run`, one stripped line per message
+    text = text.strip() + "\n"
+    outputs.append(text)
+    if on_output is not None:
+        on_output(text)
+
+
+def _handle_stream(
+    text: str, outputs: list[str], on_output: Optional[Callable[[str], None]]
+) -> None:
+    if "Requirement already satisfied:" in text:
+        return
+    _add_output(text, outputs, on_output)
+
+
+def _parse_display_data(data: dict) -> Optional[CodeBoxOutput]:
+    if "image/png" in data:
+        return CodeBoxOutput(type="image/png", content=data["image/png"])
+    if "text/plain" in data:
+        return CodeBoxOutput(type="text", content=data["text/plain"])
+    return None
+
+
+def _parse_text_outputs(
+    outputs: list[str], max_output_chars: Optional[int] = 500
+) -> CodeBoxOutput:
+    # NOTE: same as `LocalBox.run`, keep the tail of the outputs
+    result = "".join(outputs)
+    if max_output_chars is not None and len(result) > max_output_chars:
+        result = "[...]\n" + result[-max_output_chars:]
+    return CodeBoxOutput(
+        type="text", content=result or "code run successfully (no output)"
+    )
 
 
 class CustomLocalBox(LocalBox):
-    # NOTE: override singleton `LocalBox` __new__ / force not to be a singleton
+    # NOTE: override singleton `LocalBox` __new__ / force not to be a singleton,
+    #       skipping `LocalBox.__new__` which returns the cached `_instance`
     def __new__(cls, *args, **kwargs):
-        return super().__new__(cls)
+        return super(LocalBox, cls).__new__(cls)
 
-    def __init__(self, port: int = 8888) -> None:
+    def __init__(
+        self,
+        port: int = 8888,
+        workdir: str = ".codebox",
+        heartbeat_interval: float = 30.0,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10.0,
+        max_output_chars: Optional[int] = 500,
+        fixed_port: bool = False,
+    ) -> None:
         super().__init__()
         self.port = port
+        # NOTE: fail if the port is in use, instead of shifting it (`_check_port`),
+        #       e.g. the port is reserved by the pool
+        self.fixed_port: bool = fixed_port
+        # NOTE: the jupyter kernelgateway runs on `.codebox` (see `LocalBox.start`),
+        #       the kernel moves to `workdir` on connecting if it differs
+        self.workdir: str = workdir
+
+        # NOTE: the connection is checked at most once per `heartbeat_interval`
+        self.heartbeat_interval: float = heartbeat_interval
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        # NOTE: the tail of the text output kept, None to keep the whole output
+        self.max_output_chars: Optional[int] = max_output_chars
+        self.connection_stats = ConnectionStats()
+
+    def _check_port(self) -> None:
+        if not self.fixed_port:
+            return super()._check_port()
+        if is_port_in_use(self.port):
+            raise RuntimeError(f"Port {self.port} is already in use")
+
+    @property
+    def has_own_workdir(self) -> bool:
+        return os.path.abspath(self.workdir) != os.path.abspath(".codebox")
 
     def connect(self):
+        """Connect to a new kernel, deleting the previous one not to leak it"""
+        self._close_kernel()
+        self._connect()
+
+    def _connect(self) -> None:
+        super()._connect()
+        self._mark_connected()
+        self._setup_kernel()
+
+    def _setup_kernel(self) -> None:
+        if self.has_own_workdir:
+            os.makedirs(self.workdir, exist_ok=True)
+            self.run(f"import os; os.chdir({os.path.abspath(self.workdir)!r})")
+
+    def _mark_connected(self) -> None:
+        self.connection_stats.state = "connected"
+        self.connection_stats.last_checked_at = time.monotonic()
+
+    def ping(self, timeout: float = 5.0) -> bool:
+        if not isinstance(self.ws, ClientConnection):
+            return False
+        t0 = time.monotonic()
+        try:
+            pong = self.ws.ping().wait(timeout)
+        except Exception:
+            return False
+        self.connection_stats.last_ping_ms = (time.monotonic() - t0) * 1000
+        return pong
+
+    def ensure_connected(self) -> CodeBoxStatus:
+        """Check the connection by heartbeat and reconnect only if it is broken"""
+        stats = self.connection_stats
+        elapsed = time.monotonic() - stats.last_checked_at
+        if self.ws is not None and elapsed < self.heartbeat_interval:
+            return CodeBoxStatus(status=stats.state)
+
+        stats.n_checks += 1
+        if self.ping():
+            self._mark_connected()
+            return CodeBoxStatus(status=stats.state)
+        return self._reconnect_with_backoff()
+
+    def _reconnect_with_backoff(self) -> CodeBoxStatus:
+        stats = self.connection_stats
+        stats.state = "reconnecting"
+        for n_retry in range(self.max_retries):
+            try:
+                self._reconnect()
+                stats.n_reconnects += 1
+                return CodeBoxStatus(status=stats.state)
+            except Exception as e:
+                stats.n_failures += 1
+                stats.last_error = f"{e.__class__.__name__}: {e}"
+            time.sleep(min(self.backoff_base * 2**n_retry, self.backoff_max))
+
+        stats.state = "failed"
+        raise RuntimeError(
+            f"Could not reconnect to the kernel on port {self.port}: {stats.last_error}"
+        )
+
+    def _close_ws(self) -> None:
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+            self.ws = None
+
+    def _reconnect(self) -> None:
+        self._close_ws()
+
+        if self.kernel_id is not None:
+            # NOTE: keep the kernel state (variables) if the kernel is still alive
+            response = requests.get(
+                f"{self.kernel_url}/kernels/{self.kernel_id}", timeout=10
+            )
+            if response.status_code == 200:
+                self.ws = ws_connect_sync(
+                    f"{self.ws_url}/kernels/{self.kernel_id}/channels"
+                )
+                self._mark_connected()
+                return
+        self._connect()
+
+    def _close_kernel(self) -> None:
+        self._close_ws()
+        if self.kernel_id is not None:
+            try:
+                requests.delete(
+                    f"{self.kernel_url}/kernels/{self.kernel_id}", timeout=10
+                )
+            except requests.exceptions.RequestException:
+                pass
+            self.kernel_id = None
+        self.connection_stats.state = "disconnected"
+
+    def reset(self) -> CodeBoxStatus:
+        """Replace the kernel with a fresh one and clean up the working directory"""
+        self._close_kernel()
+        if self.has_own_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
         self._connect()
+        return CodeBoxStatus(status="reset")
+
+    def interrupt(self) -> CodeBoxStatus:
+        """Interrupt the running cell (KeyboardInterrupt in the kernel)"""
+        requests.post(
+            f"{self.kernel_url}/kernels/{self.kernel_id}/interrupt", timeout=10
+        )
+        return CodeBoxStatus(status="interrupted")
+
+    def restart_kernel(self) -> CodeBoxStatus:
+        """Restart the kernel process, the kernel state (variables) is lost
+
+        NOTE: `LocalBox.restart` is a no-op which `install` relies on
+        """
+        requests.post(f"{self.kernel_url}/kernels/{self.kernel_id}/restart", timeout=60)
+        # NOTE: discard the `restarting` status not to be taken as a kernel death
+        self._drain()
+        self._setup_kernel()
+        return CodeBoxStatus(status="restarted")
+
+    def _drain(self, timeout: float = 0.5) -> None:
+        while True:
+            try:
+                self.ws.recv(timeout=timeout)
+            except TimeoutError:
+                return
+
+    def execution_state(self) -> Optional[str]:
+        """Return the kernel state, e.g. `idle` / `busy`, or None if not found"""
+        response = requests.get(
+            f"{self.kernel_url}/kernels/{self.kernel_id}", timeout=10
+        )
+        if response.status_code != 200:
+            return None
+        return response.json().get("execution_state")
+
+    def _send_execute_request(self, code: str) -> str:
+        msg_id = uuid4().hex
+        self.ws.send(
+            json.dumps(
+                {
+                    "header": {"msg_id": msg_id, "msg_type": "execute_request"},
+                    "parent_header": {},
+                    "metadata": {},
+                    "content": {
+                        "code": code,
+                        "silent": False,
+                        "store_history": True,
+                        "user_expressions": {},
+                        "allow_stdin": False,
+                        "stop_on_error": True,
+                    },
+                    "channel": "shell",
+                    "buffers": [],
+                }
+            )
+        )
+        return msg_id
+
+    def run_function(
+        self, source: str, *args, timeout: Optional[float] = None
+    ) -> CodeBoxOutput:
+        """Define the function of the source in the kernel, call it and delete it
+
+        The args are passed by their repr, no names are left in the namespace.
+        """
+        name = source[len("def ") : source.index("(")]
+        code = (
+            f"{source}\n\n"
+            f"try:\n    {name}({', '.join(map(repr, args))})\nfinally:\n    del {name}\n"
+        )
+        return self.run_stream(code, timeout=timeout)
+
+    def run_stream(
+        self,
+        code: str,
+        on_output: Optional[Callable[[str], None]] = None,
+        timeout: Optional[float] = None,
+        retry: int = 2,
+    ) -> CodeBoxOutput:
+        """Run the code, forwarding the kernel outputs to `on_output` as they arrive
+
+        The cell is interrupted if it does not finish in `timeout` seconds.
+        """
+        if not self.ws:
+            self._connect()
+        msg_id = self._send_execute_request(code)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        outputs: list[str] = []
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            try:
+                received_msg = json.loads(self.ws.recv(timeout=remaining))
+            except TimeoutError:
+                return self._interrupt_cell(msg_id, timeout)
+            except ConnectionClosedError:
+                if retry <= 0:
+                    raise RuntimeError("Could not connect to kernel")
+                self._reconnect_with_backoff()
+                return self.run_stream(code, on_output, timeout, retry - 1)
+
+            output = self._handle_message(received_msg, msg_id, outputs, on_output)
+            if output is not None:
+                return output
+
+    def _interrupt_cell(
+        self, msg_id: str, timeout: float, grace: float = 10.0
+    ) -> CodeBoxOutput:
+        self.interrupt()
+        # NOTE: drain the outputs until the kernel gets idle
+        deadline = time.monotonic() + grace
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                received_msg = json.loads(self.ws.recv(timeout=remaining))
+            except TimeoutError:
+                break
+            except ConnectionClosedError:
+                # NOTE: the interrupted kernel is kept, reconnect for the next cell
+                self._reconnect_with_backoff()
+                break
+            if self._handle_message(received_msg, msg_id, [], None) is not None:
+                break
+        return CodeBoxOutput(
+            type="error",
+            content=f"TimeoutError: the cell did not finish in {timeout} seconds "
+            "and got interrupted",
+        )
+
+    def _handle_message(
+        self,
+        received_msg: dict,
+        msg_id: str,
+        outputs: list[str],
+        on_output: Optional[Callable[[str], None]],
+    ) -> Optional[CodeBoxOutput]:
+        """Handle a kernel message, return the output once the cell finished"""
+        msg_type = received_msg["header"]["msg_type"]
+        content = received_msg["content"]
+        if msg_type == "status" and content["execution_state"] in KERNEL_DIED_STATES:
+            # NOTE: e.g. killed by a signal, the gateway restarts the kernel
+            return CodeBoxOutput(
+                type="error", content="KernelDied: the kernel died and got restarted"
+            )
+        if received_msg["parent_header"].get("msg_id") != msg_id:
+            return None
+
+        if msg_type == "stream":
+            _handle_stream(content["text"], outputs, on_output)
+        elif msg_type == "execute_result":
+            _add_output(content["data"]["text/plain"], outputs, on_output)
+        elif msg_type == "display_data":
+            return _parse_display_data(content["data"])
+        elif msg_type == "error":
+            return CodeBoxOutput(
+                type="error", content=f"{content['ename']}: {content['evalue']}"
+            )
+        elif msg_type == "status" and content["execution_state"] == "idle":
+            return _parse_text_outputs(outputs, self.max_output_chars)
+        return None
+
+    def stop(self) -> CodeBoxStatus:
+        """Stop the own kernel gateway only
+
+        NOTE: `LocalBox.stop` kills every gateway started in the process (the
+              class-level `_jupyter_pids`) once `jupyter` is None, e.g. on
+              `__del__` after stopped, which takes down the other boxes too
+        """
+        if self.jupyter is not None:
+            pid = self.jupyter.pid
+            try:
+                self.jupyter.terminate()
+                if isinstance(self.jupyter, subprocess.Popen):
+                    try:
+                        self.jupyter.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        self.jupyter.kill()
+                        self.jupyter.wait()
+            except ProcessLookupError:
+                pass
+            self.jupyter = None
+            if pid in self._jupyter_pids:
+                self._jupyter_pids.remove(pid)
+        self._close_ws()
+        self.kernel_id = None
+        self.connection_stats.state = "disconnected"
+        return CodeBoxStatus(status="stopped")
+
+    def __del__(self) -> None:
+        try:
+            self.stop()
+        except Exception:
+            pass
+
+    def upload(self, file_name: str, content: bytes) -> CodeBoxStatus:
+        os.makedirs(self.workdir, exist_ok=True)
+        with open(os.path.join(self.workdir, file_name), "wb") as f:
+            f.write(content)
+        return CodeBoxStatus(status=f"{file_name} uploaded successfully")
+
+    def download(self, file_name: str) -> CodeBoxFile:
+        with open(os.path.join(self.workdir, file_name), "rb") as f:
+            content = f.read()
+        return CodeBoxFile(name=file_name, content=content)
+
+    def upload_stream(self, file_name: str, chunks: Iterable[bytes]) -> CodeBoxStatus:
+        """Write the content chunk by chunk, not to hold the whole bytes"""
+        os.makedirs(self.workdir, exist_ok=True)
+        with open(os.path.join(self.workdir, file_name), "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return CodeBoxStatus(status=f"{file_name} uploaded successfully")
+
+    def upload_path(self, file_name: str, src_path: str) -> CodeBoxStatus:
+        os.makedirs(self.workdir, exist_ok=True)
+        shutil.copyfile(src_path, os.path.join(self.workdir, file_name))
+        return CodeBoxStatus(status=f"{file_name} uploaded successfully")
+
+    def upload_archive(self, content: bytes) -> CodeBoxStatus:
+        """Extract a tar archive of the files into the working directory at once"""
+        root = os.path.abspath(self.workdir)
+        os.makedirs(root, exist_ok=True)
+        with tarfile.open(fileobj=io.BytesIO(content), mode="r:*") as tar:
+            members = tar.getmembers()
+            for member in members:
+                path = os.path.abspath(os.path.join(root, member.name))
+                if not member.isfile() or os.path.commonpath([root, path]) != root:
+                    raise ValueError(f"Invalid archive member: {member.name}")
+            tar.extractall(root, members=members)
+        return CodeBoxStatus(status=f"{len(members)} files uploaded successfully")
+
+    def download_stream(
+        self, file_name: str, chunk_size: int = 1 << 20
+    ) -> Iterator[bytes]:
+        with open(os.path.join(self.workdir, file_name), "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+
+    def download_archive(self, file_names: list[str]) -> bytes:
+        """Bundle the files in the working directory into a tar archive"""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for file_name in file_names:
+                tar.add(os.path.join(self.workdir, file_name), arcname=file_name)
+        return buffer.getvalue()
+
+    def list_files(self) -> list[CodeBoxFile]:
+        return [
+            CodeBoxFile(name=file_name, content=None)
+            for file_name in os.listdir(self.workdir)
+        ]
+
+    def snapshot(
+        self, hash_content: bool = False, prev: DirectorySnapshot = None
+    ) -> DirectorySnapshot:
+        return DirectorySnapshot.take(
+            self.workdir, hash_content=hash_content, prev=prev
+        )
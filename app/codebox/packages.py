@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox.localbox import CustomLocalBox
+
+_MODULE_NOT_FOUND = re.compile(r"ModuleNotFoundError: No module named '([^']+)'")
+# NOTE: pip found no such distribution on the index (which was reachable)
+_NO_DISTRIBUTION = re.compile(r"No matching distribution found for ([\w.-]+)")
+_INDEX_UNREACHABLE = "index not reachable"
+
+# NOTE: the import names which differ from the distribution names on PyPI
+MODULE_TO_DISTRIBUTION: dict[str, str] = {
+    "attr": "attrs",
+    "bs4": "beautifulsoup4",
+    "Crypto": "pycryptodome",
+    "cv2": "opencv-python-headless",
+    "dateutil": "python-dateutil",
+    "docx": "python-docx",
+    "dotenv": "python-dotenv",
+    "fitz": "PyMuPDF",
+    "japanize_matplotlib": "japanize-matplotlib",
+    "jose": "python-jose",
+    "jwt": "PyJWT",
+    "Levenshtein": "python-Levenshtein",
+    "magic": "python-magic",
+    "multipart": "python-multipart",
+    "MySQLdb": "mysqlclient",
+    "OpenSSL": "pyOpenSSL",
+    "PIL": "Pillow",
+    "pptx": "python-pptx",
+    "psycopg2": "psycopg2-binary",
+    "serial": "pyserial",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "slugify": "python-slugify",
+    "yaml": "PyYAML",
+    "zmq": "pyzmq",
+}
+
+# NOTE: install from the wheel cache first, then build the missing wheels into it
+_INSTALL_CELL = """\
+def _codebox_install(dists, wheel_dir):
+    import importlib, subprocess, sys
+
+    pip = [sys.executable, "-m", "pip", "-q", "--disable-pip-version-check"]
+    install = pip + ["install", "--no-index", "--find-links", wheel_dir, *dists]
+    if subprocess.run(install, capture_output=True).returncode != 0:
+        wheel = ["wheel", "--wheel-dir", wheel_dir, "--find-links", wheel_dir]
+        r = subprocess.run(pip + wheel + dists, capture_output=True, text=True)
+        if r.returncode != 0:
+            # NOTE: pip retries the connection, the missing dists are not reliable
+            prefix = {unreachable!r} + ": " if "Retrying (" in r.stderr else ""
+            raise RuntimeError(prefix + r.stderr.strip()[-500:])
+        subprocess.run(install, check=True, capture_output=True)
+    importlib.invalidate_caches()
+
+
+try:
+    _codebox_install({dists!r}, {wheel_dir!r})
+finally:
+    del _codebox_install
+"""
+
+
+def missing_module(output: CodeBoxOutput) -> Optional[str]:
+    """The module name of the ModuleNotFoundError output, if any"""
+    if output.type != "error":
+        return None
+    if (m := _MODULE_NOT_FOUND.search(output.content)) is None:
+        return None
+    return m.group(1)
+
+
+def distribution_for(module: str) -> str:
+    top_level = module.split(".")[0]
+    return MODULE_TO_DISTRIBUTION.get(top_level, top_level)
+
+
+@dataclass
+class InstallFailure:
+    error: str
+    failed_at: float
+    n_failures: int = 1
+    # NOTE: no such distribution on the index, never retried
+    is_permanent: bool = False
+
+
+def _missing_distributions(error: str) -> set[str]:
+    if _INDEX_UNREACHABLE in error:
+        return set()
+    return {name.lower() for name in _NO_DISTRIBUTION.findall(error)}
+
+
+class PackageInstaller:
+    """Install the missing packages into the kernels through a shared wheel cache
+
+    The wheels are built once into `wheel_dir` and installed from there by
+    every kernel afterwards, without reaching the package index. A failed
+    distribution is retried after `retry_after` seconds, unless the index
+    has no such distribution.
+    """
+
+    def __init__(
+        self,
+        wheel_dir: str = ".wheelhouse",
+        timeout: float = 300,
+        retry_after: float = 60 * 10,
+    ) -> None:
+        self.wheel_dir: str = os.path.abspath(wheel_dir)
+        self.timeout: float = timeout
+        self.retry_after: float = retry_after
+        self.failed: dict[str, InstallFailure] = {}  # NOTE: distribution -> failure
+        self.n_installs: int = 0
+        self.install_seconds: float = 0.0
+        self._lock = threading.Lock()
+        # NOTE: distribution -> lock, one build into `wheel_dir` at a time
+        self._build_locks: dict[str, threading.Lock] = {}
+        os.makedirs(self.wheel_dir, exist_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                n_installs=self.n_installs,
+                n_failed=len(self.failed),
+                n_permanently_failed=sum(f.is_permanent for f in self.failed.values()),
+                install_seconds=self.install_seconds,
+                n_cached_wheels=len(
+                    [f for f in os.listdir(self.wheel_dir) if f.endswith(".whl")]
+                ),
+            )
+
+    def install(self, box: CustomLocalBox, modules: Iterable[str]) -> bool:
+        """Install the distributions of the modules, False if any failed"""
+        dists = sorted({distribution_for(m) for m in modules})
+        with self._lock:
+            if not dists or any(self._is_failed(d) for d in dists):
+                return False
+            build_locks = [self._build_lock(d) for d in dists]
+
+        # NOTE: acquired in the sorted order, the sessions never deadlock
+        with ExitStack() as stack:
+            for lock in build_locks:
+                stack.enter_context(lock)
+            with self._lock:
+                # NOTE: failed while waiting for the build of another session
+                if any(self._is_failed(d) for d in dists):
+                    return False
+            return self._install(box, dists)
+
+    def _build_lock(self, dist: str) -> threading.Lock:
+        """Must be called under the lock"""
+        if (lock := self._build_locks.get(dist)) is None:
+            lock = self._build_locks[dist] = threading.Lock()
+        return lock
+
+    def _install(self, box: CustomLocalBox, dists: list[str]) -> bool:
+        t0 = time.monotonic()
+        code = _INSTALL_CELL.format(
+            dists=dists, wheel_dir=self.wheel_dir, unreachable=_INDEX_UNREACHABLE
+        )
+        output = box.run_stream(code, timeout=self.timeout)
+        with self._lock:
+            self.n_installs += 1
+            self.install_seconds += time.monotonic() - t0
+            if output.type == "error":
+                self._add_failures(dists, output.content)
+                return False
+            for d in dists:
+                self.failed.pop(d, None)
+        return True
+
+    def _is_failed(self, dist: str) -> bool:
+        """Not to be retried yet, must be called under the lock"""
+        if (failure := self.failed.get(dist)) is None:
+            return False
+        return (
+            failure.is_permanent
+            or time.monotonic() - failure.failed_at < self.retry_after
+        )
+
+    def _add_failures(self, dists: list[str], error: str) -> None:
+        missing = _missing_distributions(error)
+        now = time.monotonic()
+        for d in dists:
+            previous = self.failed.get(d)
+            self.failed[d] = InstallFailure(
+                error=error,
+                failed_at=now,
+                n_failures=1 if previous is None else previous.n_failures + 1,
+                is_permanent=d.lower() in missing,
+            )
+
+    def prewarm(self, box: CustomLocalBox, modules: Iterable[str]) -> bool:
+        """Install the modules in advance, e.g. on starting a pooled kernel"""
+        modules = list(modules)
+        return not modules or self.install(box, modules)
@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from typing_extensions import Self
+
+from app.codebox.localbox import CustomLocalBox, is_port_in_use
+from app.codebox.packages import PackageInstaller
+
+
+@dataclass
+class _PooledBox:
+    box: CustomLocalBox
+    released_at: float = field(default_factory=time.monotonic)
+
+
+class CodeBoxPool:
+    """Pool of pre-started `CustomLocalBox` kernels
+
+    `lease` hands out a warm kernel, `release` resets it and puts it back,
+    `evict_idle` stops the idle kernels beyond `size`, also every
+    `evict_interval` seconds on a background thread.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_size: int = 8,
+        port_range: tuple[int, int] = (7801, 7900),
+        idle_timeout: float = 60 * 10,
+        evict_interval: Optional[float] = 60,
+        lease_timeout: float = 60 * 3,
+        workdir_root: str = ".codebox_pool",
+        prewarm_packages: Iterable[str] = (),
+        installer: Optional[PackageInstaller] = None,
+        verbose: bool = False,
+    ) -> None:
+        assert 0 <= size <= max_size, f"invalid pool size: {size=}, {max_size=}"
+        self.size: int = size
+        self.max_size: int = max_size
+        self.port_range: tuple[int, int] = port_range
+        self.idle_timeout: float = idle_timeout
+        self.evict_interval: Optional[float] = evict_interval  # NOTE: None to disable
+        self.lease_timeout: float = lease_timeout
+        self.workdir_root: str = workdir_root
+        # NOTE: the modules installed into every kernel on starting it
+        self.prewarm_packages: list[str] = list(prewarm_packages)
+        self.installer: Optional[PackageInstaller] = installer
+        if self.prewarm_packages and self.installer is None:
+            self.installer = PackageInstaller()
+        self.verbose: bool = verbose
+
+        self._idle: list[_PooledBox] = []
+        self._leased: set[CustomLocalBox] = set()
+        self._ports: set[int] = set()
+        self._n_starting: int = 0
+        self._cond = threading.Condition()
+        self._evictor: Optional[threading.Thread] = None
+        self._stopped: Optional[threading.Event] = None
+
+    @property
+    def n_total(self) -> int:
+        return len(self._idle) + len(self._leased) + self._n_starting
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(
+                idle=len(self._idle),
+                leased=len(self._leased),
+                starting=self._n_starting,
+                ports=sorted(self._ports),
+            )
+
+    def _allocate_port(self) -> int:
+        """Reserve a port not in use, probed outside the lock"""
+        in_use: set[int] = set()
+        while True:
+            with self._cond:
+                port = next(
+                    (
+                        port
+                        for port in range(*self.port_range)
+                        if port not in self._ports and port not in in_use
+                    ),
+                    None,
+                )
+                if port is None:
+                    raise RuntimeError(
+                        f"No free port in the pool port range: {self.port_range}"
+                    )
+                self._ports.add(port)
+            # NOTE: the probe may take the socket timeout, not to block the pool
+            if not is_port_in_use(port):
+                return port
+            in_use.add(port)
+            with self._cond:
+                self._ports.discard(port)
+
+    def _spawn(self) -> CustomLocalBox:
+        """Start a new kernel, which must be reserved by `_n_starting` in advance"""
+        try:
+            port = self._allocate_port()
+        except Exception:
+            with self._cond:
+                self._n_starting -= 1
+                self._cond.notify_all()
+            raise
+        # NOTE: on the reserved port, not shifted to another box's by `_check_port`
+        box = CustomLocalBox(
+            port=port,
+            workdir=os.path.join(self.workdir_root, str(port)),
+            fixed_port=True,
+        )
+        try:
+            box.start()
+            if self.installer is not None:
+                self.installer.prewarm(box, self.prewarm_packages)
+        except Exception:
+            # NOTE: the gateway may be running, e.g. the prewarm failed
+            self._stop_box(box)
+            with self._cond:
+                self._n_starting -= 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._n_starting -= 1
+        if self.verbose:
+            print(f"CodeBoxPool: started a kernel on port {box.port}")
+        return box
+
+    def _fill(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._idle) + self._n_starting >= self.size:
+                    return
+                if self.n_total >= self.max_size:
+                    return
+                self._n_starting += 1
+            try:
+                box = self._spawn()
+            except Exception as e:
+                if self.verbose:
+                    print("CodeBoxPool: failed to start a kernel:", e)
+                return
+            with self._cond:
+                self._idle.append(_PooledBox(box=box))
+                self._cond.notify_all()
+
+    def _fill_async(self) -> None:
+        threading.Thread(target=self._fill, daemon=True).start()
+
+    def start(self) -> Self:
+        """Pre-start `size` kernels"""
+        self._start_evictor()
+        self._fill()
+        return self
+
+    def _start_evictor(self) -> None:
+        if self.evict_interval is None:
+            return
+        with self._cond:
+            if self._evictor is not None:
+                return
+            self._stopped = threading.Event()
+            self._evictor = threading.Thread(
+                target=self._evict_loop, args=(self._stopped,), daemon=True
+            )
+            self._evictor.start()
+
+    def _evict_loop(self, stopped: threading.Event) -> None:
+        # NOTE: the idle kernels expire without any lease / release
+        while not stopped.wait(self.evict_interval):
+            self.evict_idle()
+
+    def lease(self) -> CustomLocalBox:
+        self._start_evictor()
+        deadline = time.monotonic() + self.lease_timeout
+        with self._cond:
+            while not self._idle:
+                if self.n_total < self.max_size:
+                    # NOTE: no warm kernel, then boot one for this lease
+                    self._n_starting += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No codebox available in the pool")
+                self._cond.wait(timeout=remaining)
+            else:
+                box = self._idle.pop().box
+                self._leased.add(box)
+                self._fill_async()
+                return box
+
+        box = self._spawn()
+        with self._cond:
+            self._leased.add(box)
+        self._fill_async()
+        return box
+
+    def release(self, box: CustomLocalBox, reset: bool = True) -> None:
+        with self._cond:
+            if box not in self._leased:
+                return
+            self._leased.discard(box)
+
+        try:
+            if reset:
+                box.reset()
+        except Exception as e:
+            if self.verbose:
+                print("CodeBoxPool: failed to reset a kernel, recycle it:", e)
+            self._stop_box(box)
+            self._fill_async()
+            return
+
+        with self._cond:
+            self._idle.append(_PooledBox(box=box))
+            self._cond.notify_all()
+        self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """Stop the kernels idle longer than `idle_timeout` beyond the pool size"""
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            # NOTE: the oldest released kernels come first
+            self._idle.sort(key=lambda pb: pb.released_at)
+            while len(self._idle) > self.size:
+                if now - self._idle[0].released_at < self.idle_timeout:
+                    break
+                evicted.append(self._idle.pop(0).box)
+
+        for box in evicted:
+            self._stop_box(box)
+        return len(evicted)
+
+    def _stop_box(self, box: CustomLocalBox) -> None:
+        try:
+            box.stop()
+        except Exception as e:
+            if self.verbose:
+                print("CodeBoxPool: failed to stop a kernel:", e)
+        with self._cond:
+            self._ports.discard(box.port)
+            self._cond.notify_all()
+
+    def stop(self) -> None:
+        with self._cond:
+            if self._stopped is not None:
+                self._stopped.set()
+            self._evictor, self._stopped = None, None
+            boxes = [pb.box for pb in self._idle] + list(self._leased)
+            self._idle = []
+            self._leased = set()
+        for box in boxes:
+            self._stop_box(box)
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
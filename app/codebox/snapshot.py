@@ -0,0 +1,86 @@
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class FileStat:
+    mtime_ns: int
+    size: int
+    inode: int
+    digest: Optional[str] = None
+
+
+@dataclass
+class DirectorySnapshot:
+    """Index of the files under `root` (mtime + size + inode, optional content hash)"""
+
+    root: str
+    files: dict[str, FileStat] = field(default_factory=dict)
+
+    @classmethod
+    def take(
+        cls, root: str, hash_content: bool = False, prev: "DirectorySnapshot" = None
+    ) -> "DirectorySnapshot":
+        snapshot = cls(root=root)
+        if not os.path.isdir(root):
+            return snapshot
+
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                relpath = os.path.relpath(path, root)
+                snapshot.files[relpath] = FileStat(
+                    mtime_ns=st.st_mtime_ns,
+                    size=st.st_size,
+                    inode=st.st_ino,
+                    digest=_digest(path, relpath, st, prev) if hash_content else None,
+                )
+        return snapshot
+
+    def diff(self, after: "DirectorySnapshot") -> list[str]:
+        """Return the files created or modified between `self` and `after`"""
+        modifications = []
+        for relpath, stat in after.files.items():
+            before = self.files.get(relpath)
+            if before is None or _is_modified(before, stat):
+                modifications.append(relpath)
+        return sorted(modifications)
+
+
+def _is_modified(before: FileStat, after: FileStat) -> bool:
+    if before.digest and after.digest:
+        # NOTE: content hash is authoritative, e.g. `touch` without any changes
+        return before.digest != after.digest
+    return (
+        before.mtime_ns != after.mtime_ns
+        or before.size != after.size
+        or before.inode != after.inode
+    )
+
+
+def _digest(
+    path: str, relpath: str, st: os.stat_result, prev: Optional[DirectorySnapshot]
+) -> Optional[str]:
+    # NOTE: reuse the previous hash if the file seems not to be touched
+    if prev and (stat := prev.files.get(relpath)) and stat.digest:
+        if (stat.mtime_ns, stat.size, stat.inode) == (
+            st.st_mtime_ns,
+            st.st_size,
+            st.st_ino,
+        ):
+            return stat.digest
+
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
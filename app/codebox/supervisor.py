@@ -0,0 +1,249 @@
+import json
+import os
+import signal
+import threading
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox.localbox import CustomLocalBox
+
+try:
+    import resource
+except ImportError:  # NOTE: not available on windows
+    resource = None
+
+
+@dataclass
+class ResourceLimits:
+    # NOTE: wall clock seconds per cell, interrupt and then restart the kernel
+    timeout: Optional[float] = 120.0
+    # NOTE: RSS of the kernel watched while a cell runs, kill (restart) the kernel
+    max_memory_bytes: Optional[int] = None
+    # NOTE: CPU seconds per cell by RLIMIT_CPU (SIGXCPU)
+    max_cpu_seconds: Optional[int] = None
+    # NOTE: RLIMIT_AS of the kernel, raising MemoryError in the cell
+    max_address_space_bytes: Optional[int] = None
+    poll_interval: float = 0.5
+
+
+@dataclass
+class Violation:
+    kind: str  # timeout / memory / cpu / kernel_died
+    limit: Optional[float]
+    action: str  # interrupted / restarted
+    detail: str
+
+    def to_observation(self) -> CodeBoxOutput:
+        observation = dict(error="ResourceLimitExceeded", **asdict(self))
+        if self.action == "restarted":
+            observation["note"] = (
+                "The kernel got restarted, all variables and imports are lost."
+            )
+        return CodeBoxOutput(type="error", content=json.dumps(observation))
+
+
+class _KernelWatchdog(threading.Thread):
+    """Watch the RSS (killed over `max_bytes`) and the CPU time of the kernel"""
+
+    def __init__(self, pid: int, max_bytes: Optional[int], interval: float) -> None:
+        super().__init__(daemon=True)
+        self.pid: int = pid
+        self.max_bytes: Optional[int] = max_bytes
+        self.interval: float = interval
+        self.exceeded_rss: Optional[int] = None
+        # NOTE: the last CPU seconds read, kept after the kernel died
+        self.cpu_seconds: Optional[float] = None
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if (cpu_seconds := _read_cpu_seconds(self.pid)) is not None:
+                self.cpu_seconds = cpu_seconds
+            if self.max_bytes is None:
+                continue
+            rss = _read_rss(self.pid)
+            if rss is not None and rss > self.max_bytes:
+                self.exceeded_rss = rss
+                # NOTE: not to call the websocket concurrently with the running cell,
+                #       kill it and let the gateway restart the kernel
+                os.kill(self.pid, signal.SIGKILL)
+                return
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def _read_rss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return None
+
+
+def _read_cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    # NOTE: utime / stime are the 14th / 15th fields
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class KernelSupervisor:
+    """Run cells on a `CustomLocalBox` within the resource limits
+
+    A violation is reported back as a structured (json) error observation.
+    """
+
+    def __init__(self, limits: Optional[ResourceLimits] = None) -> None:
+        self.limits: ResourceLimits = limits or ResourceLimits()
+        self.violations: list[Violation] = []
+        self._pids: dict[str, int] = {}
+
+    @property
+    def needs_pid(self) -> bool:
+        return any(
+            (
+                self.limits.max_memory_bytes,
+                self.limits.max_cpu_seconds,
+                self.limits.max_address_space_bytes,
+            )
+        )
+
+    def kernel_pid(self, box: CustomLocalBox) -> Optional[int]:
+        if box.kernel_id in self._pids:
+            return self._pids[box.kernel_id]
+        output = box.run_stream("import os; print(os.getpid())", timeout=10)
+        if output.type != "text" or not output.content.strip().isdigit():
+            return None
+        self._pids[box.kernel_id] = pid = int(output.content)
+        self._apply_address_space_limit(pid)
+        return pid
+
+    def _apply_address_space_limit(self, pid: int) -> None:
+        if not self.limits.max_address_space_bytes or not hasattr(resource, "prlimit"):
+            return
+        _, hard = resource.prlimit(pid, resource.RLIMIT_AS)
+        resource.prlimit(
+            pid, resource.RLIMIT_AS, (self.limits.max_address_space_bytes, hard)
+        )
+
+    def _apply_cpu_limit(self, pid: int) -> Optional[int]:
+        """Return the CPU seconds (of the kernel process) the cell may reach"""
+        if not self.limits.max_cpu_seconds or not hasattr(resource, "prlimit"):
+            return None
+        if (used := _read_cpu_seconds(pid)) is None:
+            return None
+        # NOTE: RLIMIT_CPU is cumulative, then budget from the current usage
+        _, hard = resource.prlimit(pid, resource.RLIMIT_CPU)
+        soft = int(used) + self.limits.max_cpu_seconds
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, hard))
+        return soft
+
+    def run(
+        self,
+        box: CustomLocalBox,
+        code: str,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> CodeBoxOutput:
+        pid = self.kernel_pid(box) if self.needs_pid else None
+        watchdog, cpu_budget = None, None
+        if pid is not None:
+            cpu_budget = self._apply_cpu_limit(pid)
+            if self.limits.max_memory_bytes or cpu_budget is not None:
+                watchdog = _KernelWatchdog(
+                    pid, self.limits.max_memory_bytes, self.limits.poll_interval
+                )
+                watchdog.start()
+
+        try:
+            output = box.run_stream(code, on_output, timeout=self.limits.timeout)
+        finally:
+            if watchdog is not None:
+                watchdog.stop()
+
+        violation = self._check(box, output, watchdog, cpu_budget)
+        if violation is None:
+            return output
+        self.violations.append(violation)
+        return violation.to_observation()
+
+    def _check(
+        self,
+        box: CustomLocalBox,
+        output: CodeBoxOutput,
+        watchdog: Optional[_KernelWatchdog],
+        cpu_budget: Optional[int] = None,
+    ) -> Optional[Violation]:
+        if output.type != "error":
+            return None
+
+        limits = self.limits
+        if output.content.startswith("KernelDied"):
+            self._pids.pop(box.kernel_id, None)
+            box._drain()
+            box._setup_kernel()
+            return self._kernel_died(output, watchdog, cpu_budget)
+
+        if output.content.startswith("TimeoutError"):
+            action = "interrupted"
+            if box.execution_state() == "busy":
+                # NOTE: the interrupt did not work, e.g. blocked in a C extension
+                self._pids.pop(box.kernel_id, None)
+                box.restart_kernel()
+                action = "restarted"
+            return Violation(
+                kind="timeout",
+                limit=limits.timeout,
+                action=action,
+                detail=output.content,
+            )
+
+        if output.content.startswith("MemoryError") and limits.max_address_space_bytes:
+            return Violation(
+                kind="memory",
+                limit=limits.max_address_space_bytes,
+                action="interrupted",
+                detail=output.content,
+            )
+        return None
+
+    def _kernel_died(
+        self,
+        output: CodeBoxOutput,
+        watchdog: Optional[_KernelWatchdog],
+        cpu_budget: Optional[int],
+    ) -> Violation:
+        """Tell why the kernel died, e.g. not a segfault reported as the CPU limit"""
+        if watchdog is not None and watchdog.exceeded_rss is not None:
+            return Violation(
+                kind="memory",
+                limit=self.limits.max_memory_bytes,
+                action="restarted",
+                detail=f"RSS reached {watchdog.exceeded_rss} bytes",
+            )
+        # NOTE: SIGXCPU at `cpu_budget`, read last up to one poll interval before
+        cpu_seconds = None if watchdog is None else watchdog.cpu_seconds
+        if (
+            cpu_budget is not None
+            and cpu_seconds is not None
+            and cpu_seconds >= cpu_budget - self.limits.poll_interval
+        ):
+            return Violation(
+                kind="cpu",
+                limit=self.limits.max_cpu_seconds,
+                action="restarted",
+                detail=f"CPU time reached {cpu_seconds:.1f} seconds",
+            )
+        return Violation(
+            kind="kernel_died", limit=None, action="restarted", detail=output.content
+        )
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+from app.codeinterpreter.component.llm.schema import File
+
+
+class BlobStore:
+    """Content-addressed (sha256) on-disk store of the session files
+
+    Blobs are refcounted by the sessions holding them, and the unreferenced
+    ones are evicted in LRU order once the store exceeds `max_bytes`.
+    """
+
+    def __init__(self, root: str = ".blobstore", max_bytes: int = 1 << 32) -> None:
+        self.root: str = root
+        self.max_bytes: int = max_bytes
+        self.n_hits: int = 0
+        self.n_misses: int = 0
+
+        self._lock = threading.Lock()
+        self._sizes: OrderedDict[str, int] = OrderedDict()  # NOTE: in LRU order
+        self._refcounts: dict[str, int] = {}
+
+        os.makedirs(root, exist_ok=True)
+        # NOTE: the blobs stored by the previous processes, as least recently used
+        for entry in sorted(os.scandir(root), key=lambda e: e.stat().st_atime):
+            if entry.is_file() and len(entry.name) == 64:
+                self._sizes[entry.name] = entry.stat().st_size
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                n_blobs=len(self._sizes),
+                total_bytes=self.total_bytes,
+                n_referenced=len(self._refcounts),
+                n_hits=self.n_hits,
+                n_misses=self.n_misses,
+            )
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest)
+
+    def put_stream(self, chunks: Iterable[bytes]) -> str:
+        """Store the content and acquire a reference to it, return the digest"""
+        h = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                if digest in self._sizes:
+                    self.n_hits += 1
+                    os.remove(tmp_path)
+                else:
+                    self.n_misses += 1
+                    os.replace(tmp_path, self.path(digest))
+                    self._sizes[digest] = os.path.getsize(self.path(digest))
+                self._acquire(digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+        return digest
+
+    def put(self, file: File) -> File:
+        """Store the file content, return the file referencing the blob"""
+        if file.digest and self.acquire(file.digest):
+            return file
+        digest = self.put_stream(file.iter_chunks())
+        return File(name=file.name, path=self.path(digest), digest=digest)
+
+    def _acquire(self, digest: str) -> None:
+        self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+        self._sizes.move_to_end(digest)
+
+    def acquire(self, digest: str) -> bool:
+        with self._lock:
+            if digest not in self._sizes:
+                return False
+            self._acquire(digest)
+            return True
+
+    def release(self, digest: str) -> None:
+        with self._lock:
+            n = self._refcounts.get(digest, 0) - 1
+            if n > 0:
+                self._refcounts[digest] = n
+            else:
+                self._refcounts.pop(digest, None)
+        self.evict()
+
+    def evict(self) -> int:
+        """Remove the unreferenced blobs in LRU order while exceeding `max_bytes`"""
+        n_evicted = 0
+        with self._lock:
+            total_bytes = self.total_bytes
+            for digest in list(self._sizes):
+                if total_bytes <= self.max_bytes:
+                    break
+                if digest in self._refcounts:
+                    continue
+                total_bytes -= self._sizes.pop(digest)
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+                n_evicted += 1
+        return n_evicted
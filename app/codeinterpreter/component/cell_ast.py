@@ -0,0 +1,196 @@
+import ast
+import contextlib
+import re
+from typing import Iterable, Iterator, Optional, Union
+
+# NOTE: ipython magics / shell commands / help (e.g. `df?`, `??df`), not python syntax
+MAGIC_LINE = re.compile(r"^\s*[%!]|^\s*(\?{1,2}[\w.]+|[\w.]+\?{1,2})\s*$")
+# NOTE: e.g. `files = !ls`
+MAGIC_ASSIGNMENT = re.compile(r"^(?P<indent>\s*)(?P<targets>[\w\s,]+?)\s*=\s*[%!]")
+# NOTE: the namespace cannot be tracked statically after these
+DYNAMIC_CALLS = frozenset(["exec", "eval", "globals", "vars", "locals", "__import__"])
+
+
+def mask_magics(code: str) -> str:
+    """Replace the ipython magic lines by `pass` keeping the line numbers"""
+    lines = code.split("\n")
+    for i, line in enumerate(lines):
+        if (m := MAGIC_ASSIGNMENT.match(line)) is not None:
+            lines[i] = f"{m['indent']}{m['targets']} = None"
+        elif MAGIC_LINE.search(line):
+            indent = line[: len(line) - len(line.lstrip())]
+            lines[i] = f"{indent}pass"
+    return "\n".join(lines)
+
+
+def parse_cell(code: str) -> ast.Module:
+    # NOTE: ipython allows `await` at the top level
+    flags = ast.PyCF_ONLY_AST | ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    return compile(mask_magics(code), "<cell>", "exec", flags=flags)
+
+
+def dotted_name(node: ast.AST) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class NameCollector(ast.NodeVisitor):
+    """Collect the names bound / loaded in the cell, ignoring the scopes
+
+    Coarse on purpose, a name bound in any scope is taken as defined, and
+    only the names loaded by the code surely run at the module level are
+    `evaluated` (not in the function bodies, the branches, the try blocks),
+    then it misses some undefined names but never reports a defined one.
+    """
+
+    def __init__(self) -> None:
+        self.bound: set[str] = set()
+        self.loaded: dict[str, int] = {}  # NOTE: name -> first line number, anywhere
+        self.evaluated: dict[str, int] = {}  # NOTE: loaded at the module level
+        self.aliases: dict[str, str] = {}  # NOTE: alias -> module
+        self.calls: list[tuple[str, int]] = []
+        self.is_dynamic: bool = False
+        self._n_deferred: int = 0
+
+    @contextlib.contextmanager
+    def _deferred(self) -> Iterator[None]:
+        """The code visited inside may not run (when the cell runs)"""
+        self._n_deferred += 1
+        try:
+            yield
+        finally:
+            self._n_deferred -= 1
+
+    def _visit_all(self, nodes: Iterable[Optional[ast.AST]]) -> None:
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def _visit_deferred(self, *nodes: Union[ast.AST, list, None]) -> None:
+        with self._deferred():
+            for node in nodes:
+                self._visit_all(node if isinstance(node, list) else [node])
+
+    def visit_Name(self, node: ast.Name) -> None:
+        if isinstance(node.ctx, ast.Load):
+            self.loaded.setdefault(node.id, node.lineno)
+            if self._n_deferred == 0:
+                self.evaluated.setdefault(node.id, node.lineno)
+        else:
+            self.bound.add(node.id)
+
+    def _visit_function(self, node: ast.AST) -> None:
+        # NOTE: the decorators, defaults and annotations run on the definition
+        self.bound.add(node.name)
+        self._visit_all(node.decorator_list)
+        self.visit(node.args)
+        self._visit_all([node.returns])
+        self._visit_deferred(node.body)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _visit_function
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self.bound.add(node.name)
+        self._visit_all(node.decorator_list)
+        self._visit_all(node.bases)
+        self._visit_all(node.keywords)
+        self._visit_deferred(node.body)
+
+    def visit_Lambda(self, node: ast.Lambda) -> None:
+        self.visit(node.args)
+        self._visit_deferred(node.body)
+
+    def visit_If(self, node: Union[ast.If, ast.While, ast.IfExp]) -> None:
+        self.visit(node.test)
+        self._visit_deferred(node.body, node.orelse)
+
+    visit_While = visit_IfExp = visit_If
+
+    def visit_For(self, node: Union[ast.For, ast.AsyncFor]) -> None:
+        self.visit(node.iter)
+        self.visit(node.target)
+        self._visit_deferred(node.body, node.orelse)
+
+    visit_AsyncFor = visit_For
+
+    def visit_Try(self, node: ast.AST) -> None:
+        # NOTE: e.g. `try: df` / `except NameError: df = ...`
+        self._visit_deferred(node.body, node.handlers, node.orelse, node.finalbody)
+
+    visit_TryStar = visit_Try
+
+    def visit_Match(self, node: ast.Match) -> None:
+        self.visit(node.subject)
+        self._visit_deferred(node.cases)
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> None:
+        self.visit(node.values[0])
+        self._visit_deferred(node.values[1:])
+
+    def _visit_comprehension(self, node: ast.AST) -> None:
+        # NOTE: only the first iterable runs at once (if not empty)
+        first, *rest = node.generators
+        self.visit(first.iter)
+        elements = (
+            [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+        )
+        self._visit_deferred(first.target, first.ifs, rest, elements)
+
+    visit_ListComp = visit_SetComp = visit_DictComp = _visit_comprehension
+    visit_GeneratorExp = _visit_comprehension
+
+    def visit_arg(self, node: ast.arg) -> None:
+        self.bound.add(node.arg)
+        self.generic_visit(node)
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            name = alias.asname or alias.name.split(".")[0]
+            self.bound.add(name)
+            self.aliases[name] = alias.name if alias.asname else name
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        for alias in node.names:
+            if alias.name == "*":
+                self.is_dynamic = True
+                continue
+            name = alias.asname or alias.name
+            self.bound.add(name)
+            self.aliases[name] = f"{node.module}.{alias.name}"
+
+    def visit_Global(self, node: ast.Global) -> None:
+        self.bound.update(node.names)
+
+    visit_Nonlocal = visit_Global
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> None:
+        if node.name:
+            self.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchAs(self, node: ast.MatchAs) -> None:
+        if node.name:
+            self.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchStar(self, node: ast.MatchStar) -> None:
+        if node.name:
+            self.bound.add(node.name)
+
+    def visit_MatchMapping(self, node: ast.MatchMapping) -> None:
+        if node.rest:
+            self.bound.add(node.rest)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call) -> None:
+        if (name := dotted_name(node.func)) is not None:
+            self.calls.append((name, node.lineno))
+            if name in DYNAMIC_CALLS:
+                self.is_dynamic = True
+        self.generic_visit(node)
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Literal
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema.messages import BaseMessage
+
+EventType = Literal[
+    "llm_start",
+    "token",
+    "tool_start",
+    "code_delta",
+    "code",
+    "stdout",
+    "status",
+    "file",
+    "final",
+]
+
+
+@dataclass
+class ResponseEvent:
+    """Event yielded while generating a Code Interpreter response
+
+    llm_start: None (the tokens of a new llm call follow), token: str,
+    tool_start: str (tool name), code_delta: str (new code lines while
+    generated), code: str, stdout: str,
+    status: str, file: File, final: CodeInterpreterResponse
+    """
+
+    type: EventType
+    content: Any = None
+
+
+class EventCallbackHandler(AsyncCallbackHandler):
+    """Forward the llm tokens and tool invocations of the agent as events"""
+
+    def __init__(self, emit: Callable[[ResponseEvent], None]) -> None:
+        self.emit = emit
+
+    async def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        **kwargs: Any,
+    ) -> None:
+        self.emit(ResponseEvent(type="llm_start"))
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.emit(ResponseEvent(type="token", content=token))
+
+    async def on_tool_start(
+        self, serialized: dict[str, Any], input_str: str, **kwargs: Any
+    ) -> None:
+        self.emit(ResponseEvent(type="tool_start", content=serialized.get("name")))
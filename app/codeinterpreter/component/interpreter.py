@@ -4,41 +4,80 @@
 オリジナルのライセンス:
 - MIT License
 """
+
+import ast
+import asyncio
 import base64
+import queue
 import re
+import threading
 import traceback
-from io import BytesIO
-from typing import Callable, Optional
+import weakref
+from typing import AsyncIterator, Callable, Iterator, Optional
 from uuid import UUID, uuid4
 
 from codeboxapi.schema import CodeBoxOutput, CodeBoxStatus
 from langchain.agents import AgentExecutor
+from langchain.callbacks.manager import Callbacks
 from langchain.memory import ConversationBufferMemory
 from langchain.memory.chat_message_histories import ChatMessageHistory
 from langchain.schema.language_model import BaseLanguageModel
 from langchain.tools import BaseTool
 from typing_extensions import Self
 
-from app.codebox.localbox import CustomLocalBox
+from app.codebox.checkpoint import CheckpointInfo, KernelCheckpointer
+from app.codebox.introspection import NamespaceIntrospector
+from app.codebox.localbox import ConnectionStats, CustomLocalBox
+from app.codebox.packages import PackageInstaller, distribution_for, missing_module
+from app.codebox.pool import CodeBoxPool
+from app.codebox.snapshot import DirectorySnapshot
+from app.codebox.supervisor import KernelSupervisor, ResourceLimits
+from app.codeinterpreter.component.asyncutil import run_sync
+from app.codeinterpreter.component.blobstore import BlobStore
+from app.codeinterpreter.component.events import (
+    EventCallbackHandler,
+    ResponseEvent,
+)
+from app.codeinterpreter.component.link_rewriter import remove_download_links
 from app.codeinterpreter.component.llm.agent_executer_factory import (
     create_agent_executor,
     create_tools,
 )
 from app.codeinterpreter.component.llm.chains import (
-    get_file_modifications,
-    remove_download_link,
+    aget_file_modifications,
+    aremove_download_link,
+)
+from app.codeinterpreter.component.llm.client_registry import (
+    LLMClientRegistry,
+    default_registry,
+)
+from app.codeinterpreter.component.llm.compactor import (
+    ObservationCompactor,
+    token_counter,
 )
+from app.codeinterpreter.component.llm.function_call_parser import (
+    StreamingFunctionCallParser,
+)
+from app.codeinterpreter.component.llm.llm_builder import buildup_llm
 from app.codeinterpreter.component.llm.schema import (
     CodeInterpreterResponse,
     File,
     UserRequest,
 )
+from app.codeinterpreter.component.memo import CellMemoizer
+from app.codeinterpreter.component.preflight import CodePreflight
+from app.codeinterpreter.component.transfer import adownload_files, aupload_files
+
+
+def _model_name(llm: BaseLanguageModel) -> str:
+    # NOTE: `model_name` of the openai models, `model` of the anthropic ones
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or "gpt-4"
 
 
 class CodeInterpreter:
     def __init__(
         self,
-        llm: Optional[BaseLanguageModel],
+        llm: Optional[BaseLanguageModel] = None,
         additional_tools: list[BaseTool] = [],
         **kwargs,
     ) -> None:
@@ -46,20 +85,100 @@ class CodeInterpreter:
         self.port: int = kwargs.get("port", 7801)
         self.max_iterations: int = kwargs.get("max_iterations", 10)
         self.verbose: bool = kwargs.get("verbose", False)
-        self.log_handler: Callable = kwargs.get("log_handler", lambda x: x)
+        self.log_handler: Callable = kwargs.get(
+            "log_handler", lambda text, is_code=False: None
+        )
+        # NOTE: detect output files by diffing the working directory, not by the llm
+        self.detect_modifications_by_llm: bool = kwargs.get(
+            "detect_modifications_by_llm", False
+        )
+        self.hash_content: bool = kwargs.get("hash_content", False)
+        # NOTE: the last snapshot of the working directory, its hashes reused
+        self._workdir_snapshot: Optional[DirectorySnapshot] = None
+        # NOTE: strip download links by the rewriter, not by the llm
+        self.remove_link_by_llm: bool = kwargs.get("remove_link_by_llm", False)
+
+        # NOTE: interrupt the cell running longer than this (seconds)
+        self.cell_timeout: Optional[float] = kwargs.get("cell_timeout", 120.0)
+        # NOTE: memory / cpu caps of the kernel, violations go back to the agent
+        self.resource_limits: ResourceLimits = kwargs.get(
+            "resource_limits", ResourceLimits(timeout=self.cell_timeout)
+        )
+        # NOTE: let the agent call multiple tools per turn, run concurrently
+        self.parallel_tool_calls: bool = kwargs.get("parallel_tool_calls", False)
+        # NOTE: install the missing modules (via the wheel cache) and rerun the cell
+        self.package_installer: Optional[PackageInstaller] = kwargs.get(
+            "package_installer", PackageInstaller()
+        )
+        self.max_install_reruns: int = kwargs.get("max_install_reruns", 2)
+        # NOTE: the distributions installed by the last `_run_installing`
+        self._installed_dists: list[str] = []
+        # NOTE: save / restore the kernel state to resume the session
+        self.checkpointer: Optional[KernelCheckpointer] = kwargs.get(
+            "checkpointer", None
+        )
+        # NOTE: check the code before running it, None to run it as is
+        self.preflight: Optional[CodePreflight] = kwargs.get(
+            "preflight", CodePreflight()
+        )
+        # NOTE: index the kernel variables / files after each cell for the agent
+        self.introspector: Optional[NamespaceIntrospector] = kwargs.get(
+            "introspector", NamespaceIntrospector()
+        )
+        # NOTE: return the cached output of the pure cells rerun on the same state
+        self.memoizer: Optional[CellMemoizer] = kwargs.get("memoizer", None)
+        # NOTE: show / syntax-check the code while the llm is generating it
+        self.stream_code: bool = kwargs.get("stream_code", False)
+        # NOTE: compact the outputs fed back to the llm, the code_log keeps them all
+        self.observation_compactor: Optional[Callable[[str], str]] = kwargs.get(
+            "observation_compactor", ObservationCompactor()
+        )
+        # NOTE: count the budget of the default compactor in the tokens of the llm
+        self._count_llm_tokens: bool = "observation_compactor" not in kwargs
+        self.max_transfer_concurrency: int = kwargs.get("max_transfer_concurrency", 4)
+        # NOTE: transfer multiple files as a single tar archive
+        self.bundle_transfer: bool = kwargs.get("bundle_transfer", False)
+        # NOTE: keep the session files in the content-addressed store if given
+        self.blob_store: Optional[BlobStore] = kwargs.get("blob_store", None)
+        self.blob_digests: list[str] = []
+
+        # NOTE: set while streaming the response events
+        self._event_queue: Optional[asyncio.Queue] = None
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # NOTE: the llm clients / connections shared with the other sessions
+        self.client_registry: LLMClientRegistry = kwargs.get(
+            "client_registry", default_registry
+        )
+
+        # NOTE: lease a pre-started codebox from the pool if given
+        self.pool: Optional[CodeBoxPool] = kwargs.get("pool", None)
 
         # instances
-        self.codebox: CustomLocalBox = CustomLocalBox(port=self.port)
+        self.codebox: CustomLocalBox = (
+            self.pool.lease() if self.pool else CustomLocalBox(port=self.port)
+        )
+        self.is_leased: bool = self.pool is not None
+        self._configure_codebox()
+        self.supervisor: KernelSupervisor = KernelSupervisor(self.resource_limits)
+        # NOTE: the thread lock excludes the sync callers (e.g. `checkpoint`),
+        #       the asyncio locks the parallel tool calls on each event loop
+        self._cell_lock = threading.Lock()
+        self._acell_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
         self.llm: BaseLanguageModel = None
         self.agent_executor: AgentExecutor = None
-        self.tools: list[BaseTool] = create_tools(self._run_handler, additional_tools)
+        self.tools: list[BaseTool] = create_tools(
+            self._run_handler, additional_tools, arun_handler=self._arun_handler
+        )
         self.memory = ConversationBufferMemory(
             memory_key="chat_history",
             return_messages=True,
             chat_memory=ChatMessageHistory(),
         )
 
-        self.update_llm(llm=llm)
+        # NOTE: build the llm from kwargs (e.g. `model`) if not given,
+        #       streaming the tokens as the `token` events
+        self.update_llm(llm=llm or buildup_llm(**{"streaming": True, **kwargs}))
 
         # contexts
         self.init_context()
@@ -68,28 +187,101 @@ class CodeInterpreter:
     def session_id(self) -> Optional[UUID]:
         return self.codebox.session_id
 
+    @property
+    def connection_stats(self) -> ConnectionStats:
+        return self.codebox.connection_stats
+
     def init_context(self) -> Self:
         self.input_files: list[File] = []
+        self.input_file_names: set[str] = set()
         self.output_files: list[File] = []
         self.code_log: list[tuple[str, str]] = []
         return self
 
     def update_llm(self, llm: BaseLanguageModel) -> Self:
         self.llm: BaseLanguageModel = llm
+        if self._count_llm_tokens:
+            self.observation_compactor = ObservationCompactor(
+                count_tokens=token_counter(_model_name(llm))
+            )
         self.agent_executor: AgentExecutor = create_agent_executor(
             llm=llm,
             tools=self.tools,
             max_iterations=self.max_iterations,
             memory=self.memory,
             verbose=self.verbose,
+            compact_observation=self.observation_compactor,
+            parallel_tool_calls=self.parallel_tool_calls,
+            on_function_call_delta=(
+                self._on_function_call_delta if self.stream_code else None
+            ),
+            context_provider=self._kernel_context,
         )
         return self
 
+    def _kernel_context(self) -> Optional[str]:
+        """The variables / files known so far, saving the exploratory cells"""
+        if self.introspector is None:
+            return None
+        return self.introspector.render_context()
+
     def update_log_handler(self, log_handler: Callable) -> Self:
         self.log_handler: Callable = log_handler
         return self
 
-    def _input_handler(self, request: UserRequest) -> None:
+    def _emit(self, event: ResponseEvent) -> None:
+        """Send the event to the `log_handler` and the streaming consumer"""
+        if event.type == "code":
+            self.log_handler(text=event.content, is_code=True)
+        elif event.type == "status":
+            self.log_handler(text=event.content)
+
+        if self._event_queue is not None:
+            # NOTE: may be called from the worker threads (e.g. kernel outputs)
+            self._event_loop.call_soon_threadsafe(self._event_queue.put_nowait, event)
+
+    def _emit_stdout(self, text: str) -> None:
+        self._emit(ResponseEvent(type="stdout", content=text))
+
+    def _on_function_call_delta(self, parser: StreamingFunctionCallParser) -> None:
+        new_lines = parser.new_lines()
+        if not new_lines:
+            return
+        n_lines = len(parser.complete_lines) - len(new_lines)
+        self._emit(
+            ResponseEvent(type="code_delta", content="\n".join(new_lines) + "\n")
+        )
+        # NOTE: report the syntax error once, found in the new lines
+        error = parser.check_syntax()
+        if error is not None and (error.lineno or 0) > n_lines:
+            self._emit(
+                ResponseEvent(
+                    type="status",
+                    content=f"SyntaxError: {error.msg} (line {error.lineno})",
+                )
+            )
+
+    def _add_output_files(self, files: list[File]) -> None:
+        self.output_files += files
+        for file in files:
+            self._emit(ResponseEvent(type="file", content=file))
+
+    async def _ato_blobs(self, files: list[File]) -> list[File]:
+        """Replace the files by the handles to the blobs in the store"""
+        if self.blob_store is None:
+            return files
+        files = await asyncio.gather(
+            *[asyncio.to_thread(self.blob_store.put, file) for file in files]
+        )
+        self.blob_digests += [file.digest for file in files]
+        return files
+
+    def _release_blobs(self) -> None:
+        for digest in self.blob_digests:
+            self.blob_store.release(digest)
+        self.blob_digests = []
+
+    async def _ainput_handler(self, request: UserRequest) -> None:
         """Callback function to handle user input."""
         if not request.files:
             return
@@ -98,80 +290,252 @@ class CodeInterpreter:
                 "I uploaded, just text me back and confirm that you got the file(s)."
             )
         request.content += "\n**The user uploaded the following files: **\n"
+        request.files = await self._ato_blobs(request.files)
         for file in request.files:
             self.input_files.append(file)
+            self.input_file_names.add(file.name)
             request.content += f"[Attachment: {file.name}]\n"
-            self.codebox.upload(file.name, file.content)
+        await aupload_files(
+            self.codebox,
+            request.files,
+            max_concurrency=self.max_transfer_concurrency,
+            bundle=self.bundle_transfer,
+        )
         request.content += "**File(s) are now available in the cwd. **\n"
 
-    def _parse_output_files(self, code: str, output: CodeBoxOutput) -> str:
+    def _input_handler(self, request: UserRequest) -> None:
+        run_sync(self._ainput_handler(request))
+
+    async def _aget_file_modifications(
+        self, code: str, before: DirectorySnapshot
+    ) -> Optional[list[str]]:
+        if self.detect_modifications_by_llm:
+            return await aget_file_modifications(code, self.llm)
+        after = await asyncio.to_thread(
+            self.codebox.snapshot, hash_content=self.hash_content, prev=before
+        )
+        self._workdir_snapshot = after
+        return before.diff(after)
+
+    async def _aparse_output_files(
+        self, code: str, output: CodeBoxOutput, before: DirectorySnapshot
+    ) -> str:
         if output.type == "image/png":
             filename = f"image-{uuid4()}.png"
-            file_buffer = BytesIO(base64.b64decode(output.content))
-            file_buffer.name = filename
-            self.output_files.append(File(name=filename, content=file_buffer.read()))
+            file = File(name=filename, content=base64.b64decode(output.content))
+            self._add_output_files(await self._ato_blobs([file]))
             return f"Image {filename} got send to the user."
 
         elif output.type == "error":
-            if "ModuleNotFoundError" in output.content:
-                if package := re.search(
-                    r"ModuleNotFoundError: No module named '(.*)'", output.content
-                ):
-                    self.codebox.install(package.group(1))
+            if (module := missing_module(output)) is not None:
+                if self.package_installer is None:
+                    await asyncio.to_thread(self.codebox.install, module)
                     return (
-                        f"{package.group(1)} was missing but "
-                        "got installed now. Please try again."
+                        f"{module} was missing but got installed now. Please try again."
                     )
+                return self._install_error(output, module)
             else:
                 # TODO: preanalyze error to optimize next code generation
                 pass
             if self.verbose:
                 print("Error:", output.content)
 
-        elif modifications := get_file_modifications(code, self.llm):
-            for filename in modifications:
-                if filename in [file.name for file in self.input_files]:
-                    continue
-                fileb = self.codebox.download(filename)
-                if not fileb.content:
-                    continue
-                file_buffer = BytesIO(fileb.content)
-                file_buffer.name = filename
-                self.output_files.append(
-                    File(name=filename, content=file_buffer.read())
-                )
+        elif modifications := await self._aget_file_modifications(code, before):
+            files = await adownload_files(
+                self.codebox,
+                [fn for fn in modifications if fn not in self.input_file_names],
+                max_concurrency=self.max_transfer_concurrency,
+                bundle=self.bundle_transfer,
+                blob_store=self.blob_store,
+            )
+            self.blob_digests += [file.digest for file in files if file.digest]
+            self._add_output_files(files)
 
         return output.content
 
-    def _run_handler(self, code: str):
+    async def _arun_handler(self, code: str):
         """Run code in container and send the output to the user"""
+        # NOTE: the parallel tool calls share the kernel, run the cells one by one
+        async with self._acell_lock():
+            await self._aacquire_cell_lock()
+            try:
+                return await self._arun_cell(code)
+            finally:
+                self._cell_lock.release()
+
+    def _acell_lock(self) -> asyncio.Lock:
+        """The lock of the cells run on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if (lock := self._acell_locks.get(loop)) is None:
+            lock = self._acell_locks[loop] = asyncio.Lock()
+        return lock
+
+    async def _aacquire_cell_lock(self) -> None:
+        """Acquire the thread lock, released again if cancelled while waiting"""
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self._cell_lock.acquire))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(lambda _: self._cell_lock.release())
+            raise
+
+    async def _apreflight(self, code: str) -> Optional[str]:
+        """Check the code before running it, return the error observation if any"""
+        if self.preflight is None:
+            return None
+        if self.preflight.known_globals is None and self.preflight.check_names:
+            await asyncio.to_thread(self._load_kernel_globals)
+        return self.preflight.check(code)
+
+    def _load_kernel_globals(self) -> None:
+        # NOTE: the whole list, not the tail kept by the box
+        max_output_chars = self.codebox.max_output_chars
+        self.codebox.max_output_chars = None
+        try:
+            output = self.codebox.run_stream("print(sorted(globals()))", timeout=10)
+        finally:
+            self.codebox.max_output_chars = max_output_chars
+        try:
+            self.preflight.reset(ast.literal_eval(output.content))
+        except (ValueError, SyntaxError):
+            pass
+
+    def _install_error(self, output: CodeBoxOutput, module: str) -> str:
+        """The module is still missing after `_run_installing`"""
+        dist = distribution_for(module)
+        if dist in self._installed_dists:
+            return (
+                f"{output.content}\n{dist} got installed but {module} still cannot "
+                "be imported, check the import name or use another package."
+            )
+        if len(self._installed_dists) >= self.max_install_reruns:
+            # NOTE: the installs succeeded, only the reruns ran out
+            return (
+                f"{output.content}\n{module} is missing, the other missing packages "
+                "got installed now. Please try again."
+            )
+        return f"{output.content}\n{dist} could not be installed, use another package."
+
+    def _run_installing(self, code: str) -> CodeBoxOutput:
+        """Run the code, install the missing modules and run it again"""
+        self._installed_dists = []
+        output = self.supervisor.run(self.codebox, code, on_output=self._emit_stdout)
+        for _ in range(self.max_install_reruns):
+            module = missing_module(output)
+            if module is None or self.package_installer is None:
+                break
+            self._emit(
+                ResponseEvent(
+                    type="status", content=f"{module} をインストールしています・・・"
+                )
+            )
+            if not self.package_installer.install(self.codebox, [module]):
+                break
+            self._installed_dists.append(distribution_for(module))
+            output = self.supervisor.run(
+                self.codebox, code, on_output=self._emit_stdout
+            )
+        return output
+
+    async def _arun_cell(self, code: str) -> str:
         print("code:", code)
-        self.log_handler(text=code, is_code=True)
-        self.log_handler(text="コードを実行しています・・・")
+        self._emit(ResponseEvent(type="code", content=code))
 
-        output: CodeBoxOutput = self.codebox.run(code)
+        if (error := await self._apreflight(code)) is not None:
+            self._emit(
+                ResponseEvent(
+                    type="status", content="実行前のチェックでエラーを検出しました"
+                )
+            )
+            self.code_log.append((code, error))
+            return error
+
+        memo_key = None
+        if self.memoizer is not None:
+            memo_key = await asyncio.to_thread(self.memoizer.key, self.codebox, code)
+            if memo_key is not None and (cached := self.memoizer.get(memo_key)):
+                self._emit(
+                    ResponseEvent(
+                        type="status", content="実行済みの同じコードの結果を返します"
+                    )
+                )
+                self._emit_stdout(cached.content)
+                self.code_log.append((code, cached.content))
+                return cached.content
+
+        self._emit(ResponseEvent(type="status", content="コードを実行しています・・・"))
+        before = await asyncio.to_thread(
+            self.codebox.snapshot,
+            hash_content=self.hash_content,
+            prev=self._workdir_snapshot,
+        )
+        self._workdir_snapshot = before
+        n_violations = len(self.supervisor.violations)
+        output: CodeBoxOutput = await asyncio.to_thread(self._run_installing, code)
         self.code_log.append((code, output.content))
+        if memo_key is not None:
+            self.memoizer.put(memo_key, output)
+        restarted = any(
+            v.action == "restarted" for v in self.supervisor.violations[n_violations:]
+        )
+        kernel_diff = await self._aintrospect(code, restarted)
 
         if not isinstance(output.content, str):
             raise TypeError("Expected output.content to be a string.")
 
-        self.log_handler(text="出力ファイルを抽出しています・・・")
-        content: str = self._parse_output_files(code=code, output=output)
+        self._emit(
+            ResponseEvent(type="status", content="出力ファイルを抽出しています・・・")
+        )
+        content: str = await self._aparse_output_files(
+            code=code, output=output, before=before
+        )
+        if kernel_diff:
+            content += f"\n{kernel_diff}"
         return content
 
-    def _output_handler(self, final_response: str) -> CodeInterpreterResponse:
-        """Embed images in the response"""
+    async def _aintrospect(self, code: str, restarted: bool) -> str:
+        """Track the kernel globals after the cell, return the diff line if any"""
+        diff = None
+        if self.introspector is not None:
+            if restarted:
+                self.introspector.reset()
+            diff = await asyncio.to_thread(self.introspector.refresh, self.codebox)
+        if self.preflight is not None:
+            if diff is not None:
+                self.preflight.reset(self.introspector.index.names)
+            elif restarted:
+                self.preflight.reset()
+            else:
+                self.preflight.update(code)
+        if diff is None or diff.is_empty:
+            return ""
+        return self.introspector.render_diff(diff)
+
+    def _run_handler(self, code: str):
+        return run_sync(self._arun_handler(code))
+
+    async def _aremove_links_by_llm(self, final_response: str) -> str:
         for file in self.output_files:
             if str(file.name) in final_response:
                 # rm ![Any](file.name) from the response
                 final_response = re.sub(r"\n\n!\[.*\]\(.*\)", "", final_response)
 
-        if self.output_files and re.search(r"\n\[.*\]\(.*\)", final_response):
+        if re.search(r"\n\[.*\]\(.*\)", final_response):
             try:
-                final_response = remove_download_link(final_response, self.llm)
+                final_response = await aremove_download_link(final_response, self.llm)
             except Exception as e:
                 if self.verbose:
                     print("Error while removing download links:", e)
+        return final_response
+
+    async def _aoutput_handler(self, final_response: str) -> CodeInterpreterResponse:
+        """Embed images in the response"""
+        if self.output_files and not self.remove_link_by_llm:
+            final_response = remove_download_links(
+                final_response, [file.name for file in self.output_files]
+            )
+        elif self.output_files:
+            final_response = await self._aremove_links_by_llm(final_response)
 
         output_files = self.output_files
         code_log = self.code_log
@@ -182,19 +546,27 @@ class CodeInterpreter:
             content=final_response, files=output_files, code_log=code_log
         )
 
-    def generate_response_sync(
+    def _output_handler(self, final_response: str) -> CodeInterpreterResponse:
+        return run_sync(self._aoutput_handler(final_response))
+
+    async def agenerate_response(
         self,
         user_msg: str,
         files: list[File] = [],
-        streaming: bool = True,  # TODO: implement
+        callbacks: Callbacks = None,
     ) -> CodeInterpreterResponse:
         """Generate a Code Interpreter response based on the user's input."""
         user_request = UserRequest(content=user_msg, files=files)
         try:
-            self._input_handler(user_request)
+            await asyncio.to_thread(self.ensure_connected)
+            await self._ainput_handler(user_request)
             assert self.agent_executor, "Session not initialized."
-            response = self.agent_executor.run(input=user_request.content)
-            return self._output_handler(response)
+            # NOTE: the llm calls of the response reuse the keep-alive connections
+            async with self.client_registry.aiohttp_session():
+                response = await self.agent_executor.arun(
+                    input=user_request.content, callbacks=callbacks
+                )
+                return await self._aoutput_handler(response)
         except Exception as e:
             if self.verbose:
                 traceback.print_exc()
@@ -204,18 +576,160 @@ class CodeInterpreter:
                 "please restart the session."
             )
 
+    def generate_response_sync(
+        self,
+        user_msg: str,
+        files: list[File] = [],
+        streaming: bool = True,  # NOTE: use `stream_response_sync` for streaming
+    ) -> CodeInterpreterResponse:
+        """Generate a Code Interpreter response based on the user's input."""
+        return run_sync(self.agenerate_response(user_msg=user_msg, files=files))
+
+    async def astream_response(
+        self,
+        user_msg: str,
+        files: list[File] = [],
+    ) -> AsyncIterator[ResponseEvent]:
+        """Yield the events as they happen, the last one is the `final` response"""
+        event_queue: asyncio.Queue = asyncio.Queue()
+        self._event_queue = event_queue
+        self._event_loop = asyncio.get_running_loop()
+        task = asyncio.create_task(
+            self.agenerate_response(
+                user_msg=user_msg,
+                files=files,
+                callbacks=[EventCallbackHandler(self._emit)],
+            )
+        )
+        task.add_done_callback(lambda _: event_queue.put_nowait(None))
+        try:
+            while (event := await event_queue.get()) is not None:
+                yield event
+            yield ResponseEvent(type="final", content=task.result())
+        finally:
+            self._event_queue, self._event_loop = None, None
+            if not task.done():
+                task.cancel()
+
+    def stream_response_sync(
+        self,
+        user_msg: str,
+        files: list[File] = [],
+    ) -> Iterator[ResponseEvent]:
+        """Sync version of `astream_response`, generating on a worker thread"""
+        events: queue.Queue = queue.Queue()
+
+        async def _produce() -> None:
+            try:
+                async for event in self.astream_response(user_msg, files):
+                    events.put(event)
+            finally:
+                events.put(None)
+
+        threading.Thread(target=asyncio.run, args=(_produce(),), daemon=True).start()
+        while (event := events.get()) is not None:
+            yield event
+
+    def _configure_codebox(self) -> None:
+        # NOTE: the box keeps the whole output if compacted for the llm
+        self.codebox.max_output_chars = (
+            None if self.observation_compactor is not None else 500
+        )
+        self._workdir_snapshot = None
+        self._reset_kernel_state()
+
+    def _reset_kernel_state(self) -> None:
+        """Forget what is known about the kernel, e.g. on a new kernel"""
+        if self.preflight is not None:
+            self.preflight.reset()
+        if self.introspector is not None:
+            self.introspector.reset()
+
     def is_running(self) -> bool:
         return self.codebox.status() == "running"
 
     def start(self) -> CodeBoxStatus:
-        return self.codebox.start()
+        if self.pool is None:
+            return self.codebox.start()
+        if not self.is_leased:
+            self.codebox = self.pool.lease()
+            self.is_leased = True
+            self._configure_codebox()
+        return CodeBoxStatus(status="started")
 
     def stop(self) -> CodeBoxStatus:
-        return self.codebox.stop()
+        if self.blob_store is not None:
+            self._release_blobs()
+        if self.pool is None:
+            return self.codebox.stop()
+        if self.is_leased:
+            self.pool.release(self.codebox)
+            self.is_leased = False
+        return CodeBoxStatus(status="stopped")
+
+    async def ais_running(self) -> bool:
+        return await asyncio.to_thread(self.is_running)
+
+    async def astart(self) -> CodeBoxStatus:
+        # NOTE: the codebox keeps the sync websocket, `LocalBox` cannot mix both
+        return await asyncio.to_thread(self.start)
+
+    async def astop(self) -> CodeBoxStatus:
+        return await asyncio.to_thread(self.stop)
+
+    def interrupt(self) -> CodeBoxStatus:
+        return self.codebox.interrupt()
+
+    def ensure_connected(self) -> CodeBoxStatus:
+        return self.codebox.ensure_connected()
 
-    def reconnect(self) -> None:
+    def reconnect(self, checkpoint_id: Optional[str] = None) -> None:
+        """Replace the kernel with a new one, restored from the checkpoint if given"""
         self.init_context()
-        self.codebox.connect()
+        with self._cell_lock:
+            self.codebox.connect()
+            self._reset_kernel_state()
+        if checkpoint_id is not None:
+            self.restore(checkpoint_id)
+
+    @classmethod
+    def from_checkpoint(
+        cls, checkpoint_id: str, checkpointer: KernelCheckpointer, **kwargs
+    ) -> Self:
+        """Start a session (e.g. on another host) resumed from the checkpoint"""
+        interpreter = cls(checkpointer=checkpointer, **kwargs)
+        interpreter.start()
+        interpreter.restore(checkpoint_id)
+        return interpreter
+
+    def checkpoint(self, checkpoint_id: Optional[str] = None) -> CheckpointInfo:
+        """Save the kernel variables and the working directory to resume later"""
+        if self.checkpointer is None:
+            raise RuntimeError("No checkpointer given")
+        with self._cell_lock:
+            return self.checkpointer.save(self.codebox, checkpoint_id or uuid4().hex)
+
+    def restore(self, checkpoint_id: str) -> CheckpointInfo:
+        """Load the checkpoint into the current (e.g. a fresh pooled) kernel"""
+        if self.checkpointer is None:
+            raise RuntimeError("No checkpointer given")
+        with self._cell_lock:
+            info = self.checkpointer.restore(self.codebox, checkpoint_id)
+            diff = None
+            if self.introspector is not None:
+                self.introspector.reset()
+                diff = self.introspector.refresh(self.codebox)
+        if self.preflight is not None:
+            self.preflight.reset(
+                None if diff is None else self.introspector.index.names
+            )
+        return info
+
+    async def acheckpoint(self, checkpoint_id: Optional[str] = None) -> CheckpointInfo:
+        return await asyncio.to_thread(self.checkpoint, checkpoint_id)
+
+    async def arestore(self, checkpoint_id: str) -> CheckpointInfo:
+        return await asyncio.to_thread(self.restore, checkpoint_id)
 
     def __enter__(self) -> Self:
         self.start()
@@ -223,3 +737,10 @@ class CodeInterpreter:
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         self.stop()
+
+    async def __aenter__(self) -> Self:
+        await self.astart()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.astop()
@@ -0,0 +1,97 @@
+import os
+import re
+from typing import Iterable, Iterator, Optional
+
+# NOTE: ![alt](target "title") / [text](target "title")
+_MARKDOWN_LINK = re.compile(
+    r"(?P<image>!?)\[(?P<text>[^\]\n]*)\]\((?P<target>[^)\s]+)(?:\s+\"[^\"\n]*\")?\)"
+)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])")
+_DOWNLOAD_WORDS = re.compile(r"download|ダウンロード", re.IGNORECASE)
+# NOTE: the opening / closing line of a fenced code block
+_FENCE = re.compile(r"^\s*(?P<fence>`{3,}|~{3,})")
+
+
+def _is_sandbox_link(target: str, filenames: set[str]) -> bool:
+    if target.startswith("sandbox:"):
+        return True
+    name = os.path.basename(target.split("?")[0].split("#")[0])
+    return name in filenames
+
+
+def _rewrite_sentence(sentence: str, filenames: set[str]) -> str:
+    removed = False
+
+    def _replace(m: re.Match) -> str:
+        nonlocal removed
+        if not _is_sandbox_link(m["target"], filenames):
+            return m.group(0)
+        removed = True
+        # NOTE: images are sent to the user as files, drop them entirely
+        return "" if m["image"] else m["text"]
+
+    rewritten = _MARKDOWN_LINK.sub(_replace, sentence)
+    if removed and _DOWNLOAD_WORDS.search(sentence):
+        # e.g. "You can download the file [here](sandbox:/x.csv)."
+        return ""
+    return rewritten
+
+
+def _rewrite_line(line: str, filenames: set[str]) -> str:
+    if "](" not in line:
+        return line
+    sentences = _SENTENCE_END.split(line)
+    rewritten = [_rewrite_sentence(s, filenames) for s in sentences]
+    if rewritten == sentences:
+        return line
+
+    joined = ""
+    for sentence in filter(None, (s.strip() for s in rewritten)):
+        # NOTE: no space between japanese sentences
+        sep = "" if not joined or joined.endswith(("。", "！", "？")) else " "
+        joined += sep + sentence
+    # NOTE: keep the indent, e.g. of a nested list item
+    return line[: len(line) - len(line.lstrip())] + joined if joined else ""
+
+
+def _rewrite_lines(lines: list[str], filenames: set[str]) -> Iterator[Optional[str]]:
+    """Yield the rewritten lines, None for the removed ones"""
+    fence: Optional[str] = None
+    for line in lines:
+        if (m := _FENCE.match(line)) is not None:
+            # NOTE: closed by the same kind of fence, at least as long
+            if fence is None:
+                fence = m["fence"]
+            elif m["fence"].startswith(fence):
+                fence = None
+            yield line
+        elif fence is not None:
+            yield line
+        else:
+            rewritten = _rewrite_line(line, filenames)
+            yield None if line.strip() and not rewritten.strip() else rewritten
+
+
+def remove_download_links(text: str, filenames: Iterable[str]) -> str:
+    """Remove the markdown links to the sandbox files from the response
+
+    Links pointing to `sandbox:` or to one of `filenames` are removed,
+    the sentences offering a download of them are dropped as well. The rest
+    of the text (e.g. the code blocks) is left as is.
+    """
+    filenames = set(filenames)
+    result: list[str] = []
+    after_removed = False
+    for line in _rewrite_lines(text.split("\n"), filenames):
+        if line is None:
+            after_removed = True
+            continue
+        # NOTE: squash the blank line left around the removed line
+        if after_removed and not line.strip() and not (result and result[-1].strip()):
+            after_removed = False
+            continue
+        after_removed = False
+        result.append(line)
+    if after_removed and result and not result[-1].strip():
+        result.pop()
+    return "\n".join(result)
@@ -1,6 +1,6 @@
-from typing import Callable
+from typing import Awaitable, Callable, Optional, Union
 
-from langchain.agents import AgentExecutor, BaseSingleActionAgent
+from langchain.agents import AgentExecutor, BaseMultiActionAgent, BaseSingleActionAgent
 from langchain.callbacks.base import BaseCallbackManager
 from langchain.memory import ConversationBufferMemory
 from langchain.memory.chat_message_histories import ChatMessageHistory
@@ -8,13 +8,21 @@ from langchain.prompts.chat import MessagesPlaceholder
 from langchain.schema.language_model import BaseLanguageModel
 from langchain.tools import BaseTool, StructuredTool
 
-from app.codeinterpreter.component.llm.agents import OpenAIFunctionsAgent
+from app.codeinterpreter.component.llm.agents import (
+    OpenAIFunctionsAgent,
+    OpenAIMultiFunctionsAgent,
+)
+from app.codeinterpreter.component.llm.function_call_parser import (
+    StreamingFunctionCallParser,
+)
 from app.codeinterpreter.component.llm.prompts import code_interpreter_system_message
 from app.codeinterpreter.component.llm.schema import CodeInput
 
 
 def create_tools(
-    run_handler: Callable, additional_tools: list[BaseTool]
+    run_handler: Callable,
+    additional_tools: list[BaseTool],
+    arun_handler: Optional[Callable[..., Awaitable]] = None,
 ) -> list[BaseTool]:
     return additional_tools + [
         StructuredTool(
@@ -24,7 +32,7 @@ def create_tools(
             "be really long, so you can use the `;` character to split lines. "
             "Variables are preserved between runs. ",
             func=run_handler,
-            # coroutine=self._arun_handler,
+            coroutine=arun_handler,
             args_schema=CodeInput,
         ),
     ]
@@ -37,6 +45,12 @@ def create_agent_executor(
     memory: ConversationBufferMemory = None,
     callback_manager: BaseCallbackManager = None,
     verbose: bool = False,
+    compact_observation: Optional[Callable[[str], str]] = None,
+    parallel_tool_calls: bool = False,
+    on_function_call_delta: Optional[
+        Callable[[StreamingFunctionCallParser], None]
+    ] = None,
+    context_provider: Optional[Callable[[], Optional[str]]] = None,
 ) -> AgentExecutor:
     # NOTE: no specfy the memory, then create a memory
     memory = memory or ConversationBufferMemory(
@@ -45,7 +59,14 @@ def create_agent_executor(
         chat_memory=ChatMessageHistory(),
     )
     return AgentExecutor.from_agent_and_tools(
-        agent=_create_agent(llm, tools),
+        agent=_create_agent(
+            llm,
+            tools,
+            compact_observation,
+            parallel_tool_calls,
+            on_function_call_delta,
+            context_provider,
+        ),
         max_iterations=max_iterations,
         tools=tools,
         memory=memory,
@@ -55,14 +76,28 @@ def create_agent_executor(
 
 
 def _create_agent(
-    llm: BaseLanguageModel, tools: list[BaseTool]
-) -> BaseSingleActionAgent:
+    llm: BaseLanguageModel,
+    tools: list[BaseTool],
+    compact_observation: Optional[Callable[[str], str]] = None,
+    parallel_tool_calls: bool = False,
+    on_function_call_delta: Optional[
+        Callable[[StreamingFunctionCallParser], None]
+    ] = None,
+    context_provider: Optional[Callable[[], Optional[str]]] = None,
+) -> Union[BaseSingleActionAgent, BaseMultiActionAgent]:
     # from langchain.agents import AgentOutputParser
 
-    return OpenAIFunctionsAgent.from_llm_and_tools(
+    # NOTE: multiple tool calls per model turn, run concurrently by `arun`
+    agent_class = (
+        OpenAIMultiFunctionsAgent if parallel_tool_calls else OpenAIFunctionsAgent
+    )
+    return agent_class.from_llm_and_tools(
         llm=llm,
         tools=tools,
         system_message=code_interpreter_system_message,
         extra_prompt_messages=[MessagesPlaceholder(variable_name="chat_history")],
+        compact_observation=compact_observation,
+        on_function_call_delta=on_function_call_delta,
+        context_provider=context_provider,
         # output_parser=AgentOutputParser(),
     )
@@ -7,11 +7,13 @@
 
 """Module implements an agent that uses OpenAI's APIs function enabled API."""
 import json
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from json import JSONDecodeError
-from typing import Any, List, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
 
-from langchain.agents import BaseSingleActionAgent
+from langchain.agents import BaseMultiActionAgent, BaseSingleActionAgent
 from langchain.callbacks.base import BaseCallbackManager
 from langchain.callbacks.manager import Callbacks
 from langchain.chat_models.openai import ChatOpenAI
@@ -36,7 +38,13 @@ from langchain.schema.messages import (
 )
 from langchain.tools import BaseTool
 from langchain.tools.convert_to_openai import format_tool_to_openai_function
-from pydantic import root_validator
+from pydantic import BaseModel, PrivateAttr, root_validator
+from typing_extensions import Self
+
+from app.codeinterpreter.component.llm.function_call_parser import (
+    StreamingFunctionCallParser,
+)
+from app.codeinterpreter.component.llm.llm_cache import lookup_message, update_message
 
 
 @dataclass
@@ -45,7 +53,10 @@ class _FunctionsAgentAction(AgentAction):
 
 
 def _convert_agent_action_to_messages(
-    agent_action: AgentAction, observation: str
+    agent_action: AgentAction,
+    observation: str,
+    compact_observation: Optional[Callable[[str], str]] = None,
+    with_message_log: bool = True,
 ) -> List[BaseMessage]:
     """Convert an agent action to a message.
 
@@ -53,25 +64,32 @@ def _convert_agent_action_to_messages(
 
     Args:
         agent_action: Agent action to convert.
+        compact_observation: compacts the observation fed back to the LLM
+        with_message_log: False if the AI message is already converted by
+            another action of the same (parallel) tool calls
 
     Returns:
         AIMessage that corresponds to the original tool invocation.
     """
     if isinstance(agent_action, _FunctionsAgentAction):
-        return agent_action.message_log + [
-            _create_function_message(agent_action, observation)
+        message_log = agent_action.message_log if with_message_log else []
+        return message_log + [
+            _create_function_message(agent_action, observation, compact_observation)
         ]
     else:
         return [AIMessage(content=agent_action.log)]
 
 
 def _create_function_message(
-    agent_action: AgentAction, observation: str
+    agent_action: AgentAction,
+    observation: str,
+    compact_observation: Optional[Callable[[str], str]] = None,
 ) -> FunctionMessage:
     """Convert agent action and observation into a function message.
     Args:
         agent_action: the tool invocation request from the agent
         observation: the result of the tool invocation
+        compact_observation: compacts the observation fed back to the LLM
     Returns:
         FunctionMessage that corresponds to the original tool invocation
     """
@@ -82,30 +100,82 @@ def _create_function_message(
             content = str(observation)
     else:
         content = observation
+    if compact_observation is not None:
+        content = compact_observation(content)
     return FunctionMessage(
         name=agent_action.tool,
         content=content,
     )
 
 
+def _snapshot_inputs(inputs: dict) -> dict:
+    # NOTE: the lists (e.g. the chat history) copied, the memory appends to it
+    return {k: tuple(v) if isinstance(v, list) else v for k, v in inputs.items()}
+
+
+def _is_same_inputs(inputs: dict, snapshot: dict) -> bool:
+    """Compare the lists by the identity of the items (e.g. the messages)
+
+    The messages are not modified once added, the snapshot keeps them alive
+    not to have their ids reused.
+    """
+    if inputs.keys() != snapshot.keys():
+        return False
+    for k, v in inputs.items():
+        prev = snapshot[k]
+        if isinstance(v, list):
+            if not isinstance(prev, tuple) or len(v) != len(prev):
+                return False
+            if any(a is not b for a, b in zip(v, prev)):
+                return False
+        elif v != prev:
+            return False
+    return True
+
+
 def _format_intermediate_steps(
     intermediate_steps: List[Tuple[AgentAction, str]],
+    compact_observation: Optional[Callable[[str], str]] = None,
 ) -> List[BaseMessage]:
     """Format intermediate steps.
     Args:
         intermediate_steps: Steps the LLM has taken to date, along with observations
+        compact_observation: compacts the observations fed back to the LLM
     Returns:
         list of messages to send to the LLM for the next prediction
     """
     messages = []
 
+    prev_message_log = None
     for intermediate_step in intermediate_steps:
         agent_action, observation = intermediate_step
-        messages.extend(_convert_agent_action_to_messages(agent_action, observation))
+        message_log = getattr(agent_action, "message_log", None)
+        messages.extend(
+            _convert_agent_action_to_messages(
+                agent_action,
+                observation,
+                compact_observation,
+                with_message_log=message_log is None
+                or message_log is not prev_message_log,
+            )
+        )
+        prev_message_log = message_log
 
     return messages
 
 
+def _unpack_tool_input(_tool_input: dict) -> Union[str, dict]:
+    # HACK HACK HACK:
+    # The code that encodes tool input into Open AI uses a special variable
+    # name called `__arg1` to handle old style tools that do not expose a
+    # schema and expect a single string argument as an input.
+    # We unpack the argument here if it exists.
+    # Open AI does not support passing in a JSON array as an argument.
+    if "__arg1" in _tool_input:
+        return _tool_input["__arg1"]
+    return _tool_input
+
+
 def _parse_ai_message(message: BaseMessage) -> Union[AgentAction, AgentFinish]:
     """Parse an AI message."""
     if not isinstance(message, AIMessage):
@@ -129,17 +199,7 @@ def _parse_ai_message(message: BaseMessage) -> Union[AgentAction, AgentFinish]:
                     f"the `arguments` is not valid JSON."
                 )
 
-        # HACK HACK HACK:
-        # The code that encodes tool input into Open AI uses a special variable
-        # name called `__arg1` to handle old style tools that do not expose a
-        # schema and expect a single string argument as an input.
-        # We unpack the argument here if it exists.
-        # Open AI does not support passing in a JSON array as an argument.
-        if "__arg1" in _tool_input:
-            tool_input = _tool_input["__arg1"]
-        else:
-            tool_input = _tool_input
-
+        tool_input = _unpack_tool_input(_tool_input)
         content_msg = "responded: {content}\n" if message.content else "\n"
 
         return _FunctionsAgentAction(
@@ -152,8 +212,109 @@ def _parse_ai_message(message: BaseMessage) -> Union[AgentAction, AgentFinish]:
     return AgentFinish(return_values={"output": message.content}, log=message.content)
 
 
-class OpenAIFunctionsAgent(BaseSingleActionAgent):
-    """An Agent driven by OpenAIs function powered API.
+TOOL_SELECTION = "tool_selection"
+# NOTE: the runs whose scratchpads are kept, e.g. the concurrent ones
+_MAX_CACHED_RUNS = 8
+
+
+def _create_tool_selection_function(functions: List[dict]) -> dict:
+    """Wrap the tool functions into a function taking a list of tool calls"""
+    return {
+        "name": TOOL_SELECTION,
+        "description": "A list of actions to take. "
+        "The independent actions are run in parallel.",
+        "parameters": {
+            "title": TOOL_SELECTION,
+            "type": "object",
+            "properties": {
+                "actions": {
+                    "title": "actions",
+                    "type": "array",
+                    "items": {
+                        "title": "tool_call",
+                        "type": "object",
+                        "properties": {
+                            "action_name": {
+                                "title": "action_name",
+                                "enum": [f["name"] for f in functions],
+                                "type": "string",
+                                "description": "Name of the action to take. "
+                                "The name provided here should match up with "
+                                "the parameters for the action below.",
+                            },
+                            "action": {
+                                "title": "Action",
+                                "anyOf": [f["parameters"] for f in functions],
+                            },
+                        },
+                        "required": ["action_name", "action"],
+                    },
+                }
+            },
+            "required": ["actions"],
+        },
+    }
+
+
+def _parse_tool_call(action: Any) -> Tuple[str, Union[str, dict]]:
+    """The tool name and input of a `tool_selection` item"""
+    if not (
+        isinstance(action, dict)
+        and isinstance(action.get("action_name"), str)
+        and isinstance(action.get("action"), dict)
+    ):
+        raise OutputParserException(
+            f"Could not parse tool call: {action} because it has no "
+            f"`action_name` or `action`."
+        )
+    return action["action_name"], _unpack_tool_input(action["action"])
+
+
+def _parse_ai_message_multi(
+    message: BaseMessage,
+) -> Union[List[AgentAction], AgentFinish]:
+    """Parse an AI message calling the tools in parallel."""
+    if not isinstance(message, AIMessage):
+        raise TypeError(f"Expected an AI message got {type(message)}")
+
+    function_call = message.additional_kwargs.get("function_call", {})
+    if not function_call:
+        return AgentFinish(
+            return_values={"output": message.content}, log=message.content
+        )
+    if function_call["name"] != TOOL_SELECTION:
+        # NOTE: the model called a tool directly
+        return [_parse_ai_message(message)]
+
+    try:
+        actions = json.loads(function_call["arguments"])["actions"]
+    except (JSONDecodeError, KeyError, TypeError):
+        raise OutputParserException(
+            f"Could not parse tool input: {function_call} because "
+            f"the `arguments` is not valid JSON with `actions`."
+        )
+    if not isinstance(actions, list) or not actions:
+        raise OutputParserException(f"No actions given: {function_call}")
+
+    content_msg = "responded: {content}\n" if message.content else "\n"
+    # NOTE: the actions share the message log, converted once into the scratchpad
+    message_log = [message]
+    agent_actions = []
+    for action in actions:
+        function_name, tool_input = _parse_tool_call(action)
+        agent_actions.append(
+            _FunctionsAgentAction(
+                tool=function_name,
+                tool_input=tool_input,
+                log=f"\nInvoking: `{function_name}` with `{tool_input}`\n{content_msg}\n",
+                message_log=message_log,
+            )
+        )
+    return agent_actions
+
+
+class _BaseOpenAIFunctionsAgent(BaseModel):
+    """The shared part of the agents driven by OpenAIs function powered API.
 
     Args:
         llm: This should be an instance of ChatOpenAI, specifically a model
@@ -162,15 +323,54 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
         prompt: The prompt for this agent, should support agent_scratchpad as one
             of the variables. For an easy way to construct this prompt, use
             `OpenAIFunctionsAgent.create_prompt(...)`
+        compact_observation: compacts the tool outputs fed back to the LLM,
+            e.g. `ObservationCompactor()`. Not compacted if None.
+        on_function_call_delta: called with the parser on each streamed chunk,
+            e.g. to show the code while generated. Not streamed if None.
+        context_provider: returns the context (e.g. the kernel variables) sent
+            as a system message after the input on each call, not kept in the
+            memory. No context if None.
     """
 
     llm: BaseLanguageModel
     tools: Sequence[BaseTool]
     prompt: BasePromptTemplate
+    compact_observation: Optional[Callable[[str], str]] = None
+    on_function_call_delta: Optional[Callable[[StreamingFunctionCallParser], None]] = (
+        None
+    )
+    context_provider: Optional[Callable[[], Optional[str]]] = None
+
+    # NOTE: the function specs / tool names built once per tool set
+    _tools_key: Optional[tuple] = PrivateAttr(default=None)
+    _functions: List[dict] = PrivateAttr(default_factory=list)
+    _allowed_tools: List[str] = PrivateAttr(default_factory=list)
+    # NOTE: the formatted prompt prefix and the snapshot of its inputs
+    _prefix_cache: Optional[Tuple[dict, List[BaseMessage]]] = PrivateAttr(default=None)
+    # NOTE: id(intermediate_steps) -> (intermediate_steps, n, n-th step, scratchpad)
+    #       per run, extended by the new steps only. The runs (e.g. concurrent
+    #       `arun`s) each append to their own list of the steps.
+    _scratchpad_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _scratchpad_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _ensure_tool_cache(self) -> None:
+        tools_key = tuple((id(t), t.name, t.description) for t in self.tools)
+        if tools_key == self._tools_key:
+            return
+        self._functions = self._build_functions()
+        self._allowed_tools = [t.name for t in self.tools]
+        self._tools_key = tools_key
+
+    def _build_functions(self) -> List[dict]:
+        return [dict(format_tool_to_openai_function(t)) for t in self.tools]
+
+    def _parse_message(self, message: BaseMessage) -> Union[AgentAction, AgentFinish]:
+        return _parse_ai_message(message)
 
     def get_allowed_tools(self) -> List[str]:
         """Get allowed tools."""
-        return list([t.name for t in self.tools])
+        self._ensure_tool_cache()
+        return self._allowed_tools
 
     @root_validator
     def validate_llm(cls, values: dict) -> dict:
@@ -195,15 +395,143 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
 
     @property
     def functions(self) -> List[dict]:
-        return [dict(format_tool_to_openai_function(t)) for t in self.tools]
+        """The OpenAI function specs of the tools, cached until the tools change"""
+        self._ensure_tool_cache()
+        return self._functions
 
-    def plan(
+    def _format_prefix(self, **kwargs: Any) -> List[BaseMessage]:
+        """Format the prompt without the scratchpad, reused while the inputs are"""
+        selected_inputs = {
+            k: kwargs[k] for k in self.prompt.input_variables if k != "agent_scratchpad"
+        }
+        if self._prefix_cache is not None and _is_same_inputs(
+            selected_inputs, self._prefix_cache[0]
+        ):
+            return self._prefix_cache[1]
+        prompt = self.prompt.format_prompt(**selected_inputs, agent_scratchpad=[])
+        prefix = prompt.to_messages()
+        self._prefix_cache = (_snapshot_inputs(selected_inputs), prefix)
+        return prefix
+
+    def _format_scratchpad(
+        self, intermediate_steps: List[Tuple[AgentAction, str]]
+    ) -> List[BaseMessage]:
+        """Convert only the steps added since the previous call of the run"""
+        run_key = id(intermediate_steps)
+        with self._scratchpad_lock:
+            entry = self._scratchpad_cache.pop(run_key, None)
+        n, scratchpad = 0, []
+        # NOTE: the executor appends to the list, the last converted step tells
+        #       it was not truncated / replaced since
+        if entry is not None:
+            steps, n_cached, last_step, cached = entry
+            if (
+                steps is intermediate_steps
+                and n_cached <= len(steps)
+                and (n_cached == 0 or steps[n_cached - 1] is last_step)
+            ):
+                n, scratchpad = n_cached, cached
+        # NOTE: a new list, the returned scratchpads are not modified afterwards
+        scratchpad = scratchpad + _format_intermediate_steps(
+            intermediate_steps[n:], self.compact_observation
+        )
+        entry = (
+            intermediate_steps,
+            len(intermediate_steps),
+            intermediate_steps[-1] if intermediate_steps else None,
+            scratchpad,
+        )
+        with self._scratchpad_lock:
+            self._scratchpad_cache[run_key] = entry
+            while len(self._scratchpad_cache) > _MAX_CACHED_RUNS:
+                self._scratchpad_cache.popitem(last=False)
+        return scratchpad
+
+    def _context_messages(self) -> List[BaseMessage]:
+        if self.context_provider is None:
+            return []
+        context = self.context_provider()
+        return [SystemMessage(content=context)] if context else []
+
+    def _build_messages(
+        self, intermediate_steps: List[Tuple[AgentAction, str]], **kwargs: Any
+    ) -> List[BaseMessage]:
+        if not self._is_scratchpad_last:
+            agent_scratchpad = _format_intermediate_steps(
+                intermediate_steps, self.compact_observation
+            )
+            selected_inputs = {
+                k: kwargs[k]
+                for k in self.prompt.input_variables
+                if k != "agent_scratchpad"
+            }
+            full_inputs = dict(**selected_inputs, agent_scratchpad=agent_scratchpad)
+            return (
+                self.prompt.format_prompt(**full_inputs).to_messages()
+                + self._context_messages()
+            )
+        return (
+            self._format_prefix(**kwargs)
+            + self._context_messages()
+            + self._format_scratchpad(intermediate_steps)
+        )
+
+    @property
+    def _is_scratchpad_last(self) -> bool:
+        # NOTE: the prefix is reusable if the scratchpad comes last as `create_prompt`
+        messages = getattr(self.prompt, "messages", None)
+        return bool(messages) and (
+            isinstance(messages[-1], MessagesPlaceholder)
+            and messages[-1].variable_name == "agent_scratchpad"
+        )
+
+    def _replay_cached(self, message: BaseMessage) -> BaseMessage:
+        parser = StreamingFunctionCallParser()
+        parser.feed(message.content, message.additional_kwargs.get("function_call"))
+        self.on_function_call_delta(parser)
+        return message
+
+    def _predict_streaming(
+        self, messages: List[BaseMessage], callbacks: Callbacks = None
+    ) -> BaseMessage:
+        # NOTE: `stream` bypasses the llm cache, looked up here by the same key
+        #       as `predict_messages`
+        cached = lookup_message(self.llm, messages, functions=self.functions)
+        if cached is not None:
+            return self._replay_cached(cached)
+        parser = StreamingFunctionCallParser()
+        for chunk in self.llm.stream(
+            messages, config={"callbacks": callbacks}, functions=self.functions
+        ):
+            parser.feed_chunk(chunk)
+            self.on_function_call_delta(parser)
+        message = parser.to_message()
+        update_message(self.llm, messages, message, functions=self.functions)
+        return message
+
+    async def _apredict_streaming(
+        self, messages: List[BaseMessage], callbacks: Callbacks = None
+    ) -> BaseMessage:
+        cached = lookup_message(self.llm, messages, functions=self.functions)
+        if cached is not None:
+            return self._replay_cached(cached)
+        parser = StreamingFunctionCallParser()
+        async for chunk in self.llm.astream(
+            messages, config={"callbacks": callbacks}, functions=self.functions
+        ):
+            parser.feed_chunk(chunk)
+            self.on_function_call_delta(parser)
+        message = parser.to_message()
+        update_message(self.llm, messages, message, functions=self.functions)
+        return message
+
+    def _plan(
         self,
         intermediate_steps: List[Tuple[AgentAction, str]],
         callbacks: Callbacks = None,
         with_functions: bool = True,
         **kwargs: Any,
-    ) -> Union[AgentAction, AgentFinish]:
+    ) -> Union[AgentAction, List[AgentAction], AgentFinish]:
         """Given input, decided what to do.
 
         Args:
@@ -213,14 +541,10 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
         Returns:
             Action specifying what tool to use.
         """
-        agent_scratchpad = _format_intermediate_steps(intermediate_steps)
-        selected_inputs = {
-            k: kwargs[k] for k in self.prompt.input_variables if k != "agent_scratchpad"
-        }
-        full_inputs = dict(**selected_inputs, agent_scratchpad=agent_scratchpad)
-        prompt = self.prompt.format_prompt(**full_inputs)
-        messages = prompt.to_messages()
-        if with_functions:
+        messages = self._build_messages(intermediate_steps, **kwargs)
+        if with_functions and self.on_function_call_delta is not None:
+            predicted_message = self._predict_streaming(messages, callbacks)
+        elif with_functions:
             predicted_message = self.llm.predict_messages(
                 messages,
                 functions=self.functions,
@@ -231,15 +555,15 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
                 messages,
                 callbacks=callbacks,
             )
-        agent_decision = _parse_ai_message(predicted_message)
+        agent_decision = self._parse_message(predicted_message)
         return agent_decision
 
-    async def aplan(
+    async def _aplan(
         self,
         intermediate_steps: List[Tuple[AgentAction, str]],
         callbacks: Callbacks = None,
         **kwargs: Any,
-    ) -> Union[AgentAction, AgentFinish]:
+    ) -> Union[AgentAction, List[AgentAction], AgentFinish]:
         """Given input, decided what to do.
 
         Args:
@@ -250,17 +574,14 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
         Returns:
             Action specifying what tool to use.
         """
-        agent_scratchpad = _format_intermediate_steps(intermediate_steps)
-        selected_inputs = {
-            k: kwargs[k] for k in self.prompt.input_variables if k != "agent_scratchpad"
-        }
-        full_inputs = dict(**selected_inputs, agent_scratchpad=agent_scratchpad)
-        prompt = self.prompt.format_prompt(**full_inputs)
-        messages = prompt.to_messages()
-        predicted_message = await self.llm.apredict_messages(
-            messages, functions=self.functions, callbacks=callbacks
-        )
-        agent_decision = _parse_ai_message(predicted_message)
+        messages = self._build_messages(intermediate_steps, **kwargs)
+        if self.on_function_call_delta is not None:
+            predicted_message = await self._apredict_streaming(messages, callbacks)
+        else:
+            predicted_message = await self.llm.apredict_messages(
+                messages, functions=self.functions, callbacks=callbacks
+            )
+        agent_decision = self._parse_message(predicted_message)
         return agent_decision
 
     def return_stopped_response(
@@ -277,7 +598,7 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
             )
         elif early_stopping_method == "generate":
             # Generate does one final forward pass
-            agent_decision = self.plan(
+            agent_decision = self._plan(
                 intermediate_steps, with_functions=False, **kwargs
             )
             if type(agent_decision) == AgentFinish:  # noqa: E721
@@ -338,7 +659,7 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
             content="You are a helpful AI assistant."
         ),
         **kwargs: Any,
-    ) -> BaseSingleActionAgent:
+    ) -> Self:
         """Construct an agent from an LLM and tools."""
         if not isinstance(llm, ChatOpenAI):
             raise ValueError("Only supported with ChatOpenAI models.")
@@ -353,3 +674,63 @@ class OpenAIFunctionsAgent(BaseSingleActionAgent):
             callback_manager=callback_manager,  # type: ignore
             **kwargs,
         )
+
+
+class OpenAIFunctionsAgent(_BaseOpenAIFunctionsAgent, BaseSingleActionAgent):
+    """An Agent driven by OpenAIs function powered API, one tool per model turn."""
+
+    def plan(
+        self,
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        with_functions: bool = True,
+        **kwargs: Any,
+    ) -> Union[AgentAction, AgentFinish]:
+        """Given input, decided what to do (see `_plan`)."""
+        return self._plan(intermediate_steps, callbacks, with_functions, **kwargs)
+
+    async def aplan(
+        self,
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> Union[AgentAction, AgentFinish]:
+        """Given input, decided what to do (see `_aplan`)."""
+        return await self._aplan(intermediate_steps, callbacks, **kwargs)
+
+
+class OpenAIMultiFunctionsAgent(_BaseOpenAIFunctionsAgent, BaseMultiActionAgent):
+    """An OpenAIFunctionsAgent calling multiple tools per model turn.
+
+    The tools are offered as a single `tool_selection` function taking a list
+    of tool calls. `plan` / `aplan` return the list of the actions, which the
+    `AgentExecutor` runs concurrently on the async path (`arun`), and all the
+    observations are fed back in one step.
+    """
+
+    def plan(
+        self,
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        with_functions: bool = True,
+        **kwargs: Any,
+    ) -> Union[List[AgentAction], AgentFinish]:
+        """Given input, decided what to do (see `_plan`)."""
+        return self._plan(intermediate_steps, callbacks, with_functions, **kwargs)
+
+    async def aplan(
+        self,
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> Union[List[AgentAction], AgentFinish]:
+        """Given input, decided what to do (see `_aplan`)."""
+        return await self._aplan(intermediate_steps, callbacks, **kwargs)
+
+    def _build_functions(self) -> List[dict]:
+        return [_create_tool_selection_function(super()._build_functions())]
+
+    def _parse_message(
+        self, message: BaseMessage
+    ) -> Union[List[AgentAction], AgentFinish]:
+        return _parse_ai_message_multi(message)
@@ -0,0 +1,108 @@
+import contextlib
+import hashlib
+import threading
+from typing import Any, AsyncIterator, Optional
+
+import aiohttp
+import openai
+import requests
+from langchain.cache import BaseCache
+from langchain.chat_models.base import BaseChatModel
+from requests.adapters import HTTPAdapter
+
+# NOTE: (provider, endpoint, digest of the api key)
+ClientKey = tuple[str, str, str]
+
+
+class LLMClientRegistry:
+    """Reuse the llm clients and their HTTP connections across the requests
+
+    The models are built once per (provider, endpoint, key) and params, so
+    rebuilding the llm (e.g. on changing the model) returns the same client.
+    The openai requests go through one pooled keep-alive session: openai
+    (<1.0) takes a single module-level session, which pools the connections
+    per host and sends the keys as headers.
+    """
+
+    def __init__(self, pool_maxsize: int = 16) -> None:
+        self.pool_maxsize: int = pool_maxsize
+        self.n_created: int = 0
+        self.n_reused: int = 0
+
+        self._lock = threading.Lock()
+        self._models: dict[tuple, BaseChatModel] = {}
+        self._session: Optional[requests.Session] = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                n_clients=len({key for _, key, _, _ in self._models}),
+                n_models=len(self._models),
+                n_created=self.n_created,
+                n_reused=self.n_reused,
+            )
+
+    @staticmethod
+    def key(
+        provider: str, endpoint: Optional[str], api_key: Optional[str]
+    ) -> ClientKey:
+        digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return (provider, endpoint or "", digest)
+
+    def get(
+        self,
+        key: ClientKey,
+        model_cls: type[BaseChatModel],
+        llm_cache: Optional[BaseCache] = None,
+        **params: Any,
+    ) -> BaseChatModel:
+        """The model of the class and params for the client, built once
+
+        `llm_cache` is the own cache of the model (see `ScopedLLMCacheMixin`).
+        """
+        model_key = (model_cls, key, llm_cache, tuple(sorted(params.items())))
+        with self._lock:
+            if (model := self._models.get(model_key)) is not None:
+                self.n_reused += 1
+                return model
+        model = model_cls(**params)
+        if llm_cache is not None:
+            model._llm_cache = llm_cache
+        with self._lock:
+            self.n_created += 1
+            return self._models.setdefault(model_key, model)
+
+    def requests_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize)
+                self._session = requests.Session()
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+            return self._session
+
+    def install_openai_session(self) -> None:
+        """Let the sync openai requests share the pooled session"""
+        openai.requestssession = self.requests_session()
+
+    @contextlib.asynccontextmanager
+    async def aiohttp_session(self) -> AsyncIterator[None]:
+        """Share one keep-alive session by the async openai requests inside
+
+        openai (<1.0) opens a new aiohttp session per async request otherwise.
+        The session is bound to the running event loop, so it is scoped here.
+        """
+        if openai.aiosession.get() is not None:
+            yield
+            return
+        connector = aiohttp.TCPConnector(limit=self.pool_maxsize)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            token = openai.aiosession.set(session)
+            try:
+                yield
+            finally:
+                openai.aiosession.reset(token)
+
+
+# NOTE: shared by the llms built by `buildup_llm` in this process
+default_registry = LLMClientRegistry()
@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_TRACEBACK_HEAD = "Traceback (most recent call last):"
+
+
+def _count_tokens_approx(text: str) -> int:
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def token_counter(model_name: str = "gpt-4") -> Callable[[str], int]:
+    """Return the token counter of the model, approximated if tiktoken is missing"""
+    if tiktoken is None:
+        return _count_tokens_approx
+    try:
+        encoding = tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+@dataclass
+class ObservationCompactor:
+    """Compact the tool outputs (observations) fed back to the llm
+
+    The full outputs are kept in `CodeInterpreter.code_log`, only the
+    scratchpad messages of the agent get compacted.
+    """
+
+    # NOTE: utf-8 bytes of the observation, split into the head and the tail
+    max_bytes: int = 8000
+    head_ratio: float = 0.3
+    # NOTE: rows of a printed table kept at the head and at the tail each
+    max_table_rows: int = 10
+    dedup_tracebacks: bool = True
+    # NOTE: token budget checked after the byte budget, None not to count tokens
+    max_tokens: Optional[int] = 2000
+    count_tokens: Callable[[str], int] = _count_tokens_approx
+
+    def __call__(self, observation: str) -> str:
+        return self.compact(observation)
+
+    def compact(self, observation: str) -> str:
+        text = observation
+        if self.dedup_tracebacks:
+            text = dedup_tracebacks(text)
+        text = truncate_tables(text, self.max_table_rows)
+        compacted = truncate_bytes(text, self.max_bytes, self.head_ratio)
+        if self.max_tokens is None:
+            return compacted
+
+        # NOTE: shrink the byte budget in proportion until within the tokens
+        max_bytes = len(compacted.encode("utf-8"))
+        while (n_tokens := self.count_tokens(compacted)) > self.max_tokens:
+            max_bytes = int(max_bytes * self.max_tokens / n_tokens * 0.95)
+            if max_bytes <= 0:
+                return ""
+            compacted = truncate_bytes(text, max_bytes, self.head_ratio)
+        return compacted
+
+
+def _collapse_repeated_lines(lines: list[str]) -> list[str]:
+    collapsed: list[str] = []
+    n_repeated = 0
+    for i, line in enumerate(lines):
+        if i > 0 and line == lines[i - 1] and line.strip():
+            n_repeated += 1
+            continue
+        if n_repeated:
+            collapsed.append(f"[Previous line repeated {n_repeated} more times]")
+            n_repeated = 0
+        collapsed.append(line)
+    if n_repeated:
+        collapsed.append(f"[Previous line repeated {n_repeated} more times]")
+    return collapsed
+
+
+def _split_tracebacks(lines: list[str]) -> list[list[str]]:
+    # NOTE: a traceback is the head, the indented frames and the exception line
+    blocks: list[list[str]] = []
+    i = 0
+    while i < len(lines):
+        if not lines[i].startswith(_TRACEBACK_HEAD):
+            blocks.append([lines[i]])
+            i += 1
+            continue
+        j = i + 1
+        while j < len(lines) and lines[j][:1].isspace():
+            j += 1
+        blocks.append(lines[i : j + 1])
+        i = j + 1
+    return blocks
+
+
+def dedup_tracebacks(text: str) -> str:
+    """Drop the tracebacks identical to a preceding one and collapse repeated lines
+
+    e.g. the same warning / error printed in a loop, or a deep recursion
+    """
+    if "\n" not in text:
+        return text
+    blocks = _split_tracebacks(text.split("\n"))
+
+    deduped: list[str] = []
+    seen: dict[str, int] = {}
+    for block in blocks:
+        if not block[0].startswith(_TRACEBACK_HEAD):
+            deduped += block
+            continue
+        key = "\n".join(block).strip()
+        if key in seen:
+            seen[key] += 1
+            continue
+        seen[key] = 0
+        deduped += block
+    n_dropped = sum(seen.values())
+    if n_dropped:
+        deduped.append(f"[{n_dropped} identical tracebacks omitted]")
+    return "\n".join(_collapse_repeated_lines(deduped))
+
+
+def _table_width(line: str) -> int:
+    return len(line.split())
+
+
+def truncate_tables(text: str, max_rows: int) -> str:
+    """Keep the header and `max_rows` rows at the head / tail of long tables
+
+    A table is a run of lines splitting into the same number of columns,
+    e.g. a printed pandas dataframe or a numpy array.
+    """
+    lines = text.split("\n")
+    if len(lines) <= 2 * max_rows + 2:
+        return text
+
+    truncated: list[str] = []
+    i = 0
+    while i < len(lines):
+        width = _table_width(lines[i])
+        j = i + 1
+        # NOTE: the header line has one column less than the rows (the index)
+        if j < len(lines) and _table_width(lines[j]) == width + 1:
+            width += 1
+            j += 1
+        while j < len(lines) and width > 1 and _table_width(lines[j]) == width:
+            j += 1
+
+        n_rows = j - i - 1
+        if n_rows > 2 * max_rows:
+            n_omitted = n_rows - 2 * max_rows
+            truncated += lines[i : i + 1 + max_rows]
+            truncated.append(f"... [{n_omitted} rows omitted]")
+            truncated += lines[j - max_rows : j]
+        else:
+            truncated += lines[i:j]
+        i = j
+    return "\n".join(truncated)
+
+
+def truncate_bytes(text: str, max_bytes: int, head_ratio: float = 0.3) -> str:
+    """Keep the head and the tail of the text within `max_bytes` (utf-8)
+
+    The cut points are moved to the line boundaries where possible.
+    """
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+
+    n_head = int(max_bytes * head_ratio)
+    n_tail = max_bytes - n_head
+    head = encoded[:n_head].decode("utf-8", errors="ignore")
+    tail = encoded[len(encoded) - n_tail :].decode("utf-8", errors="ignore")
+    if "\n" in head:
+        head = head[: head.rindex("\n")]
+    if "\n" in tail:
+        tail = tail[tail.index("\n") + 1 :]
+
+    n_omitted = len(encoded) - len(head.encode("utf-8")) - len(tail.encode("utf-8"))
+    return f"{head}\n[... {n_omitted} bytes truncated ...]\n{tail}"
@@ -0,0 +1,186 @@
+import codeop
+import json
+import re
+from typing import Any, Optional
+
+from langchain.schema.messages import AIMessage, BaseMessage
+
+# NOTE: the head of `{"code": "...` of the python tool arguments
+_CODE_ARGUMENT_HEAD = re.compile(r'^\s*\{\s*"code"\s*:\s*"')
+# NOTE: a head cut in the middle, e.g. `{"co`
+_PARTIAL_CODE_ARGUMENT_HEAD = re.compile(
+    r'^\s*(\{\s*("(c(o(d(e("\s*(:\s*)?)?)?)?)?)?)?)?$'
+)
+# NOTE: the complete characters and escape sequences of a json string body
+_JSON_STRING_BODY = re.compile(r'(?:[^"\\]|\\u[0-9a-fA-F]{4}|\\[^u])*')
+# NOTE: a high surrogate waiting for the low one, e.g. `\ud83d`
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+# NOTE: the lines continuing the statement above at the top level
+_CONTINUATION = re.compile(r"^(else|elif|except|finally)\b")
+
+
+def _split_json_string_body(body: str) -> tuple[str, str, bool]:
+    """Split the body into the decodable head, the rest and whether it is closed"""
+    m = _JSON_STRING_BODY.match(body)
+    head, rest = body[: m.end()], body[m.end() :]
+    if rest.startswith('"'):
+        return head, "", True
+    if (s := _HIGH_SURROGATE.search(head)) and _is_unescaped(head, s.start()):
+        head, rest = head[: s.start()], head[s.start() :] + rest
+    return head, rest, False
+
+
+def _is_unescaped(body: str, index: int) -> bool:
+    n_backslashes = len(body[:index]) - len(body[:index].rstrip("\\"))
+    return n_backslashes % 2 == 0
+
+
+def _is_statement_start(line: str) -> bool:
+    return bool(line) and line[0] not in " \t#" and not _CONTINUATION.match(line)
+
+
+class StreamingFunctionCallParser:
+    """Assemble the `function_call` of an AI message from the streamed deltas
+
+    The code of the python tool is available while it is still generated,
+    either from the json `{"code": "..."}` or from the raw code the model
+    sometimes puts into `arguments` (see `_parse_ai_message`).
+    """
+
+    def __init__(self, code_tool: str = "python") -> None:
+        self.code_tool: str = code_tool
+        self.content: str = ""
+        self.name: str = ""
+        self.arguments: str = ""
+        self._n_emitted_lines: int = 0
+
+        # NOTE: the arguments are decoded incrementally, `_n_decoded` chars of
+        #       them so far, `_pending` an escape sequence cut in the middle
+        self._mode: Optional[str] = None  # NOTE: "json", "closed", "raw", "none"
+        self._n_decoded: int = 0
+        self._pending: str = ""
+        self._code: str = ""
+        self._lines: list[str] = []
+        self._tail: str = ""
+        # NOTE: the line the last top-level statement starts at, checked from
+        self._n_checked_lines: int = 0
+        self._statement_start: int = 0
+        self._syntax_error: Optional[SyntaxError] = None
+
+    @property
+    def is_function_call(self) -> bool:
+        return bool(self.name)
+
+    def feed(self, content: str = "", function_call: Optional[dict] = None) -> None:
+        """Feed a delta, `function_call` of {"name": ..., "arguments": ...}"""
+        self.content += content or ""
+        if function_call:
+            self.name += function_call.get("name") or ""
+            self.arguments += function_call.get("arguments") or ""
+
+    def feed_chunk(self, chunk: BaseMessage) -> None:
+        """Feed an `AIMessageChunk` streamed by the chat model"""
+        self.feed(chunk.content, chunk.additional_kwargs.get("function_call"))
+
+    def _decode(self) -> None:
+        """Decode the arguments fed since the previous call"""
+        if self._mode is None:
+            self._detect_mode()
+            if self._mode is None:
+                return
+
+        delta = self.arguments[self._n_decoded :]
+        self._n_decoded = len(self.arguments)
+        if self._mode == "raw":
+            self._append_code(delta)
+        elif self._mode == "json" and delta:
+            head, self._pending, is_closed = _split_json_string_body(
+                self._pending + delta
+            )
+            try:
+                self._append_code(json.loads(f'"{head}"'))
+            except json.JSONDecodeError:
+                self._mode, self._code, self._lines, self._tail = "none", "", [], ""
+                return
+            if is_closed:
+                self._mode = "closed"
+
+    def _detect_mode(self) -> None:
+        if (m := _CODE_ARGUMENT_HEAD.match(self.arguments)) is not None:
+            self._mode, self._n_decoded = "json", m.end()
+        elif _PARTIAL_CODE_ARGUMENT_HEAD.match(self.arguments) is None:
+            # NOTE: the raw code, or not the code at all, e.g. `{"path": ...`
+            is_json = self.arguments.lstrip().startswith("{")
+            self._mode = "none" if is_json else "raw"
+
+    def _append_code(self, text: str) -> None:
+        self._code += text
+        *lines, self._tail = (self._tail + text).split("\n")
+        self._lines += lines
+
+    @property
+    def code(self) -> str:
+        """The code generated so far, empty if not calling the code tool"""
+        if self.name != self.code_tool:
+            return ""
+        self._decode()
+        return self._code
+
+    @property
+    def complete_lines(self) -> list[str]:
+        """The code lines terminated by a newline"""
+        if self.name != self.code_tool:
+            return []
+        self._decode()
+        return self._lines
+
+    def new_lines(self) -> list[str]:
+        """The complete lines of the code not returned yet"""
+        lines = self.complete_lines
+        new_lines = lines[self._n_emitted_lines :]
+        self._n_emitted_lines = len(lines)
+        return new_lines
+
+    def check_syntax(self) -> Optional[SyntaxError]:
+        """Check the complete lines, an incomplete statement is not an error
+
+        Only the lines from the last complete top-level statement are compiled,
+        the first error found is kept.
+        """
+        lines = self.complete_lines
+        if self._syntax_error is not None or not lines:
+            return self._syntax_error
+        for i in range(
+            max(self._n_checked_lines, self._statement_start + 1), len(lines)
+        ):
+            if _is_statement_start(lines[i]) and self._compile(i) is not None:
+                self._statement_start = i
+            if self._syntax_error is not None:
+                return self._syntax_error
+        self._n_checked_lines = len(lines)
+        self._compile(len(lines))
+        return self._syntax_error
+
+    def _compile(self, end: int) -> Any:
+        """Compile the lines of the last statement up to `end`, None if incomplete"""
+        source = "\n".join(self._lines[self._statement_start : end]) + "\n"
+        try:
+            return codeop.compile_command(source, "<cell>", "exec")
+        except SyntaxError as e:
+            if e.lineno is not None:
+                e.lineno += self._statement_start
+            self._syntax_error = e
+        except (ValueError, OverflowError):
+            pass
+        return None
+
+    def to_message(self, **kwargs: Any) -> AIMessage:
+        """The assembled message to parse as `_parse_ai_message`"""
+        additional_kwargs = {}
+        if self.is_function_call:
+            additional_kwargs["function_call"] = dict(
+                name=self.name, arguments=self.arguments
+            )
+        return AIMessage(
+            content=self.content, additional_kwargs=additional_kwargs, **kwargs
+        )
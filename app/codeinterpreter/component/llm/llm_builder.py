@@ -1,13 +1,32 @@
 from os import getenv
 from typing import Optional
 
-from langchain.chat_models import AzureChatOpenAI, ChatAnthropic, ChatOpenAI
+from langchain.cache import BaseCache
 from langchain.chat_models.base import BaseChatModel
 
+from app.codeinterpreter.component.llm.client_registry import (
+    LLMClientRegistry,
+    default_registry,
+)
+from app.codeinterpreter.component.llm.llm_cache import (
+    CachedAzureChatOpenAI,
+    CachedChatAnthropic,
+    CachedChatOpenAI,
+)
+
 
 def buildup_llm(
-    model: str = "gpt-4", openai_api_key: Optional[str] = None, **kwargs
+    model: str = "gpt-4",
+    openai_api_key: Optional[str] = None,
+    llm_cache: Optional[BaseCache] = None,
+    client_registry: Optional[LLMClientRegistry] = None,
+    streaming: bool = False,
+    **kwargs,
 ) -> BaseChatModel:
+    # NOTE: `streaming` calls back `on_llm_new_token` on `predict_messages` too
+    # NOTE: reuse the client (and its connections) built for the same key
+    registry = client_registry or default_registry
+    # NOTE: `llm_cache` is scoped to the built model, not set globally
     if "gpt" in model:
         openai_api_key = openai_api_key or getenv("OPENAI_API_KEY", None)
         if openai_api_key is None:
@@ -20,6 +39,7 @@ def buildup_llm(
         openai_api_base = getenv("OPENAI_API_BASE")
         deployment_name = getenv("DEPLOYMENT_NAME")
         openapi_type = getenv("OPENAI_API_TYPE")
+        registry.install_openai_session()
 
         if (
             openapi_type == "azure"
@@ -27,7 +47,10 @@ def buildup_llm(
             and openai_api_base
             and deployment_name
         ):
-            return AzureChatOpenAI(
+            return registry.get(
+                registry.key("azure", openai_api_base, openai_api_key),
+                CachedAzureChatOpenAI,
+                llm_cache=llm_cache,
                 temperature=0.03,
                 openai_api_base=openai_api_base,
                 openai_api_version=openai_api_version,
@@ -35,16 +58,29 @@ def buildup_llm(
                 openai_api_key=openai_api_key,
                 max_retries=3,
                 request_timeout=60 * 3,
+                streaming=streaming,
             )  # type: ignore
         else:
-            return ChatOpenAI(
+            return registry.get(
+                registry.key("openai", openai_api_base, openai_api_key),
+                CachedChatOpenAI,
+                llm_cache=llm_cache,
                 temperature=0.03,
                 model=model,
                 openai_api_key=openai_api_key,
                 max_retries=3,
                 request_timeout=60 * 3,
+                streaming=streaming,
             )  # type: ignore
     elif "claude" in model:
-        return ChatAnthropic(model=model)
+        return registry.get(
+            registry.key(
+                "anthropic", getenv("ANTHROPIC_API_URL"), getenv("ANTHROPIC_API_KEY")
+            ),
+            CachedChatAnthropic,
+            llm_cache=llm_cache,
+            model=model,
+            streaming=streaming,
+        )
     else:
         raise ValueError(f"Unknown model: {model} (expected gpt or claude model)")
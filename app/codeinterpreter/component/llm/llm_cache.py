@@ -0,0 +1,282 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import langchain
+from langchain.cache import RETURN_VAL_TYPE, BaseCache
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models import AzureChatOpenAI, ChatAnthropic, ChatOpenAI
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+from langchain.schema import ChatGeneration, ChatResult
+from langchain.schema.language_model import BaseLanguageModel
+from langchain.schema.messages import BaseMessage
+from pydantic import PrivateAttr
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return "\n".join(line.rstrip() for line in value.strip().split("\n"))
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def normalize_prompt(prompt: str) -> str:
+    """The prompt (json of the messages) without the insignificant whitespaces"""
+    try:
+        return json.dumps(_normalize(json.loads(prompt)), sort_keys=True)
+    except json.JSONDecodeError:
+        return _normalize(prompt)
+
+
+def set_llm_cache(cache: Optional[BaseCache]) -> None:
+    """Set the cache used by every llm (langchain has one global cache)"""
+    langchain.llm_cache = cache
+
+
+def model_cache(llm: BaseLanguageModel) -> Optional[BaseCache]:
+    """The cache of the model (see `ScopedLLMCacheMixin`), else the global one"""
+    if getattr(llm, "cache", None) is False:
+        return None
+    if (cache := getattr(llm, "_llm_cache", None)) is not None:
+        return cache
+    return langchain.llm_cache
+
+
+def lookup_message(
+    llm: BaseLanguageModel, messages: list[BaseMessage], **kwargs: Any
+) -> Optional[BaseMessage]:
+    """The cached response to the messages, e.g. for the streamed calls
+
+    The key is the same as `predict_messages(messages, **kwargs)` uses.
+    """
+    if (cache := model_cache(llm)) is None:
+        return None
+    generations = cache.lookup(dumps(messages), llm._get_llm_string(**kwargs))
+    if not generations:
+        return None
+    return generations[0].message
+
+
+def update_message(
+    llm: BaseLanguageModel,
+    messages: list[BaseMessage],
+    message: BaseMessage,
+    **kwargs: Any,
+) -> None:
+    """Cache the response (e.g. assembled from the stream) to the messages"""
+    if (cache := model_cache(llm)) is None:
+        return
+    cache.update(
+        dumps(messages),
+        llm._get_llm_string(**kwargs),
+        [ChatGeneration(message=message)],
+    )
+
+
+class ScopedLLMCacheMixin:
+    """Cache the responses of the chat model in its own `_llm_cache`
+
+    langchain looks up the global `langchain.llm_cache` shared by every llm in
+    the process, used here only if the model has no cache of its own.
+    """
+
+    def _generate_with_cache(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if (cache := getattr(self, "_llm_cache", None)) is None:
+            return super()._generate_with_cache(messages, stop, run_manager, **kwargs)
+        prompt, llm_string = dumps(messages), self._get_llm_string(stop=stop, **kwargs)
+        if isinstance(generations := cache.lookup(prompt, llm_string), list):
+            return ChatResult(generations=generations)
+        result = self._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        cache.update(prompt, llm_string, result.generations)
+        return result
+
+    async def _agenerate_with_cache(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if (cache := getattr(self, "_llm_cache", None)) is None:
+            return await super()._agenerate_with_cache(
+                messages, stop, run_manager, **kwargs
+            )
+        prompt, llm_string = dumps(messages), self._get_llm_string(stop=stop, **kwargs)
+        if isinstance(generations := cache.lookup(prompt, llm_string), list):
+            return ChatResult(generations=generations)
+        result = await self._agenerate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+        cache.update(prompt, llm_string, result.generations)
+        return result
+
+
+class CachedChatOpenAI(ScopedLLMCacheMixin, ChatOpenAI):
+    _llm_cache: Optional[BaseCache] = PrivateAttr(default=None)
+
+
+class CachedAzureChatOpenAI(ScopedLLMCacheMixin, AzureChatOpenAI):
+    _llm_cache: Optional[BaseCache] = PrivateAttr(default=None)
+
+
+class CachedChatAnthropic(ScopedLLMCacheMixin, ChatAnthropic):
+    _llm_cache: Optional[BaseCache] = PrivateAttr(default=None)
+
+
+class LLMResponseCache(BaseCache):
+    """Cache the llm responses in memory (LRU) and in SQLite on the disk
+
+    The key is the llm string (the model, its params and the functions) and
+    the normalized messages. The entries expire after `ttl` seconds, the disk
+    tier keeps the responses across the processes.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = ".llm_cache.db",
+        ttl: Optional[float] = 60 * 60 * 24,
+        max_entries: int = 1024,
+        max_disk_entries: int = 100_000,
+    ) -> None:
+        self.path: Optional[str] = path  # NOTE: None for the memory only
+        self.ttl: Optional[float] = ttl  # NOTE: None to never expire
+        self.max_entries: int = max_entries
+        self.max_disk_entries: int = max_disk_entries
+        self.n_memory_hits: int = 0
+        self.n_disk_hits: int = 0
+        self.n_misses: int = 0
+        self.n_expired: int = 0
+
+        self._lock = threading.Lock()
+        # NOTE: key -> (created_at, generations), in LRU order
+        self._entries: OrderedDict[str, tuple[float, RETURN_VAL_TYPE]] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, "
+                "response TEXT, created_at REAL, accessed_at REAL)"
+            )
+            self._db.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        n_hits = self.n_memory_hits + self.n_disk_hits
+        n_lookups = n_hits + self.n_misses
+        return n_hits / n_lookups if n_lookups else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            n_disk_entries = (
+                0
+                if self._db is None
+                else self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            )
+            return dict(
+                n_entries=len(self._entries),
+                n_disk_entries=n_disk_entries,
+                n_memory_hits=self.n_memory_hits,
+                n_disk_hits=self.n_disk_hits,
+                n_misses=self.n_misses,
+                n_expired=self.n_expired,
+                hit_rate=self.hit_rate,
+            )
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        text = f"{llm_string}\0{normalize_prompt(prompt)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self.key(prompt, llm_string)
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None:
+                created_at, generations = entry
+                if not self._is_expired(created_at):
+                    self._entries.move_to_end(key)
+                    self.n_memory_hits += 1
+                    return generations
+                del self._entries[key]
+                self.n_expired += 1
+
+            if (generations := self._lookup_disk(key)) is not None:
+                self.n_disk_hits += 1
+                return generations
+            self.n_misses += 1
+            return None
+
+    def _lookup_disk(self, key: str) -> Optional[RETURN_VAL_TYPE]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        if self._is_expired(created_at):
+            self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._db.commit()
+            self.n_expired += 1
+            return None
+        self._db.execute(
+            "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        self._db.commit()
+        generations = loads(response)
+        self._put_memory(key, created_at, generations)
+        return generations
+
+    def _put_memory(
+        self, key: str, created_at: float, generations: RETURN_VAL_TYPE
+    ) -> None:
+        self._entries[key] = (created_at, generations)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, return_val)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                (key, dumps(return_val), now, now),
+            )
+            # NOTE: evict the least recently used entries over the limit
+            self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            self._db.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
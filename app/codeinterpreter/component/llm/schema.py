@@ -6,34 +6,197 @@
 """
 
 import asyncio
+import contextlib
+import os
+import tempfile
+from io import BytesIO
+from typing import Any, BinaryIO, Iterable, Iterator, Optional
 
 from codeboxapi.schema import CodeBoxStatus  # type: ignore
 from langchain.schema import AIMessage, HumanMessage  # type: ignore
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+
+CHUNK_SIZE = 1 << 20
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
+
+
+def _spool(chunks: Iterable[bytes]) -> str:
+    fd, path = tempfile.mkstemp(prefix="file-")
+    with os.fdopen(fd, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return path
+
+
+class _TempFile:
+    """Remove the temporary file once no `File` (or its copies) refers to it"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __deepcopy__(self, memo: dict) -> "_TempFile":
+        return self
+
+    def __del__(self) -> None:
+        with contextlib.suppress(OSError):
+            os.remove(self.path)
 
 
 class File(BaseModel):
+    """File sent to / received from the codebox
+
+    The content is backed by bytes, a local path or a chunk iterator,
+    and is materialized lazily only when `.content` is read (or serialized).
+    The temporary files spooled by the file are removed with it.
+    """
+
     name: str
-    content: bytes
+    path: Optional[str] = None
+    # NOTE: sha256 of the content, if backed by a blob in the `BlobStore`
+    digest: Optional[str] = None
+    _content: Optional[bytes] = PrivateAttr(default=None)
+    _chunks: Optional[Iterator[bytes]] = PrivateAttr(default=None)
+    _image: Any = PrivateAttr(default=None)
+    _tmp: Optional[_TempFile] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        content: Optional[bytes] = None,
+        chunks: Optional[Iterable[bytes]] = None,
+        **data,
+    ) -> None:
+        super().__init__(**data)
+        if content is None and chunks is None and self.path is None:
+            raise ValueError("Either `content`, `chunks` or `path` must be specified")
+        self._content = content
+        self._chunks = None if chunks is None else iter(chunks)
+
+    def _iter(
+        self,
+        to_dict: bool = False,
+        by_alias: bool = False,
+        include: Any = None,
+        exclude: Any = None,
+        exclude_unset: bool = False,
+        exclude_defaults: bool = False,
+        exclude_none: bool = False,
+    ) -> Iterator[tuple[str, Any]]:
+        # NOTE: serialize the content as the field it used to be (`dict`, `json`),
+        #       not on `copy` (`to_dict=False`) sharing the private attributes
+        yield from super()._iter(
+            to_dict,
+            by_alias,
+            include,
+            exclude,
+            exclude_unset,
+            exclude_defaults,
+            exclude_none,
+        )
+        if (
+            to_dict
+            and (include is None or "content" in include)
+            and (exclude is None or "content" not in exclude)
+        ):
+            yield "content", self.content
+
+    @classmethod
+    def _from_temp_path(cls, name: str, path: str) -> "File":
+        file = cls(name=name, path=path)
+        file._tmp = _TempFile(path)
+        return file
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            if self._chunks is not None:
+                self._content = b"".join(self._chunks)
+                self._chunks = None
+            else:
+                with open(self.path, "rb") as f:
+                    self._content = f.read()
+        return self._content
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._content is not None
+
+    @property
+    def is_image(self) -> bool:
+        return self.name.lower().endswith(IMAGE_SUFFIXES)
+
+    def getbuffer(self) -> memoryview:
+        """Zero-copy view of the content"""
+        return memoryview(self.content)
+
+    @property
+    def size(self) -> int:
+        if self._content is None and self._chunks is None:
+            return os.path.getsize(self.path)
+        return len(self.content)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Iterate the content by chunks without materializing it if possible"""
+        if self._content is not None:
+            view = self.getbuffer()
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset : offset + chunk_size]
+        elif self._chunks is not None:
+            # NOTE: a chunk iterator can be consumed only once
+            yield from self._iter_spooled_chunks()
+        else:
+            with open(self.path, "rb") as f:
+                yield from iter(lambda: f.read(chunk_size), b"")
+
+    def _iter_spooled_chunks(self) -> Iterator[bytes]:
+        # NOTE: spool the chunks to a temporary file, then be backed by the path
+        chunks, self._chunks = self._chunks, None
+        fd, path = tempfile.mkstemp(prefix="file-")
+        self._tmp = _TempFile(path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                try:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        yield chunk
+                finally:
+                    # NOTE: drain the rest, e.g. the consumer stopped early
+                    for chunk in chunks:
+                        f.write(chunk)
+        finally:
+            self.path = path
+
+    def open(self) -> BinaryIO:
+        if self._content is None and self._chunks is None:
+            return open(self.path, "rb")
+        return BytesIO(self.content)
 
     @classmethod
-    def from_path(cls, path: str):
+    def from_path(cls, path: str, lazy: bool = True):
         if not path.startswith("/"):
             path = f"./{path}"
+        name = path.split("/")[-1]
+        if lazy:
+            return cls(name=name, path=path)
         with open(path, "rb") as f:
-            path = path.split("/")[-1]
-            return cls(name=path, content=f.read())
+            return cls(name=name, content=f.read())
+
+    @classmethod
+    async def afrom_path(cls, path: str, lazy: bool = True):
+        return await asyncio.to_thread(cls.from_path, path, lazy)
 
     @classmethod
-    async def afrom_path(cls, path: str):
-        return await asyncio.to_thread(cls.from_path, path)
+    def from_chunks(cls, name: str, chunks: Iterable[bytes]):
+        return cls(name=name, chunks=chunks)
 
     @classmethod
     def from_url(cls, url: str):
         import requests  # type: ignore
 
-        r = requests.get(url)
-        return cls(name=url.split("/")[-1], content=r.content)
+        # NOTE: spool the response to a temporary file instead of the memory
+        with requests.get(url, stream=True) as r:
+            r.raise_for_status()
+            path = _spool(r.iter_content(chunk_size=CHUNK_SIZE))
+        return cls._from_temp_path(url.split("/")[-1], path)
 
     @classmethod
     async def afrom_url(cls, url: str):
@@ -41,13 +204,22 @@ class File(BaseModel):
 
         async with aiohttp.ClientSession() as session:
             async with session.get(url) as r:
-                return cls(name=url.split("/")[-1], content=await r.read())
+                r.raise_for_status()
+                fd, path = tempfile.mkstemp(prefix="file-")
+                tmp = _TempFile(path)
+                with os.fdopen(fd, "wb") as f:
+                    async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+        file = cls(name=url.split("/")[-1], path=path)
+        file._tmp = tmp
+        return file
 
     def save(self, path: str):
         if not path.startswith("/"):
             path = f"./{path}"
         with open(path, "wb") as f:
-            f.write(self.content)
+            for chunk in self.iter_chunks():
+                f.write(chunk)
 
     async def asave(self, path: str):
         await asyncio.to_thread(self.save, path)
@@ -63,15 +235,19 @@ class File(BaseModel):
             )
             exit(1)
 
-        from io import BytesIO
+        # NOTE: decode lazily, once per file
+        if self._image is not None:
+            return self._image
 
-        img_io = BytesIO(self.content)
-        img = Image.open(img_io)
+        with self.open() as img_io:
+            img = Image.open(img_io)
+            img.load()
 
         # Convert image to RGB if it's not
         if img.mode not in ("RGB", "L"):  # L is for greyscale images
             img = img.convert("RGB")
 
+        self._image = img
         return img
 
     def show_image(self):
@@ -0,0 +1,279 @@
+import ast
+import builtins
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox.localbox import CustomLocalBox
+from app.codeinterpreter.component.cell_ast import (
+    MAGIC_LINE,
+    NameCollector,
+    dotted_name,
+    parse_cell,
+)
+
+# NOTE: the builtins without side effects (besides the output)
+PURE_BUILTINS = frozenset(
+    [
+        "abs", "all", "any", "bool", "dict", "display", "divmod", "enumerate",
+        "filter", "float", "format", "frozenset", "getattr", "hasattr", "int",
+        "isinstance", "len", "list", "map", "max", "min", "print", "range", "repr",
+        "reversed", "round", "set", "sorted", "str", "sum", "tuple", "type", "zip",
+    ]
+)  # fmt: skip
+# NOTE: the modules doing i/o or returning random / time dependent values
+IMPURE_MODULES = frozenset(
+    [
+        "datetime", "glob", "io", "matplotlib", "np.random", "numpy.random", "os",
+        "pathlib", "plt", "random", "requests", "secrets", "shutil", "sns",
+        "seaborn", "socket", "subprocess", "sys", "tempfile", "time", "torch",
+        "urllib", "uuid",
+    ]
+)  # fmt: skip
+# NOTE: the methods mutating the object, writing, plotting or sampling
+_IMPURE_METHOD = re.compile(
+    r"^(append|extend|insert|pop|popitem|remove|discard|clear|sort|reverse|update"
+    r"|setdefault|add|fit|fit_transform|partial_fit|write|writelines|close|save"
+    r"|savefig|show|plot|hist|scatter|to_(csv|excel|parquet|pickle|sql|feather|hdf"
+    r"|json|html|latex|markdown)|sample|shuffle|rand\w*|choice|permutation|seed"
+    r"|now|today|utcnow)$"
+)
+# NOTE: the reads fingerprinted by the file, e.g. `pd.read_csv("data.csv")`
+_READ_CALL = re.compile(r"(^|\.)(read_\w+|load|loadtxt)$")
+_URL = re.compile(r"^[a-zA-Z][\w+.-]*://")
+
+# NOTE: run in the kernel, prints the digest of the values, `-` if not hashable
+_FINGERPRINT_FUNCTION = """\
+def _codebox_fingerprint(names, max_bytes):
+    import hashlib, pickle, types
+
+    def digest(value):
+        if isinstance(value, types.ModuleType):
+            return value.__name__.encode()
+        try:
+            import pandas as pd
+
+            if isinstance(value, (pd.DataFrame, pd.Series)):
+                dtypes = str(getattr(value, "dtypes", value.dtype))
+                head = repr((type(value), value.shape, dtypes))
+                hashed = pd.util.hash_pandas_object(value, index=True).values
+                return head.encode() + hashed.tobytes()
+        except ImportError:
+            pass
+        if type(value).__module__ == "numpy" and hasattr(value, "tobytes"):
+            return repr((value.shape, value.dtype)).encode() + value.tobytes()
+        data = pickle.dumps(value)
+        if len(data) > max_bytes:
+            raise ValueError("too large")
+        return data
+
+    h = hashlib.sha256()
+    namespace = globals()
+    try:
+        for name in names:
+            if name in namespace:
+                h.update(name.encode() + b"=" + digest(namespace[name]) + b";")
+    except Exception:
+        print("-")
+    else:
+        print(h.hexdigest())
+"""
+
+
+def _parse_pure(code: str) -> Optional[ast.Module]:
+    if MAGIC_LINE.search(code):
+        return None
+    try:
+        return parse_cell(code)
+    except SyntaxError:
+        return None
+
+
+class _PurityChecker:
+    def __init__(self, tree: ast.Module) -> None:
+        self.collector = NameCollector()
+        self.collector.visit(tree)
+        self.tree = tree
+
+    def read_paths(self) -> Optional[list[str]]:
+        """The local file paths read by the cell, None if not known statically
+
+        e.g. the path held in a variable or a url, which may change without
+        changing the key.
+        """
+        paths = []
+        for node in ast.walk(self.tree):
+            if not (
+                isinstance(node, ast.Call)
+                and _READ_CALL.search(dotted_name(node.func) or "")
+            ):
+                continue
+            arg = node.args[0] if node.args else None
+            if not (isinstance(arg, ast.Constant) and isinstance(arg.value, str)):
+                return None
+            if _URL.match(arg.value):
+                return None
+            paths.append(arg.value)
+        return paths
+
+    def is_pure(self) -> bool:
+        # NOTE: only the expressions, no global is bound by the cell
+        if not all(isinstance(stmt, ast.Expr) for stmt in self.tree.body):
+            return False
+        if self.collector.is_dynamic:
+            return False
+        for node in ast.walk(self.tree):
+            if isinstance(node, (ast.Await, ast.Yield, ast.YieldFrom, ast.NamedExpr)):
+                return False
+            if isinstance(node, ast.Call) and not self._is_pure_call(node):
+                return False
+        return True
+
+    def _is_pure_call(self, node: ast.Call) -> bool:
+        if any(kw.arg == "inplace" for kw in node.keywords):
+            return False
+        if isinstance(node.func, ast.Name):
+            # NOTE: the functions defined in the kernel may mutate the globals
+            return node.func.id in PURE_BUILTINS
+        if not isinstance(node.func, ast.Attribute):
+            return True  # NOTE: e.g. `df["a"].str.len()`, checked by the walk
+        if _IMPURE_METHOD.match(node.func.attr):
+            return False
+        name = dotted_name(node.func) or ""
+        return not any(
+            name == module or name.startswith(f"{module}.") for module in IMPURE_MODULES
+        )
+
+
+class CellMemoizer:
+    """Return the cached output of the pure cells run on the same kernel state
+
+    A cell is pure if it only evaluates expressions without i/o, randomness
+    or mutation (checked by the ast). The key is the normalized code plus the
+    digest of the variables it reads (computed in the kernel) and the files
+    it reads. Only the text outputs are cached, in LRU order.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 1 << 24,
+        max_fingerprint_bytes: int = 1 << 26,
+    ) -> None:
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.max_fingerprint_bytes: int = max_fingerprint_bytes
+        self.n_hits: int = 0
+        self.n_misses: int = 0
+        self.n_impure: int = 0
+
+        self._lock = threading.Lock()
+        self._outputs: OrderedDict[str, CodeBoxOutput] = OrderedDict()
+        self._total_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        n_lookups = self.n_hits + self.n_misses
+        return self.n_hits / n_lookups if n_lookups else 0.0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                n_entries=len(self._outputs),
+                total_bytes=self.total_bytes,
+                n_hits=self.n_hits,
+                n_misses=self.n_misses,
+                n_impure=self.n_impure,
+                hit_rate=self.hit_rate,
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._outputs.clear()
+            self._total_bytes = 0
+
+    def key(self, box: CustomLocalBox, code: str) -> Optional[str]:
+        """The memo key of the cell on the current kernel state, None if impure"""
+        tree = _parse_pure(code)
+        checker = None if tree is None else _PurityChecker(tree)
+        # NOTE: the files read must be known and exist, to be fingerprinted
+        file_stats = (
+            self._file_stats(box, checker.read_paths())
+            if checker is not None and checker.is_pure()
+            else None
+        )
+        if file_stats is None:
+            with self._lock:
+                self.n_impure += 1
+            return None
+
+        names = sorted(
+            name
+            for name in checker.collector.loaded
+            if name not in checker.collector.bound and not hasattr(builtins, name)
+        )
+        output = box.run_function(
+            _FINGERPRINT_FUNCTION, names, self.max_fingerprint_bytes, timeout=30
+        )
+        fingerprint = output.content.strip()
+        if output.type != "text" or fingerprint == "-":
+            with self._lock:
+                self.n_impure += 1
+            return None
+
+        # NOTE: normalized, without the comments / formatting
+        normalized = ast.unparse(tree)
+        h = hashlib.sha256(f"{normalized}\0{fingerprint}".encode())
+        for stat in file_stats:
+            h.update(f"\0{stat}".encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def _file_stats(
+        box: CustomLocalBox, paths: Optional[Iterable[str]]
+    ) -> Optional[list[str]]:
+        """The size / mtime of the files, None if any is missing (may be created)"""
+        if paths is None:
+            return None
+        stats = []
+        for path in paths:
+            try:
+                stat = os.stat(os.path.join(box.workdir, path))
+            except OSError:
+                return None
+            stats.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        return stats
+
+    def get(self, key: str) -> Optional[CodeBoxOutput]:
+        with self._lock:
+            if (output := self._outputs.get(key)) is None:
+                self.n_misses += 1
+                return None
+            self._outputs.move_to_end(key)
+            self.n_hits += 1
+            return output
+
+    def put(self, key: str, output: CodeBoxOutput) -> None:
+        """Cache the output of the cell, only the text (not errors / images)"""
+        if output.type != "text" or len(output.content) > self.max_bytes:
+            return
+        with self._lock:
+            if (replaced := self._outputs.pop(key, None)) is not None:
+                self._total_bytes -= len(replaced.content)
+            self._outputs[key] = output
+            self._total_bytes += len(output.content)
+            while (
+                len(self._outputs) > self.max_entries
+                or self._total_bytes > self.max_bytes
+            ):
+                _, evicted = self._outputs.popitem(last=False)
+                self._total_bytes -= len(evicted.content)
@@ -0,0 +1,120 @@
+import builtins
+import re
+import threading
+from typing import Iterable, Optional
+
+from app.codeinterpreter.component.cell_ast import NameCollector, parse_cell
+
+# NOTE: the names ipython injects into the namespace, e.g. `_`, `_i3`, `Out`
+_IPYTHON_NAME = re.compile(r"^_+$|^_i*\d*$|^_[iod]h$")
+IPYTHON_GLOBALS = frozenset(
+    ["In", "Out", "get_ipython", "display", "exit", "quit", "__name__", "__file__"]
+)
+# NOTE: calls blocking on the stdin or terminating the kernel
+BANNED_CALLS = frozenset(
+    ["input", "exit", "quit", "sys.exit", "os._exit", "os.abort", "getpass.getpass"]
+)
+
+
+class CodePreflight:
+    """Check the generated code before sending it to the kernel
+
+    Syntax errors, names not defined in the kernel and banned calls are
+    returned as an observation at once, saving the kernel round trip.
+    The kernel globals are tracked from the cells run (`update`).
+    """
+
+    def __init__(
+        self,
+        banned_calls: Iterable[str] = BANNED_CALLS,
+        check_names: bool = True,
+    ) -> None:
+        self.banned_calls: frozenset[str] = frozenset(banned_calls)
+        self.check_names: bool = check_names
+        self.known_globals: Optional[set[str]] = None  # NOTE: None if not known
+        self.n_checked: int = 0
+        self.n_rejected: dict[str, int] = dict(syntax=0, name=0, banned=0)
+        self._lock = threading.Lock()
+
+    @property
+    def n_saved_round_trips(self) -> int:
+        return sum(self.n_rejected.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                n_checked=self.n_checked,
+                n_saved_round_trips=self.n_saved_round_trips,
+                **{f"n_{kind}_errors": n for kind, n in self.n_rejected.items()},
+            )
+
+    def reset(self, known_globals: Optional[Iterable[str]] = None) -> None:
+        """Reset the kernel globals, e.g. on a new or restarted kernel"""
+        self.known_globals = None if known_globals is None else set(known_globals)
+
+    def update(self, code: str) -> None:
+        """Add the names bound by the code run in the kernel"""
+        if self.known_globals is None:
+            return
+        try:
+            tree = parse_cell(code)
+        except SyntaxError:
+            return
+        collector = NameCollector()
+        collector.visit(tree)
+        if collector.is_dynamic:
+            # NOTE: cannot tell the names any more, until reset by the kernel
+            self.known_globals = None
+            return
+        self.known_globals |= collector.bound
+
+    def _is_known(self, name: str) -> bool:
+        return (
+            name in self.known_globals
+            or name in IPYTHON_GLOBALS
+            or hasattr(builtins, name)
+            or _IPYTHON_NAME.match(name) is not None
+        )
+
+    def check(self, code: str) -> Optional[str]:
+        """Return the error observation, None if the code can be run"""
+        kind, observation = self._check(code)
+        with self._lock:
+            self.n_checked += 1
+            if kind is not None:
+                self.n_rejected[kind] += 1
+        return observation
+
+    def _check(self, code: str) -> tuple[Optional[str], Optional[str]]:
+        try:
+            tree = parse_cell(code)
+        except SyntaxError as e:
+            text = (e.text or "").rstrip()
+            return "syntax", _format_error(
+                f"SyntaxError: {e.msg} (line {e.lineno})"
+                + (f"\n    {text}" if text else "")
+            )
+
+        collector = NameCollector()
+        collector.visit(tree)
+        for name, lineno in collector.calls:
+            head, _, rest = name.partition(".")
+            resolved = ".".join(filter(None, [collector.aliases.get(head, head), rest]))
+            if name in self.banned_calls or resolved in self.banned_calls:
+                return "banned", _format_error(
+                    f"BannedCallError: `{name}` is not allowed in the sandbox "
+                    f"(line {lineno})"
+                )
+
+        if not self.check_names or self.known_globals is None or collector.is_dynamic:
+            return None, None
+        for name, lineno in collector.evaluated.items():
+            if name not in collector.bound and not self._is_known(name):
+                return "name", _format_error(
+                    f"NameError: name '{name}' is not defined (line {lineno})"
+                )
+        return None, None
+
+
+def _format_error(message: str) -> str:
+    return f"{message}\n(checked before running, the code was not executed)"
@@ -1,7 +1,11 @@
 import streamlit as st
 
+from app.codebox.packages import PackageInstaller
+from app.codebox.pool import CodeBoxPool
+from app.codeinterpreter.component.blobstore import BlobStore
 from app.codeinterpreter.component.interpreter import CodeInterpreter
 from app.codeinterpreter.component.llm.llm_builder import buildup_llm
+from app.codeinterpreter.component.llm.llm_cache import LLMResponseCache
 
 
 def init_session_state(key: str, init_value):
@@ -10,10 +14,42 @@ def init_session_state(key: str, init_value):
     return st.session_state[key]
 
 
+@st.cache_resource
+def get_blob_store() -> BlobStore:
+    return BlobStore(root=".blobstore")
+
+
+@st.cache_resource
+def get_llm_cache() -> LLMResponseCache:
+    return LLMResponseCache(path=".llm_cache.db")
+
+
+@st.cache_resource
+def get_package_installer() -> PackageInstaller:
+    return PackageInstaller(wheel_dir=".wheelhouse")
+
+
+@st.cache_resource
+def get_codebox_pool() -> CodeBoxPool:
+    # NOTE: shared across the sessions in this process
+    return CodeBoxPool(
+        size=2,
+        port_range=(7801, 7900),
+        prewarm_packages=["sklearn", "seaborn", "japanize_matplotlib"],
+        installer=get_package_installer(),
+        verbose=True,
+    ).start()
+
+
 def init_codeinterpreter(model: str = "gpt-3.5-turbo"):
-    llm = buildup_llm(model=model)
+    llm = buildup_llm(model=model, llm_cache=get_llm_cache(), streaming=True)
     st.session_state["codeinterpreter"] = cdp = CodeInterpreter(
-        llm=llm, local=True, verbose=True
+        llm=llm,
+        local=True,
+        verbose=True,
+        pool=get_codebox_pool(),
+        blob_store=get_blob_store(),
+        package_installer=get_package_installer(),
     )
     cdp.start()
 
@@ -0,0 +1,108 @@
+import asyncio
+import io
+import os
+import tarfile
+from typing import Optional
+
+from app.codebox.localbox import CustomLocalBox
+from app.codeinterpreter.component.blobstore import BlobStore
+from app.codeinterpreter.component.llm.schema import File
+
+
+def _bundle(files: list[File]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for file in files:
+            info = tarfile.TarInfo(name=file.name)
+            info.size = file.size
+            with file.open() as f:
+                tar.addfile(info, f)
+    return buffer.getvalue()
+
+
+def _unbundle(content: bytes) -> list[File]:
+    files = []
+    with tarfile.open(fileobj=io.BytesIO(content), mode="r:*") as tar:
+        for member in tar.getmembers():
+            if not member.isfile() or member.size == 0:
+                continue
+            files.append(File(name=member.name, content=tar.extractfile(member).read()))
+    return files
+
+
+async def aupload_files(
+    codebox: CustomLocalBox,
+    files: list[File],
+    max_concurrency: int = 4,
+    bundle: bool = False,
+) -> None:
+    """Upload the files concurrently, or bundled into a single tar archive"""
+    if not files:
+        return
+    if bundle and len(files) > 1:
+        content = await asyncio.to_thread(_bundle, files)
+        await asyncio.to_thread(codebox.upload_archive, content)
+        return
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _upload(file: File) -> None:
+        async with semaphore:
+            if file.path and not file.is_loaded:
+                # NOTE: e.g. a blob in the store, copy it on the file system
+                await asyncio.to_thread(codebox.upload_path, file.name, file.path)
+            else:
+                await asyncio.to_thread(
+                    codebox.upload_stream, file.name, file.iter_chunks()
+                )
+
+    await asyncio.gather(*[_upload(file) for file in files])
+
+
+def _download(
+    codebox: CustomLocalBox, filename: str, blob_store: Optional[BlobStore]
+) -> Optional[File]:
+    if blob_store is None:
+        fileb = codebox.download(filename)
+        if not fileb.content:
+            return None
+        return File(name=filename, content=fileb.content)
+
+    digest = blob_store.put_stream(codebox.download_stream(filename))
+    if os.path.getsize(blob_store.path(digest)) == 0:
+        blob_store.release(digest)
+        return None
+    return File(name=filename, path=blob_store.path(digest), digest=digest)
+
+
+async def adownload_files(
+    codebox: CustomLocalBox,
+    filenames: list[str],
+    max_concurrency: int = 4,
+    bundle: bool = False,
+    blob_store: Optional[BlobStore] = None,
+) -> list[File]:
+    """Download the files concurrently, the empty files are skipped
+
+    With `blob_store`, the files are streamed into the store and returned as
+    handles to the blobs instead of the bytes.
+    """
+    if not filenames:
+        return []
+    if bundle and len(filenames) > 1:
+        content = await asyncio.to_thread(codebox.download_archive, filenames)
+        files = await asyncio.to_thread(_unbundle, content)
+        if blob_store is None:
+            return files
+        return await asyncio.gather(
+            *[asyncio.to_thread(blob_store.put, file) for file in files]
+        )
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _adownload(filename: str) -> Optional[File]:
+        async with semaphore:
+            return await asyncio.to_thread(_download, codebox, filename, blob_store)
+
+    files = await asyncio.gather(*[_adownload(filename) for filename in filenames])
+    return [file for file in files if file is not None]
@@ -0,0 +1,153 @@
+"""Microbenchmark of the agent step overhead, excluding the network
+
+e.g. python -m app.codeinterpreter.executable.bench_agent_step --n-steps 20
+"""
+
+import time
+from typing import Any, List, Optional
+
+import typer
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.chat_models.openai import ChatOpenAI
+from langchain.schema import AgentAction, ChatGeneration, ChatResult
+from langchain.schema.messages import AIMessage, BaseMessage, HumanMessage
+from langchain.tools import BaseTool, StructuredTool
+from langchain.tools.convert_to_openai import format_tool_to_openai_function
+
+from app.codeinterpreter.component.llm.agent_executer_factory import (
+    _create_agent,
+    create_tools,
+)
+from app.codeinterpreter.component.llm.agents import (
+    _format_intermediate_steps,
+    _FunctionsAgentAction,
+)
+from app.codeinterpreter.component.llm.schema import CodeInput
+
+
+class _OfflineChatOpenAI(ChatOpenAI):
+    """ChatOpenAI answering a constant function call without the api request"""
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = AIMessage(
+            content="",
+            additional_kwargs=dict(
+                function_call=dict(name="python", arguments='{"code": "print(1)"}')
+            ),
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _intermediate_step(i: int) -> tuple[AgentAction, str]:
+    code = f"print({i})"
+    message = AIMessage(
+        content="",
+        additional_kwargs=dict(
+            function_call=dict(name="python", arguments=f'{{"code": "{code}"}}')
+        ),
+    )
+    # NOTE: an own message log per step, as the steps sharing one are merged
+    action = _FunctionsAgentAction(
+        tool="python", tool_input={"code": code}, log="", message_log=[message]
+    )
+    return (action, f"{i}\n" * 20)
+
+
+def _intermediate_steps(n_steps: int) -> list[tuple[AgentAction, str]]:
+    return [_intermediate_step(i) for i in range(n_steps)]
+
+
+def _chat_history(n_messages: int, message_bytes: int) -> list[BaseMessage]:
+    return [
+        (HumanMessage if i % 2 == 0 else AIMessage)(content="x" * message_bytes)
+        for i in range(n_messages)
+    ]
+
+
+def _measure(fn, n_repeats: int) -> float:
+    """Return the mean seconds per call"""
+    fn()  # NOTE: warm up
+    t0 = time.perf_counter()
+    for _ in range(n_repeats):
+        fn()
+    return (time.perf_counter() - t0) / n_repeats
+
+
+def main(
+    n_steps: int = 10,
+    n_repeats: int = 200,
+    n_tools: int = 5,
+    n_history: int = 60,
+    message_bytes: int = 2000,
+):
+    additional_tools: list[BaseTool] = [
+        StructuredTool(
+            name=f"tool_{i}",
+            description=f"Dummy tool {i}",
+            func=lambda code: code,
+            args_schema=CodeInput,
+        )
+        for i in range(n_tools - 1)
+    ]
+    tools = create_tools(lambda code: code, additional_tools)
+    llm = _OfflineChatOpenAI(openai_api_key="offline")
+    agent = _create_agent(llm, tools)
+    history = _chat_history(n_history, message_bytes)
+    inputs = dict(input="benchmark", chat_history=history)
+
+    results = {
+        "functions (uncached)": _measure(
+            lambda: [dict(format_tool_to_openai_function(t)) for t in agent.tools],
+            n_repeats,
+        ),
+        "functions (cached)": _measure(lambda: agent.functions, n_repeats),
+    }
+    for k in sorted({0, n_steps // 2, n_steps}):
+        steps = _intermediate_steps(k)
+        results[f"plan ({k} steps)"] = _measure(
+            lambda: agent.plan(steps, **inputs), n_repeats
+        )
+        results[f"messages ({k} steps)"] = _measure(
+            lambda: agent._build_messages(steps, **inputs), n_repeats
+        )
+        # NOTE: a new run (steps list) and a new history on each call
+        histories = iter(
+            [_chat_history(n_history, message_bytes) for _ in range(n_repeats + 1)]
+        )
+        results[f"messages cold ({k} steps)"] = _measure(
+            lambda: agent._build_messages(
+                list(steps), input="benchmark", chat_history=next(histories)
+            ),
+            n_repeats,
+        )
+        results[f"messages uncached ({k} steps)"] = _measure(
+            lambda: agent.prompt.format_prompt(
+                **inputs, agent_scratchpad=_format_intermediate_steps(steps)
+            ).to_messages(),
+            n_repeats,
+        )
+
+    # NOTE: the history and the steps growing on each call, as in a session
+    growing_history, growing_steps = list(history), []
+
+    def _build_growing() -> None:
+        growing_history.append(HumanMessage(content="x" * message_bytes))
+        growing_steps.append(_intermediate_step(len(growing_steps)))
+        agent._build_messages(
+            growing_steps, input="benchmark", chat_history=growing_history
+        )
+
+    results["messages (growing)"] = _measure(_build_growing, n_repeats)
+
+    for name, seconds in results.items():
+        print(f"{name:<32}: {seconds * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -10,6 +10,7 @@ from app.codeinterpreter.component.interpreter import (
 from app.codeinterpreter.component.llm.llm_builder import buildup_llm
 from app.codeinterpreter.component.llm.schema import File
 from app.codeinterpreter.component.session import (
+    get_llm_cache,
     init_codeinterpreter,
     init_session_state,
     term_codeinterpreter,
@@ -61,6 +62,7 @@ system_prompt = st.sidebar.text_area(
     help="Custom instructions to provide the language model to determine style, personality, etc.",
 )
 system_prompt = system_prompt.strip().replace("{", "{{").replace("}", "}}")
+# NOTE: not cached, `chain.stream` bypasses the llm cache (and the prompt has the time)
 chain, memory = get_chain(system_prompt, temperature=0.25)
 
 if "codeinterpreter" not in st.session_state:
@@ -69,7 +71,9 @@ if "codeinterpreter" not in st.session_state:
 
 def on_change_model():
     cdp: CodeInterpreter = st.session_state["codeinterpreter"]
-    llm = buildup_llm(model=st.session_state.model_name)
+    llm = buildup_llm(
+        model=st.session_state.model_name, llm_cache=get_llm_cache(), streaming=True
+    )
     cdp.update_llm(llm=llm)
 
 
@@ -137,18 +141,13 @@ with st.container():
 
 def parse_response(response: CodeInterpreterResponse):
     text = ""
-    img = None
     imgs = []
 
     try:
         text: str = response.content
 
-        imgs = []
-        for fl in response.files:
-            img = fl.get_image()
-            if img.mode not in ("RGB", "L"):  # L is for greyscale images
-                img = img.convert("RGB")
-            imgs.append(img)
+        # NOTE: hand the encoded image bytes to `st.image` as is, no re-encoding
+        imgs = [fl.content for fl in response.files if fl.is_image]
     except Exception as e:
         print(e)
         if not text:
@@ -163,6 +162,85 @@ runnable_config = RunnableConfig(
     tags=["Streamlit Chat"],
 )
 
+
+def translate(msg: str) -> str:
+    return "".join(
+        [
+            chunk.content
+            for chunk in chain.stream({"input": msg}, config=runnable_config)
+        ]
+    )
+
+
+def stream_markdown(msg: str) -> str:
+    text: str = ""
+    st.markdown(text + "▌")
+
+    # streaming output
+    for chunk in chain.stream({"input": msg}, config=runnable_config):
+        text += chunk.content
+        st.markdown(text + "▌")
+    st.markdown(text)
+    return text
+
+
+def render_events(
+    cdp: CodeInterpreter, user_msg: str, files: list[File], log_handler
+) -> CodeInterpreterResponse:
+    """Render the events on this (streamlit) thread as they happen"""
+    response, tokens = None, ""
+    for event in cdp.stream_response_sync(user_msg=user_msg, files=files):
+        if event.type == "llm_start":
+            # NOTE: show the tokens of the latest llm call only
+            tokens = ""
+        elif event.type == "code":
+            log_handler(event.content, is_code=True)
+        elif event.type == "status":
+            log_handler(event.content)
+        elif event.type == "token":
+            tokens += event.content
+            log_handler(tokens)
+        elif event.type == "final":
+            response = event.content
+    return response
+
+
+def generate(prompt: str, files: list[File], log_handler) -> tuple[str, list]:
+    log_handler("入力プロンプトを英語にしています・・・")
+    with st.spinner("ちょっとまっててー"):
+        msg = f"""以下を英語にしてください。翻訳した結果の英語のみを返してください。
+        ```
+        {prompt}
+        ```"""
+        user_msg = translate(msg)
+        print("-" * 50)
+        print(f"{user_msg=}")
+
+        cdp: CodeInterpreter = st.session_state["codeinterpreter"]
+
+        print("-" * 50)
+        print("llm:", cdp.llm.model_name)
+
+        # NOTE: reconnect lazily, only if the kernel connection is broken
+        cdp.ensure_connected()
+        print("CodeInterpreter:", cdp.connection_stats)
+
+        log_handler(f"処理中です・・・ {cdp.llm.model_name}: {user_msg}")
+        response = render_events(cdp, user_msg, files, log_handler)
+        _text, imgs = parse_response(response)
+
+    # NOTE: into japanese
+    msg = f"""以下を日本語にしてください。翻訳した結果の日本語のみを返してください。エラーメッセージの場合はへそのまま返してください。
+    ```
+    {_text}
+    ```"""
+
+    log_handler("完了しました")
+
+    text = stream_markdown(msg)
+    return text, imgs
+
+
 if submit_button and prompt:
     with latest_avatar_user:
         with st.chat_message("user", avatar=user_avatar):
@@ -193,52 +271,7 @@ if submit_button and prompt:
             files.append(fl)
 
         with _msg_area_ai:
-            log_handler("入力プロンプトを英語にしています・・・")
-            with st.spinner("ちょっとまっててー"):
-                msg = f"""以下を英語にしてください。翻訳した結果の英語のみを返してください。
-                ```
-                {prompt}
-                ```"""
-                user_msg = "".join(
-                    [
-                        chunk.content
-                        for chunk in chain.stream(
-                            {"input": msg}, config=runnable_config
-                        )
-                    ]
-                )
-                print("-" * 50)
-                print(f"{user_msg=}")
-
-                cdp: CodeInterpreter = st.session_state["codeinterpreter"]
-                cdp.update_log_handler(log_handler=log_handler)
-
-                print("-" * 50)
-                print("llm:", cdp.llm.model_name)
-
-                cdp.reconnect()
-                print("CodeInterpreter: reconnected")
-
-                log_handler(f"処理中です・・・ {cdp.llm.model_name}: {user_msg}")
-                response = cdp.generate_response_sync(user_msg=user_msg, files=files)
-                _text, imgs = parse_response(response)
-
-            # NOTE: into japanese
-            msg = f"""以下を日本語にしてください。翻訳した結果の日本語のみを返してください。エラーメッセージの場合はへそのまま返してください。
-            ```
-            {_text}
-            ```"""
-
-            log_handler("完了しました")
-
-            text: str = ""
-            st.markdown(text + "▌")
-
-            # streaming output
-            for chunk in chain.stream({"input": msg}, config=runnable_config):
-                text += chunk.content
-                st.markdown(text + "▌")
-            st.markdown(text)
+            text, imgs = generate(prompt, files, log_handler)
 
         with _image_area_ai:
             for img in imgs:
@@ -1,5 +1,6 @@
 import json
 import re
+from os import getenv
 from typing import Union
 
 from dotenv import load_dotenv
@@ -15,6 +16,7 @@ from langchain.prompts import (
 )
 from langchain.schema import AgentAction, AgentFinish
 
+from app.codeinterpreter.component.llm.client_registry import default_registry
 from app.langchain.component.agent.agent_executor import CustomAgentExecutor
 from app.langchain.component.agent.initialize import initialize_agent
 from app.langchain.component.agent.prompt import FORMAT_INSTRUCTIONS, PREFIX, SUFFIX
@@ -84,11 +86,25 @@ class CustomOutputParser(AgentOutputParser):
         return actions
 
 
+def _get_llm(model_name: str, temperature: float) -> ChatOpenAI:
+    # NOTE: built once per model and key, sharing the pooled connections
+    #       with the llms of `buildup_llm`
+    default_registry.install_openai_session()
+    return default_registry.get(
+        default_registry.key(
+            "openai", getenv("OPENAI_API_BASE"), getenv("OPENAI_API_KEY")
+        ),
+        ChatOpenAI,
+        temperature=temperature,
+        model_name=model_name,
+    )  # type: ignore
+
+
 def build_agent(
     model_name="gpt-3.5-turbo", temperature: float = 0, max_iterations: int = 15
 ) -> CustomAgentExecutor:
     load_dotenv()
-    llm = ChatOpenAI(temperature=temperature, model_name=model_name)
+    llm = _get_llm(model_name, temperature)
     # llm = RedPajamaLLM()
 
     shell_tool = CustomShellTool()
@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox.checkpoint import KernelCheckpointer
+
+_MANIFEST = dict(
+    pickler="pickle",
+    modules={"pd": "pandas"},
+    variables={"df": dict(format="parquet", file="df.parquet", bytes=10)},
+    skipped={},
+)
+
+
+class _FakeBox:
+    """Run the checkpoint functions by writing what the kernel would"""
+
+    def __init__(self, workdir: str) -> None:
+        self.workdir = workdir
+        self.calls: list[tuple[str, tuple, dict]] = []
+
+    def run_function(self, source: str, *args, **kwargs) -> CodeBoxOutput:
+        name = source[len("def ") : source.index("(")]
+        self.calls.append((name, args, kwargs))
+        if name == "_codebox_checkpoint":
+            os.makedirs(args[0])
+            with open(os.path.join(args[0], "manifest.json"), "w") as f:
+                json.dump(_MANIFEST, f)
+        else:
+            with open(args[1], "w") as f:
+                json.dump(dict(failed={"pd": "ImportError: no pandas"}), f)
+        return CodeBoxOutput(type="text", content="")
+
+
+@pytest.fixture
+def box(tmp_path) -> _FakeBox:
+    workdir = tmp_path / "workdir"
+    workdir.mkdir()
+    (workdir / "data.csv").write_text("a\n1\n")
+    return _FakeBox(str(workdir))
+
+
+@pytest.fixture
+def checkpointer(tmp_path) -> KernelCheckpointer:
+    return KernelCheckpointer(root=str(tmp_path / "checkpoints"), timeout=42)
+
+
+@pytest.mark.parametrize("checkpoint_id", ["../escape", "a/b", "", ".", "a.tmp"])
+def test_invalid_checkpoint_id(checkpointer: KernelCheckpointer, checkpoint_id: str):
+    with pytest.raises(ValueError):
+        checkpointer.path(checkpoint_id)
+
+
+def test_save_and_restore(checkpointer: KernelCheckpointer, box: _FakeBox, tmp_path):
+    info = checkpointer.save(box, "session-1")
+    assert info.variables == ["df"]
+    assert checkpointer.list() == ["session-1"]
+
+    restored_box = _FakeBox(str(tmp_path / "restored"))
+    info = checkpointer.restore(restored_box, "session-1")
+    assert info.variables == ["df"]
+    assert info.skipped == {"pd": "ImportError: no pandas"}
+    assert os.path.exists(os.path.join(restored_box.workdir, "data.csv"))
+
+    assert [kwargs for _, _, kwargs in box.calls + restored_box.calls] == [
+        dict(timeout=42),
+        dict(timeout=42),
+    ]
+    # NOTE: the checkpoint is left as saved
+    namespace_path = os.path.join(checkpointer.path("session-1"), "namespace")
+    assert os.listdir(namespace_path) == ["manifest.json"]
+    assert not os.path.exists(restored_box.calls[0][1][1])
+
+
+def test_list_skips_the_unfinished_checkpoints(checkpointer: KernelCheckpointer):
+    os.makedirs(os.path.join(checkpointer.root, "session-1.tmp", "namespace"))
+    assert checkpointer.list() == []
@@ -0,0 +1,88 @@
+import json
+import subprocess
+
+from websockets.exceptions import ConnectionClosedError
+
+from app.codebox.localbox import CustomLocalBox
+
+
+class _FakeWebSocket:
+    def __init__(self, messages: list) -> None:
+        self.messages = messages
+
+    def recv(self, timeout=None) -> str:
+        message = self.messages.pop(0)
+        if isinstance(message, Exception):
+            raise message
+        return json.dumps(message)
+
+
+def _message(msg_type: str, content: dict, msg_id: str = "cell") -> dict:
+    return dict(
+        header=dict(msg_type=msg_type),
+        parent_header=dict(msg_id=msg_id),
+        content=content,
+    )
+
+
+def _box_receiving(messages: list, monkeypatch) -> CustomLocalBox:
+    box = CustomLocalBox(port=7903)
+    box.ws = _FakeWebSocket(messages)
+    monkeypatch.setattr(box, "_send_execute_request", lambda code: "cell")
+    return box
+
+
+def _start_fake_gateway(box: CustomLocalBox) -> subprocess.Popen:
+    box.jupyter = subprocess.Popen(["sleep", "60"])
+    box._jupyter_pids.append(box.jupyter.pid)
+    return box.jupyter
+
+
+def test_stop_terminates_only_the_own_gateway():
+    box, other = CustomLocalBox(port=7901), CustomLocalBox(port=7902)
+    process, other_process = _start_fake_gateway(box), _start_fake_gateway(other)
+    try:
+        box.stop()
+        # NOTE: `LocalBox.stop` killed every pid once `jupyter` is None
+        box.stop()
+        del box
+
+        assert process.poll() is not None
+        assert other_process.poll() is None
+        assert process.pid not in CustomLocalBox._jupyter_pids
+        assert other_process.pid in CustomLocalBox._jupyter_pids
+    finally:
+        other.stop()
+    assert other_process.poll() is not None
+
+
+def test_boxes_are_not_singletons():
+    assert CustomLocalBox(port=7901) is not CustomLocalBox(port=7902)
+
+
+def test_run_stream_forwards_the_outputs_as_run(monkeypatch):
+    box = _box_receiving(
+        [
+            _message("stream", dict(name="stdout", text="  loading\n")),
+            _message("stream", dict(text="Requirement already satisfied: pandas\n")),
+            _message("execute_result", dict(data={"text/plain": "42"})),
+            _message("status", dict(execution_state="idle")),
+        ],
+        monkeypatch,
+    )
+    streamed = []
+    output = box.run_stream("print('loading'); 42", on_output=streamed.append)
+    assert streamed == ["loading\n", "42\n"]
+    assert output.content == "loading\n42\n"
+
+
+def test_interrupt_reconnects_if_the_connection_is_closed(monkeypatch):
+    box = _box_receiving([ConnectionClosedError(None, None)], monkeypatch)
+    reconnects = []
+    monkeypatch.setattr(box, "interrupt", lambda: None)
+    monkeypatch.setattr(box, "_reconnect_with_backoff", lambda: reconnects.append(1))
+
+    output = box._interrupt_cell("cell", timeout=1)
+    assert output.type == "error"
+    assert output.content.startswith("TimeoutError")
+    assert reconnects == [1]
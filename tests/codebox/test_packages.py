@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox import packages
+from app.codebox.packages import PackageInstaller, distribution_for, missing_module
+
+_NOT_FOUND = (
+    "RuntimeError: ERROR: Could not find a version that satisfies the requirement "
+    "nosuchpkg (from versions: none)\nERROR: No matching distribution found for "
+    "nosuchpkg"
+)
+
+
+class _FakeBox:
+    def __init__(self, *outputs: CodeBoxOutput) -> None:
+        self.outputs = list(outputs)
+        self.codes: list[str] = []
+
+    def run_stream(self, code: str, timeout: float) -> CodeBoxOutput:
+        self.codes.append(code)
+        return self.outputs.pop(0)
+
+
+def _error(content: str) -> CodeBoxOutput:
+    return CodeBoxOutput(type="error", content=content)
+
+
+_OK = CodeBoxOutput(type="text", content="")
+
+
+@pytest.fixture
+def installer(tmp_path) -> PackageInstaller:
+    return PackageInstaller(wheel_dir=str(tmp_path), retry_after=60)
+
+
+def test_missing_module_to_distribution():
+    output = _error("ModuleNotFoundError: No module named 'sklearn.linear_model'")
+    assert distribution_for(missing_module(output)) == "scikit-learn"
+    assert missing_module(CodeBoxOutput(type="text", content="")) is None
+
+
+def test_failure_is_retried_after_the_ttl(installer, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(packages.time, "monotonic", lambda: now[0])
+    box = _FakeBox(_error("RuntimeError: timed out"), _OK)
+
+    assert not installer.install(box, ["sklearn"])
+    assert not installer.install(box, ["sklearn"])
+    assert len(box.codes) == 1
+
+    now[0] += 61
+    assert installer.install(box, ["sklearn"])
+    assert len(box.codes) == 2
+    assert installer.failed == {}
+
+
+def test_no_such_distribution_is_never_retried(installer, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(packages.time, "monotonic", lambda: now[0])
+    box = _FakeBox(_error(_NOT_FOUND), _OK)
+
+    assert not installer.install(box, ["nosuchpkg", "yaml"])
+    assert installer.failed["nosuchpkg"].is_permanent
+    assert not installer.failed["PyYAML"].is_permanent
+
+    now[0] += 61
+    assert not installer.install(box, ["nosuchpkg"])
+    assert installer.install(box, ["yaml"])
+    assert installer.stats()["n_permanently_failed"] == 1
+
+
+def test_unreachable_index_is_retried(installer, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(packages.time, "monotonic", lambda: now[0])
+    box = _FakeBox(_error(f"RuntimeError: index not reachable: {_NOT_FOUND}"), _OK)
+
+    assert not installer.install(box, ["nosuchpkg"])
+    assert not installer.failed["nosuchpkg"].is_permanent
+    now[0] += 61
+    assert installer.install(box, ["nosuchpkg"])
+
+
+class _SlowBox:
+    def __init__(self) -> None:
+        self.running: list[str] = []
+        self.overlaps: list[set] = []
+        self._lock = threading.Lock()
+
+    def run_stream(self, code: str, timeout: float) -> CodeBoxOutput:
+        with self._lock:
+            self.overlaps.append(set(self.running))
+            self.running.append(code)
+        time.sleep(0.05)
+        with self._lock:
+            self.running.remove(code)
+        return _OK
+
+
+def _install_concurrently(installer: PackageInstaller, box, modules: list[str]):
+    threads = [
+        threading.Thread(target=installer.install, args=(box, [m])) for m in modules
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_same_distribution_is_built_one_at_a_time(installer):
+    box = _SlowBox()
+    _install_concurrently(installer, box, ["sklearn", "sklearn", "sklearn"])
+    assert box.overlaps == [set(), set(), set()]
+
+
+def test_other_distributions_are_built_concurrently(installer):
+    box = _SlowBox()
+    _install_concurrently(installer, box, ["sklearn", "yaml"])
+    assert any(box.overlaps)
+
+
+def test_failure_while_waiting_is_not_retried(installer):
+    class _FailingBox(_SlowBox):
+        def run_stream(self, code: str, timeout: float) -> CodeBoxOutput:
+            super().run_stream(code, timeout)
+            return _error(_NOT_FOUND)
+
+    box = _FailingBox()
+    _install_concurrently(installer, box, ["nosuchpkg", "nosuchpkg"])
+    assert len(box.overlaps) == 1
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from app.codebox import pool as pool_module
+from app.codebox.pool import CodeBoxPool
+
+
+class _FakeBox:
+    started: list["_FakeBox"] = []
+    stopped: list["_FakeBox"] = []
+
+    def __init__(self, port: int, workdir: str, fixed_port: bool = False) -> None:
+        self.port = port
+        self.workdir = workdir
+        self.fixed_port = fixed_port
+        self.n_resets = 0
+
+    def start(self) -> None:
+        time.sleep(0.01)  # NOTE: let the concurrent spawns overlap
+        self.started.append(self)
+
+    def stop(self) -> None:
+        self.stopped.append(self)
+
+    def reset(self) -> None:
+        self.n_resets += 1
+
+
+class _FailingInstaller:
+    def prewarm(self, box, modules) -> bool:
+        raise RuntimeError("index not reachable")
+
+
+@pytest.fixture(autouse=True)
+def fake_box(monkeypatch):
+    _FakeBox.started, _FakeBox.stopped = [], []
+    monkeypatch.setattr(pool_module, "CustomLocalBox", _FakeBox)
+    monkeypatch.setattr(pool_module, "is_port_in_use", lambda port: port == 7801)
+    # NOTE: refill in the foreground to keep the pool state deterministic
+    monkeypatch.setattr(CodeBoxPool, "_fill_async", CodeBoxPool._fill)
+    return _FakeBox
+
+
+def test_start_skips_the_ports_in_use(tmp_path):
+    pool = CodeBoxPool(size=2, port_range=(7801, 7810), workdir_root=str(tmp_path))
+    pool.start()
+    assert pool.stats()["ports"] == [7802, 7803]
+    assert all(box.fixed_port for box in _FakeBox.started)
+
+
+def test_concurrent_spawns_reserve_distinct_ports(tmp_path):
+    pool = CodeBoxPool(size=0, max_size=8, workdir_root=str(tmp_path))
+    boxes = []
+    threads = [
+        threading.Thread(target=lambda: boxes.append(pool.lease())) for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({box.port for box in boxes}) == 6
+
+
+def test_release_resets_and_reuses_the_box(tmp_path):
+    pool = CodeBoxPool(size=1, workdir_root=str(tmp_path)).start()
+    box = pool.lease()
+    pool.release(box)
+    assert box.n_resets == 1
+    assert pool.stats() == dict(idle=2, leased=0, starting=0, ports=[7802, 7803])
+
+
+def test_prewarm_failure_stops_the_started_box(tmp_path):
+    pool = CodeBoxPool(
+        size=0,
+        workdir_root=str(tmp_path),
+        prewarm_packages=["sklearn"],
+        installer=_FailingInstaller(),
+    )
+    with pytest.raises(RuntimeError):
+        pool.lease()
+    assert _FakeBox.stopped == _FakeBox.started
+    assert pool.stats() == dict(idle=0, leased=0, starting=0, ports=[])
+
+
+def test_evict_idle_stops_only_the_evicted_boxes(tmp_path):
+    pool = CodeBoxPool(size=1, idle_timeout=0, workdir_root=str(tmp_path))
+    boxes = [pool.lease(), pool.lease()]
+    for box in boxes:
+        pool.release(box, reset=False)
+    (kept,) = [pb.box for pb in pool._idle]
+    assert len(_FakeBox.stopped) == 2
+    assert kept not in _FakeBox.stopped
+    assert pool.stats()["ports"] == [kept.port]
+
+
+def test_idle_kernels_are_evicted_without_traffic(tmp_path):
+    pool = CodeBoxPool(
+        size=0, idle_timeout=0.05, evict_interval=0.01, workdir_root=str(tmp_path)
+    )
+    box = pool.lease()
+    pool.release(box, reset=False)
+    assert _FakeBox.stopped == []
+
+    deadline = time.monotonic() + 5
+    while not _FakeBox.stopped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.stop()
+    assert _FakeBox.stopped == [box]
+    assert pool.stats() == dict(idle=0, leased=0, starting=0, ports=[])
+
+
+def test_ports_are_probed_outside_the_lock(tmp_path, monkeypatch):
+    pool = CodeBoxPool(size=0, workdir_root=str(tmp_path))
+    n_blocked = []
+
+    def is_port_in_use(port: int) -> bool:
+        # NOTE: the pool is usable by the other threads while probing
+        thread = threading.Thread(target=pool.stats)
+        thread.start()
+        thread.join(timeout=1)
+        n_blocked.append(thread.is_alive())
+        return port == 7801
+
+    monkeypatch.setattr(pool_module, "is_port_in_use", is_port_in_use)
+    assert pool.lease().port == 7802
+    assert n_blocked == [False, False]
@@ -0,0 +1,56 @@
+import os
+
+from app.codebox.snapshot import DirectorySnapshot
+
+
+def _write(path, content: str, mtime_ns: int = 1_000_000_000) -> None:
+    path.write_text(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_diff_lists_the_created_and_modified_files(tmp_path):
+    _write(tmp_path / "kept.csv", "a")
+    _write(tmp_path / "modified.csv", "a")
+    before = DirectorySnapshot.take(str(tmp_path))
+
+    _write(tmp_path / "modified.csv", "ab")
+    (tmp_path / "plots").mkdir()
+    _write(tmp_path / "plots" / "new.png", "png")
+    after = DirectorySnapshot.take(str(tmp_path))
+
+    assert before.diff(after) == sorted(
+        ["modified.csv", os.path.join("plots", "new.png")]
+    )
+
+
+def test_deleted_files_are_not_listed(tmp_path):
+    _write(tmp_path / "removed.csv", "a")
+    before = DirectorySnapshot.take(str(tmp_path))
+    os.remove(tmp_path / "removed.csv")
+    assert before.diff(DirectorySnapshot.take(str(tmp_path))) == []
+
+
+def test_touched_file_is_unchanged_by_the_content_hash(tmp_path):
+    _write(tmp_path / "data.csv", "a")
+    before = DirectorySnapshot.take(str(tmp_path), hash_content=True)
+    _write(tmp_path / "data.csv", "a", mtime_ns=2_000_000_000)
+
+    assert before.diff(DirectorySnapshot.take(str(tmp_path))) == ["data.csv"]
+    after = DirectorySnapshot.take(str(tmp_path), hash_content=True, prev=before)
+    assert before.diff(after) == []
+
+
+def test_content_hash_is_reused_while_untouched(tmp_path, monkeypatch):
+    _write(tmp_path / "data.csv", "a")
+    before = DirectorySnapshot.take(str(tmp_path), hash_content=True)
+
+    def _open(*args, **kwargs):
+        raise AssertionError("the file is read again")
+
+    monkeypatch.setattr("builtins.open", _open)
+    after = DirectorySnapshot.take(str(tmp_path), hash_content=True, prev=before)
+    assert after.files["data.csv"].digest == before.files["data.csv"].digest
+
+
+def test_missing_root_is_empty(tmp_path):
+    assert DirectorySnapshot.take(str(tmp_path / "missing")).files == {}
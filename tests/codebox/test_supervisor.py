@@ -0,0 +1,133 @@
+import json
+import time
+
+import pytest
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox import supervisor as supervisor_module
+from app.codebox.supervisor import KernelSupervisor, ResourceLimits
+
+_KERNEL_DIED = CodeBoxOutput(
+    type="error", content="KernelDied: the kernel died and got restarted"
+)
+
+
+class _FakeBox:
+    def __init__(self, output: CodeBoxOutput, state: str = "idle", wait=None) -> None:
+        self.kernel_id = "kernel"
+        self.output = output
+        self.state = state
+        self.wait = wait  # NOTE: returns once the cell would finish
+        self.calls: list[str] = []
+
+    def run_stream(self, code, on_output=None, timeout=None) -> CodeBoxOutput:
+        if code == "import os; print(os.getpid())":
+            return CodeBoxOutput(type="text", content="4242\n")
+        if self.wait is not None:
+            self.wait()
+        return self.output
+
+    def execution_state(self) -> str:
+        return self.state
+
+    def restart_kernel(self) -> None:
+        self.calls.append("restart_kernel")
+
+    def _drain(self) -> None:
+        self.calls.append("drain")
+
+    def _setup_kernel(self) -> None:
+        self.calls.append("setup_kernel")
+
+
+class _FakeResource:
+    RLIMIT_AS, RLIMIT_CPU, RLIM_INFINITY = 9, 0, -1
+
+    def __init__(self) -> None:
+        self.limits: dict = {}
+
+    def prlimit(self, pid, kind, limits=None):
+        if limits is not None:
+            self.limits[kind] = limits
+        return (self.RLIM_INFINITY, self.RLIM_INFINITY)
+
+
+@pytest.fixture
+def fake_resource(monkeypatch) -> _FakeResource:
+    fake = _FakeResource()
+    monkeypatch.setattr(supervisor_module, "resource", fake)
+    return fake
+
+
+def _observation(output: CodeBoxOutput) -> dict:
+    assert output.type == "error"
+    return json.loads(output.content)
+
+
+def _wait_until(condition) -> None:
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize(
+    "state, action, calls",
+    [("idle", "interrupted", []), ("busy", "restarted", ["restart_kernel"])],
+)
+def test_timeout(state: str, action: str, calls: list):
+    box = _FakeBox(CodeBoxOutput(type="error", content="TimeoutError: 1s"), state)
+    supervisor = KernelSupervisor(ResourceLimits(timeout=1))
+
+    observation = _observation(supervisor.run(box, "while True: pass"))
+    assert (observation["kind"], observation["action"]) == ("timeout", action)
+    assert box.calls == calls
+    assert ("note" in observation) == (action == "restarted")
+
+
+def test_memory_watchdog_kills_the_kernel(monkeypatch):
+    killed = []
+    monkeypatch.setattr(supervisor_module, "_read_rss", lambda pid: 2048)
+    monkeypatch.setattr(supervisor_module, "_read_cpu_seconds", lambda pid: 1.0)
+    monkeypatch.setattr(supervisor_module.os, "kill", lambda *args: killed.append(args))
+    box = _FakeBox(_KERNEL_DIED, wait=lambda: _wait_until(lambda: killed))
+    limits = ResourceLimits(max_memory_bytes=1024, poll_interval=0.01)
+
+    observation = _observation(KernelSupervisor(limits).run(box, "x = [0] * 10**9"))
+    assert killed == [(4242, supervisor_module.signal.SIGKILL)]
+    assert (observation["kind"], observation["action"]) == ("memory", "restarted")
+    assert observation["detail"] == "RSS reached 2048 bytes"
+    assert box.calls == ["drain", "setup_kernel"]
+
+
+def test_memory_error_by_the_address_space_limit(fake_resource):
+    box = _FakeBox(CodeBoxOutput(type="error", content="MemoryError: "))
+    limits = ResourceLimits(max_address_space_bytes=1 << 30)
+
+    observation = _observation(KernelSupervisor(limits).run(box, "x = [0] * 10**9"))
+    assert (observation["kind"], observation["action"]) == ("memory", "interrupted")
+    assert fake_resource.limits[_FakeResource.RLIMIT_AS] == (1 << 30, -1)
+
+
+@pytest.mark.parametrize("cpu_after, kind", [(15.0, "cpu"), (10.5, "kernel_died")])
+def test_kernel_died_is_cpu_only_at_the_budget(
+    monkeypatch, fake_resource, cpu_after: float, kind: str
+):
+    cpu_seconds = [10.0]
+    monkeypatch.setattr(
+        supervisor_module, "_read_cpu_seconds", lambda pid: cpu_seconds[0]
+    )
+
+    def _run_cell() -> None:
+        cpu_seconds[0] = cpu_after
+        time.sleep(0.05)  # NOTE: let the watchdog read it
+
+    box = _FakeBox(_KERNEL_DIED, wait=_run_cell)
+    limits = ResourceLimits(max_cpu_seconds=5, poll_interval=0.01)
+
+    observation = _observation(KernelSupervisor(limits).run(box, "segfault()"))
+    assert fake_resource.limits[_FakeResource.RLIMIT_CPU] == (15, -1)
+    assert (observation["kind"], observation["action"]) == (kind, "restarted")
+
+
+def test_limits_are_not_shared_by_default():
+    assert KernelSupervisor().limits is not KernelSupervisor().limits
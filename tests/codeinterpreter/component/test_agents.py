@@ -0,0 +1,165 @@
+import json
+
+import pytest
+from langchain.agents import BaseMultiActionAgent, BaseSingleActionAgent
+from langchain.chat_models import ChatOpenAI
+from langchain.prompts.chat import MessagesPlaceholder
+from langchain.schema import OutputParserException
+from langchain.schema.messages import (
+    AIMessage,
+    FunctionMessage,
+    HumanMessage,
+    SystemMessage,
+)
+
+from app.codeinterpreter.component.llm.agents import (
+    OpenAIFunctionsAgent,
+    OpenAIMultiFunctionsAgent,
+    _format_intermediate_steps,
+    _parse_ai_message_multi,
+)
+
+
+def _create_agent(cls=OpenAIFunctionsAgent, **kwargs) -> OpenAIFunctionsAgent:
+    return cls.from_llm_and_tools(
+        llm=ChatOpenAI(openai_api_key="sk-test"), tools=[], **kwargs
+    )
+
+
+def _tool_selection(actions) -> AIMessage:
+    arguments = json.dumps({"actions": actions})
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "function_call": {"name": "tool_selection", "arguments": arguments}
+        },
+    )
+
+
+def test_context_is_sent_after_the_input_on_each_call():
+    contexts = iter(["df: DataFrame (2, 2)", "df: DataFrame (3, 2)"])
+    agent = _create_agent(context_provider=lambda: next(contexts))
+
+    for context in ["df: DataFrame (2, 2)", "df: DataFrame (3, 2)"]:
+        messages = agent._build_messages([], input="plot df")
+        assert messages[-2:] == [
+            HumanMessage(content="plot df"),
+            SystemMessage(content=context),
+        ]
+
+
+def test_empty_context_is_not_sent():
+    agent = _create_agent(context_provider=lambda: "")
+    assert agent._build_messages([], input="hi")[-1] == HumanMessage(content="hi")
+
+
+def test_agent_action_types():
+    assert isinstance(_create_agent(), BaseSingleActionAgent)
+    assert isinstance(_create_agent(OpenAIMultiFunctionsAgent), BaseMultiActionAgent)
+
+
+@pytest.mark.parametrize(
+    "actions",
+    [
+        [{"action": {"code": "1"}}],
+        [{"action_name": "python"}],
+        [{"action_name": "python", "action": "1"}],
+        ["python"],
+        {"action_name": "python", "action": {"code": "1"}},
+    ],
+)
+def test_malformed_tool_selection(actions):
+    with pytest.raises(OutputParserException):
+        _parse_ai_message_multi(_tool_selection(actions))
+
+
+def test_parallel_actions_share_the_message_log():
+    message = _tool_selection(
+        [
+            {"action_name": "python", "action": {"code": "1"}},
+            {"action_name": "python", "action": {"code": "2"}},
+        ]
+    )
+    actions = _parse_ai_message_multi(message)
+    assert [action.tool_input for action in actions] == [{"code": "1"}, {"code": "2"}]
+
+    agent = _create_agent(OpenAIMultiFunctionsAgent)
+    scratchpad = agent._format_scratchpad([(actions[0], "1"), (actions[1], "2")])
+    assert scratchpad == [
+        message,
+        FunctionMessage(name="python", content="1"),
+        FunctionMessage(name="python", content="2"),
+    ]
+
+
+def _step(i: int):
+    message = AIMessage(
+        content="",
+        additional_kwargs={
+            "function_call": {"name": "python", "arguments": f'{{"code": "{i}"}}'}
+        },
+    )
+    action = _parse_ai_message_multi(message)[0]
+    return action, str(i)
+
+
+def _memory_agent() -> OpenAIFunctionsAgent:
+    return _create_agent(
+        extra_prompt_messages=[MessagesPlaceholder(variable_name="chat_history")]
+    )
+
+
+def test_prefix_follows_the_edited_chat_history():
+    agent = _memory_agent()
+    history = [HumanMessage(content="hi"), AIMessage(content="hello")]
+    assert agent._format_prefix(input="x", chat_history=history)[2].content == "hello"
+
+    # NOTE: the same list of the same length, edited in place
+    history[1] = AIMessage(content="bye")
+    assert agent._format_prefix(input="x", chat_history=history)[2].content == "bye"
+
+
+def test_prefix_is_reused_for_the_same_messages():
+    agent = _memory_agent()
+    history = [HumanMessage(content="hi")]
+    prefix = agent._format_prefix(input="x", chat_history=history)
+    assert agent._format_prefix(input="x", chat_history=list(history)) is prefix
+
+    history.append(AIMessage(content="hello"))
+    assert agent._format_prefix(input="x", chat_history=history) is not prefix
+    assert agent._format_prefix(input="y", chat_history=history)[-1].content == "y"
+
+
+def test_concurrent_runs_keep_their_own_scratchpads():
+    agent = _create_agent()
+    steps_a, steps_b = [_step(0)], [_step(10), _step(11)]
+    for _ in range(2):
+        assert agent._format_scratchpad(steps_a) == _format_intermediate_steps(steps_a)
+        assert agent._format_scratchpad(steps_b) == _format_intermediate_steps(steps_b)
+        steps_a.append(_step(len(steps_a)))
+
+
+def test_scratchpad_is_reconverted_once_the_steps_are_replaced():
+    agent = _create_agent()
+    steps = [_step(0), _step(1)]
+    agent._format_scratchpad(steps)
+    steps[1] = _step(2)
+    assert agent._format_scratchpad(steps) == _format_intermediate_steps(steps)
+    del steps[1:]
+    assert agent._format_scratchpad(steps) == _format_intermediate_steps(steps)
+
+
+def test_sequential_steps_keep_their_own_message_logs():
+    steps = [_step(0), _step(1)]
+    assert _format_intermediate_steps(steps) == [
+        steps[0][0].message_log[0],
+        FunctionMessage(name="python", content="0"),
+        steps[1][0].message_log[0],
+        FunctionMessage(name="python", content="1"),
+    ]
+
+
+def test_equal_message_logs_are_not_merged():
+    # NOTE: e.g. the same call made twice, the logs are equal but not shared
+    steps = [_step(0), _step(0)]
+    assert len(_format_intermediate_steps(steps)) == 4
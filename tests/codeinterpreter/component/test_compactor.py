@@ -0,0 +1,81 @@
+import pytest
+
+from app.codeinterpreter.component.llm.compactor import (
+    ObservationCompactor,
+    dedup_tracebacks,
+    truncate_bytes,
+    truncate_tables,
+)
+
+_TRACEBACK = (
+    "Traceback (most recent call last):\n"
+    '  File "<cell>", line 2, in <module>\n'
+    "ZeroDivisionError: division by zero"
+)
+
+
+def test_identical_tracebacks_are_dropped():
+    text = "\n".join([_TRACEBACK, "retrying", _TRACEBACK, "retrying", _TRACEBACK])
+    deduped = dedup_tracebacks(text)
+    assert deduped.count("ZeroDivisionError") == 1
+    assert deduped.endswith("[2 identical tracebacks omitted]")
+
+
+def test_repeated_lines_are_collapsed():
+    text = "\n".join(["start"] + ["warning: slow"] * 5 + ["done"])
+    assert dedup_tracebacks(text).split("\n") == [
+        "start",
+        "warning: slow",
+        "[Previous line repeated 4 more times]",
+        "done",
+    ]
+
+
+def test_long_table_keeps_the_header_head_and_tail():
+    rows = [f"{i}  {i * 2}  {i * 3}" for i in range(30)]
+    text = "\n".join(["   a  b", *rows, "[30 rows x 2 columns]"])
+    lines = truncate_tables(text, max_rows=3).split("\n")
+    assert lines == [
+        "   a  b",
+        *rows[:3],
+        "... [24 rows omitted]",
+        *rows[-3:],
+        "[30 rows x 2 columns]",
+    ]
+
+
+def test_short_text_is_not_truncated():
+    assert truncate_tables("a b\n1 2", max_rows=3) == "a b\n1 2"
+    assert truncate_bytes("short", max_bytes=100) == "short"
+
+
+def test_truncate_bytes_cuts_at_the_line_boundaries():
+    text = "\n".join(f"line {i}" for i in range(100))
+    truncated = truncate_bytes(text, max_bytes=100, head_ratio=0.3)
+    assert truncated.startswith("line 0\n")
+    assert truncated.endswith("line 99")
+    assert all(
+        line.startswith("line ") or line.startswith("[... ")
+        for line in truncated.split("\n")
+    )
+    assert len(truncated.encode("utf-8")) < len(text.encode("utf-8"))
+
+
+def test_truncate_bytes_does_not_split_the_characters():
+    truncated = truncate_bytes("あ" * 100, max_bytes=50)
+    assert "�" not in truncated
+    assert truncated.startswith("あ") and truncated.endswith("あ")
+
+
+@pytest.mark.parametrize("max_tokens", [50, 200])
+def test_compact_fits_the_token_budget(max_tokens: int):
+    compactor = ObservationCompactor(max_bytes=100_000, max_tokens=max_tokens)
+    text = "\n".join(f"value {i}: {'x' * i}" for i in range(200))
+    compacted = compactor(text)
+    assert compactor.count_tokens(compacted) <= max_tokens
+    assert compacted.startswith("value 0")
+
+
+def test_compact_without_token_budget():
+    compactor = ObservationCompactor(max_bytes=100, max_tokens=None)
+    assert len(compactor("x\n" * 1000).encode("utf-8")) < 200
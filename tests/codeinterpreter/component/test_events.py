@@ -0,0 +1,37 @@
+import asyncio
+
+from langchain.chat_models import ChatOpenAI
+from langchain.schema.messages import HumanMessage
+
+from app.codeinterpreter.component.events import EventCallbackHandler, ResponseEvent
+from app.codeinterpreter.component.llm.client_registry import LLMClientRegistry
+from app.codeinterpreter.component.llm.llm_builder import buildup_llm
+
+
+def test_handler_emits_llm_start_before_the_tokens():
+    events: list[ResponseEvent] = []
+    handler = EventCallbackHandler(events.append)
+
+    async def _run() -> None:
+        for _ in range(2):
+            await handler.on_chat_model_start({}, [[HumanMessage(content="hi")]])
+            await handler.on_llm_new_token("Hel")
+            await handler.on_llm_new_token("lo")
+
+    asyncio.run(_run())
+    assert [(e.type, e.content) for e in events] == [
+        ("llm_start", None),
+        ("token", "Hel"),
+        ("token", "lo"),
+    ] * 2
+
+
+def test_buildup_llm_streams_the_tokens_if_asked():
+    registry = LLMClientRegistry()
+    llm = buildup_llm(openai_api_key="sk-test", client_registry=registry)
+    streaming_llm = buildup_llm(
+        openai_api_key="sk-test", client_registry=registry, streaming=True
+    )
+    assert isinstance(streaming_llm, ChatOpenAI)
+    assert not llm.streaming
+    assert streaming_llm.streaming
@@ -0,0 +1,119 @@
+import json
+
+import pytest
+from langchain.schema.messages import AIMessageChunk
+
+from app.codeinterpreter.component.llm.agents import _parse_ai_message
+from app.codeinterpreter.component.llm.function_call_parser import (
+    StreamingFunctionCallParser,
+)
+
+_CODE = 'import pandas as pd\nprint("caf\\u00e9\\n")\n'
+
+
+def _stream(arguments: str, size: int):
+    parser = StreamingFunctionCallParser()
+    parser.feed(function_call={"name": "python"})
+    for i in range(0, len(arguments), size):
+        parser.feed(function_call={"arguments": arguments[i : i + size]})
+        yield parser
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_code_is_decoded_while_streamed(size: int):
+    arguments = json.dumps({"code": _CODE})
+    codes = [parser.code for parser in _stream(arguments, size)]
+    # NOTE: the code only grows, even with an escape sequence cut in the middle
+    assert all(_CODE.startswith(code) for code in codes)
+    assert codes[-1] == _CODE
+
+
+def test_new_lines_are_returned_once():
+    arguments = json.dumps({"code": _CODE})
+    lines = [line for parser in _stream(arguments, 4) for line in parser.new_lines()]
+    assert lines == _CODE.split("\n")[:-1]
+
+
+def test_raw_code_arguments():
+    *_, parser = _stream("print(1)\nx = 2", 5)
+    assert parser.code == "print(1)\nx = 2"
+    assert parser.complete_lines == ["print(1)"]
+
+
+def test_not_the_code_tool():
+    parser = StreamingFunctionCallParser()
+    parser.feed(function_call={"name": "search", "arguments": '{"code": "x"}'})
+    assert parser.code == ""
+
+
+def test_incomplete_statement_is_not_a_syntax_error():
+    *_, parser = _stream(json.dumps({"code": "for i in range(3):\n"}), 100)
+    assert parser.check_syntax() is None
+    *_, parser = _stream(json.dumps({"code": "x = = 1\n"}), 100)
+    assert isinstance(parser.check_syntax(), SyntaxError)
+
+
+def test_to_message_parses_as_the_unstreamed_message():
+    parser = StreamingFunctionCallParser()
+    arguments = json.dumps({"code": _CODE})
+    for chunk in [
+        AIMessageChunk(content="Let me "),
+        AIMessageChunk(content="check."),
+        AIMessageChunk(
+            content="", additional_kwargs={"function_call": {"name": "python"}}
+        ),
+        AIMessageChunk(
+            content="",
+            additional_kwargs={"function_call": {"arguments": arguments[:10]}},
+        ),
+        AIMessageChunk(
+            content="",
+            additional_kwargs={"function_call": {"arguments": arguments[10:]}},
+        ),
+    ]:
+        parser.feed_chunk(chunk)
+
+    message = parser.to_message()
+    assert message.content == "Let me check."
+    action = _parse_ai_message(message)
+    assert action.tool == "python"
+    assert action.tool_input == {"code": _CODE}
+
+
+def test_plain_answer_has_no_function_call():
+    parser = StreamingFunctionCallParser()
+    parser.feed("done")
+    assert not parser.is_function_call
+    assert parser.to_message().additional_kwargs == {}
+
+
+def test_split_surrogate_pair_is_decoded_once_complete():
+    arguments = json.dumps({"code": "x = '😀'\n"})
+    codes = [parser.code for parser in _stream(arguments, 1)]
+    assert "\ud83d" not in "".join(codes)
+    assert codes[-1] == "x = '😀'\n"
+
+
+def test_syntax_error_line_after_the_checked_statements():
+    code = "x = 1\nif x:\n    y = 2\nelse:\n    y = 3\n" * 20 + "x = = 1\n"
+    errors = [
+        parser.check_syntax()
+        for parser in _stream(json.dumps({"code": code}), 4)
+        if parser.new_lines()
+    ]
+    assert errors[:-1] == [None] * (len(errors) - 1)
+    assert errors[-1].lineno == 101
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "try:\n    x\nexcept NameError:\n    pass\nfinally:\n    pass\n",
+        "def f():\n    x = 1\n# comment\n    return x\n",
+        "s = '''\nnot = = code\n'''\n",
+        "@decorator\ndef f():\n    pass\n",
+    ],
+)
+def test_statements_continued_at_the_top_level(code: str):
+    for parser in _stream(json.dumps({"code": code}), 2):
+        assert parser.check_syntax() is None
@@ -0,0 +1,21 @@
+import asyncio
+import inspect
+
+from app.codeinterpreter.component.interprete_async import CodeInterpreterAsync
+from app.codeinterpreter.component.llm.schema import CodeInterpreterResponse
+
+
+def test_generate_response_is_async_and_delegates(monkeypatch):
+    calls = []
+
+    async def agenerate_response(self, user_msg, files=[]):
+        calls.append((user_msg, files))
+        return CodeInterpreterResponse(content="done")
+
+    monkeypatch.setattr(CodeInterpreterAsync, "agenerate_response", agenerate_response)
+    interpreter = CodeInterpreterAsync.__new__(CodeInterpreterAsync)
+
+    assert inspect.iscoroutinefunction(CodeInterpreterAsync.generate_response)
+    response = asyncio.run(interpreter.generate_response("hi", detailed_error=True))
+    assert response.content == "done"
+    assert calls == [("hi", [])]
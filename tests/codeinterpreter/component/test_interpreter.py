@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+
+import pytest
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codebox import snapshot as snapshot_module
+from app.codebox.snapshot import DirectorySnapshot
+from app.codeinterpreter.component import interpreter as interpreter_module
+from app.codeinterpreter.component.interpreter import CodeInterpreter
+
+
+def _create_interpreter() -> CodeInterpreter:
+    interpreter = CodeInterpreter.__new__(CodeInterpreter)
+    interpreter._cell_lock = threading.Lock()
+    interpreter._acell_locks = weakref.WeakKeyDictionary()
+    return interpreter
+
+
+def test_parallel_cells_run_one_by_one(monkeypatch):
+    interpreter, running, overlaps = _create_interpreter(), [], []
+
+    async def _arun_cell(self, code):
+        overlaps.append(bool(running))
+        running.append(code)
+        await asyncio.sleep(0.01)
+        running.remove(code)
+        return code
+
+    monkeypatch.setattr(CodeInterpreter, "_arun_cell", _arun_cell)
+
+    async def _run():
+        return await asyncio.gather(
+            *[interpreter._arun_handler(str(i)) for i in range(4)]
+        )
+
+    assert asyncio.run(_run()) == ["0", "1", "2", "3"]
+    assert overlaps == [False] * 4
+
+
+def test_cancelled_wait_does_not_keep_the_lock(monkeypatch):
+    interpreter = _create_interpreter()
+
+    async def _arun_cell(self, code):
+        return code
+
+    monkeypatch.setattr(CodeInterpreter, "_arun_cell", _arun_cell)
+
+    async def _run():
+        # NOTE: e.g. a checkpoint is being saved on another thread
+        interpreter._cell_lock.acquire()
+        task = asyncio.create_task(interpreter._arun_handler("1"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        interpreter._cell_lock.release()
+        await asyncio.sleep(0.05)
+        return await asyncio.wait_for(interpreter._arun_handler("2"), timeout=5)
+
+    assert asyncio.run(_run()) == "2"
+    assert not interpreter._cell_lock.locked()
+
+
+class _WorkdirBox:
+    def __init__(self, workdir: str) -> None:
+        self.workdir = workdir
+
+    def snapshot(self, hash_content=False, prev=None) -> DirectorySnapshot:
+        return DirectorySnapshot.take(self.workdir, hash_content, prev)
+
+
+def test_cells_reuse_the_hashes_of_the_untouched_files(tmp_path, monkeypatch):
+    for i in range(3):
+        (tmp_path / f"data_{i}.csv").write_text("a,b\n1,2\n")
+    interpreter = _create_interpreter()
+    interpreter.__dict__.update(
+        codebox=_WorkdirBox(str(tmp_path)),
+        hash_content=True,
+        detect_modifications_by_llm=False,
+        _workdir_snapshot=None,
+        preflight=None,
+        memoizer=None,
+        introspector=None,
+        supervisor=type("Supervisor", (), {"violations": []})(),
+        code_log=[],
+        log_handler=lambda text, is_code=False: None,
+        _event_queue=None,
+        input_file_names=[],
+        max_transfer_concurrency=1,
+        bundle_transfer=False,
+        blob_store=None,
+        blob_digests=[],
+        output_files=[],
+    )
+
+    def _run_installing(self, code):
+        (tmp_path / "plot.png").write_text(code)
+        return CodeBoxOutput(type="text", content="done")
+
+    async def adownload_files(codebox, file_names, **kwargs):
+        downloaded.append(file_names)
+        return []
+
+    n_hashed, downloaded = [], []
+    sha256 = hashlib.sha256
+    monkeypatch.setattr(
+        snapshot_module.hashlib,
+        "sha256",
+        lambda *args: n_hashed.append(1) or sha256(*args),
+    )
+    monkeypatch.setattr(CodeInterpreter, "_run_installing", _run_installing)
+    monkeypatch.setattr(interpreter_module, "adownload_files", adownload_files)
+
+    asyncio.run(interpreter._arun_cell("1"))
+    # NOTE: the csv files hashed once, the plot after the cell
+    assert len(n_hashed) == 4
+    asyncio.run(interpreter._arun_cell("2"))
+    assert len(n_hashed) == 5
+    assert downloaded == [["plot.png"], ["plot.png"]]
+
+
+def _missing(module: str) -> CodeBoxOutput:
+    return CodeBoxOutput(
+        type="error", content=f"ModuleNotFoundError: No module named '{module}'"
+    )
+
+
+class _FakeSupervisor:
+    def __init__(self, *outputs: CodeBoxOutput) -> None:
+        self.outputs = list(outputs)
+
+    def run(self, box, code, on_output=None) -> CodeBoxOutput:
+        return self.outputs.pop(0)
+
+
+class _FakeInstaller:
+    def __init__(self, failing: set) -> None:
+        self.failing = failing
+
+    def install(self, box, modules) -> bool:
+        return not self.failing.intersection(modules)
+
+
+@pytest.mark.parametrize(
+    "outputs, failing, expected",
+    [
+        (["yaml"], {"yaml"}, "PyYAML could not be installed"),
+        (["yaml", "yaml", "yaml"], set(), "PyYAML got installed but yaml still cannot"),
+        (["yaml", "bs4", "sklearn"], set(), "sklearn is missing, the other"),
+    ],
+)
+def test_install_error_after_the_reruns(outputs, failing, expected):
+    interpreter = _create_interpreter()
+    interpreter.__dict__.update(
+        codebox=None,
+        supervisor=_FakeSupervisor(*[_missing(m) for m in outputs]),
+        package_installer=_FakeInstaller(failing),
+        max_install_reruns=2,
+        _event_queue=None,
+        log_handler=lambda text, is_code=False: None,
+        verbose=False,
+    )
+    output = interpreter._run_installing("import yaml")
+    content = asyncio.run(interpreter._aparse_output_files("", output, before=None))
+    assert expected in content
+
+
+def _count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_compactor_budget_is_counted_in_the_llm_tokens(monkeypatch):
+    model_names = []
+
+    def token_counter(model_name):
+        model_names.append(model_name)
+        return _count_words
+
+    monkeypatch.setattr(interpreter_module, "token_counter", token_counter)
+    monkeypatch.setattr(interpreter_module, "create_agent_executor", lambda **kw: kw)
+    interpreter = _create_interpreter()
+    interpreter.__dict__.update(
+        _count_llm_tokens=True,
+        tools=[],
+        max_iterations=1,
+        memory=None,
+        verbose=False,
+        parallel_tool_calls=False,
+        stream_code=False,
+    )
+    interpreter.update_llm(type("LLM", (), {"model_name": "gpt-4-0613"})())
+
+    compactor = interpreter.observation_compactor
+    assert model_names == ["gpt-4-0613"]
+    assert interpreter.agent_executor["compact_observation"] is compactor
+    # NOTE: 6000 bytes, within the budget if approximated by the bytes
+    observation = " ".join(["a"] * 3000)
+    compacted = compactor(observation)
+    assert compacted != observation
+    assert _count_words(compacted) <= compactor.max_tokens
+
+
+def test_given_compactor_is_kept(monkeypatch):
+    monkeypatch.setattr(interpreter_module, "create_agent_executor", lambda **kw: kw)
+    interpreter = _create_interpreter()
+    compactor = lambda text: text  # noqa: E731
+    interpreter.__dict__.update(
+        observation_compactor=compactor,
+        _count_llm_tokens=False,
+        tools=[],
+        max_iterations=1,
+        memory=None,
+        verbose=False,
+        parallel_tool_calls=False,
+        stream_code=False,
+    )
+    interpreter.update_llm(type("LLM", (), {"model": "claude-2"})())
+    assert interpreter.observation_compactor is compactor
@@ -0,0 +1,56 @@
+import pytest
+
+from app.codeinterpreter.component.link_rewriter import remove_download_links
+
+FILES = ["plot.png", "result.csv"]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (
+            "Here is the plot.\n\n![plot](sandbox:/mnt/data/plot.png)\n\nIt rises.",
+            "Here is the plot.\n\nIt rises.",
+        ),
+        (
+            "Saved it. You can download it [here](sandbox:/mnt/data/result.csv).",
+            "Saved it.",
+        ),
+        (
+            "The table is in [result.csv](result.csv).",
+            "The table is in result.csv.",
+        ),
+        (
+            "集計しました。[こちら](sandbox:/result.csv)からダウンロードできます。",
+            "集計しました。",
+        ),
+        (
+            "Done.\n\n[Download result.csv](sandbox:/mnt/data/result.csv)",
+            "Done.",
+        ),
+        (
+            "  - see [result.csv](sandbox:/result.csv) for details",
+            "  - see result.csv for details",
+        ),
+    ],
+)
+def test_removes_the_sandbox_links(text: str, expected: str):
+    assert remove_download_links(text, FILES) == expected
+
+
+def test_text_without_sandbox_links_is_unchanged():
+    text = "\n\nSee [the docs](https://example.com/docs).  \n\n\n\nBye.  \n"
+    assert remove_download_links(text, FILES) == text
+
+
+def test_code_blocks_are_unchanged():
+    text = (
+        "Run this:\n\n```python\nx = 1  \n\n\n# [plot](sandbox:/plot.png)\n```\n\n"
+        "~~~\n[result.csv](result.csv)\n~~~"
+    )
+    assert remove_download_links(text, FILES) == text
+
+
+def test_only_the_blank_lines_around_the_removed_links_are_squashed():
+    text = "A  \n\n\n\nB\n\n![plot](sandbox:/plot.png)\n\nC\n"
+    assert remove_download_links(text, FILES) == "A  \n\n\n\nB\n\nC\n"
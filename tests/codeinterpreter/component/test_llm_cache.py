@@ -0,0 +1,141 @@
+import langchain
+import pytest
+from langchain.schema import ChatGeneration
+from langchain.schema.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain.schema.output import ChatGenerationChunk
+
+from app.codeinterpreter.component.llm import llm_cache as llm_cache_module
+from app.codeinterpreter.component.llm.agents import OpenAIFunctionsAgent
+from app.codeinterpreter.component.llm.client_registry import LLMClientRegistry
+from app.codeinterpreter.component.llm.llm_builder import buildup_llm
+from app.codeinterpreter.component.llm.llm_cache import (
+    CachedChatOpenAI,
+    LLMResponseCache,
+    normalize_prompt,
+    set_llm_cache,
+)
+
+PROMPT = '[{"content": "plot df  \\n", "type": "human"}]'
+LLM_STRING = "gpt-4 temperature=0.03"
+
+
+def _generations(text: str) -> list:
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+@pytest.fixture
+def cache(tmp_path) -> LLMResponseCache:
+    return LLMResponseCache(path=str(tmp_path / "cache.db"), max_entries=2)
+
+
+def test_normalize_prompt_ignores_the_trailing_whitespaces():
+    assert normalize_prompt(PROMPT) == normalize_prompt(
+        '[{"type": "human", "content": "plot df"}]'
+    )
+    assert normalize_prompt("a  \nb\n") == "a\nb"
+
+
+def test_memory_hit_and_miss(cache: LLMResponseCache):
+    assert cache.lookup(PROMPT, LLM_STRING) is None
+    cache.update(PROMPT, LLM_STRING, _generations("done"))
+    assert cache.lookup(PROMPT, LLM_STRING)[0].text == "done"
+    assert cache.lookup(PROMPT, "gpt-3.5-turbo") is None
+    assert cache.stats()["n_memory_hits"] == 1
+    assert cache.stats()["n_misses"] == 2
+
+
+def test_disk_tier_is_shared_across_the_instances(cache: LLMResponseCache):
+    cache.update(PROMPT, LLM_STRING, _generations("done"))
+    other = LLMResponseCache(path=cache.path)
+    assert other.lookup(PROMPT, LLM_STRING)[0].text == "done"
+    assert other.stats()["n_disk_hits"] == 1
+
+
+def test_streamed_generations_are_cached(cache: LLMResponseCache):
+    chunk = ChatGenerationChunk(message=AIMessageChunk(content="streamed"))
+    cache.update(PROMPT, LLM_STRING, [chunk])
+    other = LLMResponseCache(path=cache.path)
+    assert other.lookup(PROMPT, LLM_STRING)[0].text == "streamed"
+
+
+def test_entries_expire_after_the_ttl(cache: LLMResponseCache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache_module.time, "time", lambda: now[0])
+    cache.update(PROMPT, LLM_STRING, _generations("done"))
+    now[0] += cache.ttl + 1
+    assert cache.lookup(PROMPT, LLM_STRING) is None
+    assert cache.stats()["n_expired"] == 2  # NOTE: in the memory and on the disk
+
+
+def test_memory_tier_evicts_the_least_recently_used(tmp_path):
+    cache = LLMResponseCache(path=None, max_entries=2)
+    for text in ["a", "b", "c"]:
+        cache.update(text, LLM_STRING, _generations(text))
+    assert cache.lookup("a", LLM_STRING) is None
+    assert cache.lookup("c", LLM_STRING)[0].text == "c"
+    assert cache.stats()["n_entries"] == 2
+
+
+def test_set_llm_cache_installs_the_global_cache(cache: LLMResponseCache):
+    previous = langchain.llm_cache
+    try:
+        set_llm_cache(cache)
+        assert langchain.llm_cache is cache
+    finally:
+        set_llm_cache(previous)
+
+
+@pytest.fixture
+def n_requests(monkeypatch) -> list:
+    """The streamed api requests of `CachedChatOpenAI`, answering a python call"""
+    n_requests = []
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        n_requests.append(1)
+        for kwargs in [{"name": "python"}, {"arguments": '{"code": "print(1)"}'}]:
+            message = AIMessageChunk(
+                content="", additional_kwargs={"function_call": kwargs}
+            )
+            yield ChatGenerationChunk(message=message)
+
+    monkeypatch.setattr(CachedChatOpenAI, "_stream", _stream)
+    return n_requests
+
+
+def _build_llm(llm_cache=None):
+    return buildup_llm(
+        openai_api_key="sk-test",
+        llm_cache=llm_cache,
+        client_registry=LLMClientRegistry(),
+        streaming=True,
+    )
+
+
+def test_cache_is_scoped_to_the_built_model(cache: LLMResponseCache, n_requests):
+    previous = langchain.llm_cache
+    llm, other = _build_llm(cache), _build_llm()
+    assert langchain.llm_cache is previous
+
+    messages = [HumanMessage(content="plot df")]
+    for model in [llm, llm, other, other]:
+        model.predict_messages(messages)
+    assert len(n_requests) == 3
+    assert cache.stats()["n_memory_hits"] == 1
+
+
+def test_streamed_plan_checks_and_fills_the_cache(cache: LLMResponseCache, n_requests):
+    codes = []
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=_build_llm(cache),
+        tools=[],
+        on_function_call_delta=lambda parser: codes.append(parser.code),
+    )
+    for _ in range(2):
+        action = agent.plan([], input="print 1")
+        assert action.tool_input == {"code": "print(1)"}
+    assert len(n_requests) == 1
+    assert codes[-1] == "print(1)"  # NOTE: the cached code is shown too
+
+    # NOTE: the same key as the unstreamed call
+    agent.llm.predict_messages(agent._build_messages([], input="print 1"), functions=[])
+    assert len(n_requests) == 1
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from codeboxapi.schema import CodeBoxOutput
+
+from app.codeinterpreter.component.memo import CellMemoizer
+
+
+class _FakeBox:
+    def __init__(self, workdir: str) -> None:
+        self.workdir = workdir
+        self.fingerprint = "state-1"
+        self.n_calls = 0
+
+    def run_function(self, source: str, *args, timeout: float) -> CodeBoxOutput:
+        self.n_calls += 1
+        return CodeBoxOutput(type="text", content=f"{self.fingerprint}\n")
+
+
+@pytest.fixture
+def box(tmp_path) -> _FakeBox:
+    (tmp_path / "data.csv").write_text("a,b\n1,2\n")
+    return _FakeBox(str(tmp_path))
+
+
+def test_pure_cell_key_follows_the_code_and_the_state(box: _FakeBox):
+    memoizer = CellMemoizer()
+    key = memoizer.key(box, "df.describe()")
+    assert key is not None
+    assert memoizer.key(box, "df.describe()  # summary") == key
+    assert memoizer.key(box, "df.head()") != key
+
+    box.fingerprint = "state-2"
+    assert memoizer.key(box, "df.describe()") != key
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "x = df.mean()",
+        "model.fit(X, y)",
+        "np.random.rand(3)",
+        "df.dropna(inplace=True)",
+        "%timeit df.mean()",
+        "pd.read_csv(path)",
+        "pd.read_csv(f'{name}.csv')",
+        "pd.read_csv(filepath_or_buffer='data.csv')",
+        "pd.read_csv('https://example.com/data.csv')",
+        "pd.read_csv('missing.csv')",
+    ],
+)
+def test_impure_cells_have_no_key(box: _FakeBox, code: str):
+    memoizer = CellMemoizer()
+    assert memoizer.key(box, code) is None
+    assert memoizer.stats()["n_impure"] == 1
+
+
+def test_read_file_is_fingerprinted(box: _FakeBox):
+    memoizer = CellMemoizer()
+    key = memoizer.key(box, "pd.read_csv('data.csv').describe()")
+    assert key is not None
+
+    with open(os.path.join(box.workdir, "data.csv"), "a") as f:
+        f.write("3,4\n")
+    assert memoizer.key(box, "pd.read_csv('data.csv').describe()") != key
+
+
+def _output(n_bytes: int) -> CodeBoxOutput:
+    return CodeBoxOutput(type="text", content="x" * n_bytes)
+
+
+def test_put_evicts_the_least_recently_used_over_the_limits():
+    memoizer = CellMemoizer(max_entries=3, max_bytes=10)
+    for key in "abc":
+        memoizer.put(key, _output(3))
+    assert memoizer.get("a") is not None
+    memoizer.put("d", _output(3))
+
+    assert memoizer.get("b") is None
+    assert memoizer.stats()["n_entries"] == 3
+    assert memoizer.total_bytes == 9
+
+
+def test_total_bytes_follows_the_replaced_entries():
+    memoizer = CellMemoizer(max_bytes=10)
+    memoizer.put("a", _output(4))
+    memoizer.put("a", _output(6))
+    memoizer.put("b", _output(4))
+    assert memoizer.total_bytes == 10
+    assert memoizer.get("a") is not None
+
+    memoizer.put("error", CodeBoxOutput(type="error", content="boom"))
+    assert memoizer.total_bytes == 10
+    memoizer.clear()
+    assert memoizer.total_bytes == 0
@@ -0,0 +1,85 @@
+import pytest
+
+from app.codeinterpreter.component.preflight import CodePreflight
+
+
+@pytest.fixture
+def preflight() -> CodePreflight:
+    preflight = CodePreflight()
+    preflight.reset(["pd"])
+    return preflight
+
+
+def test_trailing_question_mark_in_comment_is_not_help(preflight: CodePreflight):
+    code = "df = pd.DataFrame()  # is it empty?\nprint(df)"
+    assert preflight.check(code) is None
+
+
+@pytest.mark.parametrize("line", ["pd?", "pd.DataFrame??", "?pd", "%timeit 1", "!ls"])
+def test_help_and_magic_lines_are_masked(preflight: CodePreflight, line: str):
+    assert preflight.check(f"{line}\nprint(pd)") is None
+
+
+def test_undefined_name_at_module_level(preflight: CodePreflight):
+    error = preflight.check("x = 1\nprint(model)")
+    assert error.startswith("NameError: name 'model' is not defined (line 2)")
+    assert preflight.stats()["n_name_errors"] == 1
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "def f():\n    return model.predict(1)",
+        "async def f():\n    return await model.apredict(1)",
+        "class A:\n    x = model",
+        "f = lambda: model",
+        "if False:\n    print(model)",
+        "while False:\n    model.fit()",
+        "for i in []:\n    print(model)",
+        "try:\n    model\nexcept NameError:\n    model = None",
+        "x = model if False else 1",
+        "x = False and model",
+        "x = [model for _ in []]",
+    ],
+)
+def test_names_not_evaluated_at_module_level(preflight: CodePreflight, code: str):
+    assert preflight.check(code) is None
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "@decorator\ndef f():\n    pass",
+        "def f(x=default):\n    pass",
+        "class A(Base):\n    pass",
+        "if flag:\n    pass",
+        "for i in items:\n    pass",
+        "x = [i for i in items]",
+    ],
+)
+def test_names_evaluated_on_definition(preflight: CodePreflight, code: str):
+    assert preflight.check(code).startswith("NameError")
+
+
+def test_names_bound_by_earlier_cells(preflight: CodePreflight):
+    preflight.update("model = object()")
+    assert preflight.check("print(model)") is None
+
+
+def test_unknown_globals_skip_name_checks():
+    assert CodePreflight().check("print(model)") is None
+
+
+def test_banned_call_inside_function(preflight: CodePreflight):
+    error = preflight.check("import sys as s\ndef f():\n    s.exit(1)")
+    assert error.startswith("BannedCallError: `s.exit`")
+
+
+def test_syntax_error(preflight: CodePreflight):
+    error = preflight.check("print(1")
+    assert error.startswith("SyntaxError")
+    assert "the code was not executed" in error
+
+
+def test_magic_assignment_binds_names(preflight: CodePreflight):
+    assert preflight.check("files = !ls\nprint(files)") is None
@@ -0,0 +1,84 @@
+import gc
+import os
+
+import pytest
+
+from app.codeinterpreter.component.llm.schema import File, UserRequest
+
+
+@pytest.fixture
+def data_path(tmp_path) -> str:
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"a,b\n1,2\n")
+    return str(path)
+
+
+def test_dict_and_json_keep_the_content(data_path: str):
+    for file in [
+        File(name="data.csv", content=b"a,b\n1,2\n"),
+        File.from_path(data_path),
+        File.from_chunks("data.csv", [b"a,b\n", b"1,2\n"]),
+    ]:
+        assert file.dict()["content"] == b"a,b\n1,2\n"
+        assert '"content": "a,b\\n1,2\\n"' in file.json()
+        assert "content" not in file.dict(exclude={"content"})
+
+
+def test_nested_files_keep_the_content():
+    request = UserRequest(content="hi", files=[File(name="a.txt", content=b"a")])
+    assert request.dict()["files"] == [
+        dict(name="a.txt", path=None, digest=None, content=b"a")
+    ]
+
+
+def test_partially_consumed_chunks_are_backed_by_the_path():
+    file = File.from_chunks("data.bin", (bytes([i]) * 4 for i in range(4)))
+    chunks = file.iter_chunks()
+    assert next(chunks) == b"\x00" * 4
+    chunks.close()
+
+    assert file.path is not None
+    assert file.content == b"".join(bytes([i]) * 4 for i in range(4))
+
+
+def test_spooled_file_is_removed_with_the_file():
+    file = File.from_chunks("data.bin", [b"abc", b"def"])
+    assert b"".join(file.iter_chunks()) == b"abcdef"
+    copied = file.copy()
+    path = file.path
+
+    del file
+    gc.collect()
+    assert os.path.exists(path)
+    assert copied.content == b"abcdef"
+
+    del copied
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_downloaded_file_is_removed_with_the_file(monkeypatch):
+    import requests
+
+    class _Response:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self, chunk_size):
+            yield b"downloaded"
+
+    monkeypatch.setattr(requests, "get", lambda url, stream: _Response())
+    file = File.from_url("https://example.com/data.txt")
+    path = file.path
+    assert file.name == "data.txt"
+    assert file.content == b"downloaded"
+
+    del file
+    gc.collect()
+    assert not os.path.exists(path)
@@ -0,0 +1,13 @@
+from app.codeinterpreter.component.llm.client_registry import LLMClientRegistry
+from app.langchain.component.agent import agent_builder
+
+
+def test_llm_is_shared_through_the_registry(monkeypatch):
+    registry = LLMClientRegistry()
+    monkeypatch.setattr(agent_builder, "default_registry", registry)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+
+    llm = agent_builder._get_llm("gpt-3.5-turbo", 0)
+    assert agent_builder._get_llm("gpt-3.5-turbo", 0) is llm
+    assert agent_builder._get_llm("gpt-4", 0) is not llm
+    assert registry.stats() == dict(n_clients=1, n_models=2, n_created=2, n_reused=1)